@@ -0,0 +1,247 @@
+'''
+Staged build of simulation-ready map data from an OSM edge CSV, e.g.
+large_edge_data.csv -> fixed_large_dis_data.json. Stages, in order:
+    paths: each CSV row's geometry -> sections with climb, distance and
+        incline (elevation_pull.assemble_path_data), plus its nodes and osmid
+    stop_start: stopstart.classify_stop_start_edges -> each path's 'smooth' flag
+    discretise: discretising.discretise_all_sections, only when max_length is set
+    elevations: climb and incline of the sections discretising split, from the
+        elevations at their new end points
+Each stage's output is cached under a hash of its inputs: the previous
+stage's hash, the CSV rows it reads, its parameters and the elevation
+source's name, which identifies its data (a digest of a DEM's contents, an
+HTTP source's dataset URL).
+A rerun recomputes only the stages whose inputs changed. The paths stage is
+cached per chunk of CSV rows and runs its chunks across processes. Adding a
+district's edges to the end of the CSV only recomputes the chunks that hold
+the new rows.
+
+Elevations are fetched in bulk by the parent through a
+elevation_source.CachedElevation, so workers never touch the network, and no
+point is fetched twice across stages or builds.
+
+python -m data_collection.data_acquisition.build_pipeline edge_csv output_json [--max-length M] [--source google|opentopodata|dem] [--dem FILE] [--workers N]
+'''
+import argparse
+import hashlib
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+import pandas as pd
+import data_collection.data_acquisition.discretising as ds
+import data_collection.data_acquisition.elevation_pull as ep
+import data_collection.data_acquisition.elevation_source as es
+import data_collection.data_acquisition.stopstart as ss
+
+# Bump when a stage's output changes for the same inputs
+PIPELINE_VERSION = 1
+BUILD_CACHE_DIR = './data_collection/data/build_cache'
+STAGES = ('paths', 'stop_start', 'discretise', 'elevations')
+# CSV rows per cached, parallel chunk of the paths stage
+CHUNK_SIZE = 250
+# CSV columns the paths stage reads
+PATH_COLUMNS = ('u', 'v', 'osmid', 'geometry')
+
+
+def _hash(*parts) -> str:
+    digest = hashlib.sha256(f'pipeline-v{PIPELINE_VERSION}'.encode())
+    for part in parts:
+        digest.update(json.dumps(part, sort_keys=True).encode())
+        digest.update(b'\0')
+    return digest.hexdigest()
+
+
+def _file_hash(file_path: str) -> str:
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as file:
+        for chunk in iter(lambda: file.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _cache_path(cache_dir: str, stage: str, key: str) -> str:
+    return os.path.join(cache_dir, f'{stage}_{key[:16]}.json')
+
+
+def _load(cache_dir: str, stage: str, key: str):
+    file_path = _cache_path(cache_dir, stage, key)
+    if not os.path.exists(file_path):
+        return None
+    with open(file_path, 'r') as file:
+        return json.load(file)
+
+
+def _store(cache_dir: str, stage: str, key: str, output):
+    os.makedirs(cache_dir, exist_ok=True)
+    file_path = _cache_path(cache_dir, stage, key)
+    # Written under a temporary name so an interrupted write is never loaded
+    with open(file_path + '.tmp', 'w') as file:
+        json.dump(output, file)
+    os.replace(file_path + '.tmp', file_path)
+
+
+def _path_chunk(rows, elevations: dict) -> list:
+    # Path data of each row, with elevations from the parent's table
+    source = es.ElevationTable(elevations)
+    paths = []
+    for u, v, osmid, geometry in rows:
+        path_data = ep.assemble_path_data(geometry, source)
+        path_data['nodes'] = [u, v]
+        path_data['osmid'] = osmid
+        paths.append(path_data)
+    return paths
+
+
+def build_paths(rows, elevation_source, cache_dir: str, workers: int = None, chunk_size: int = CHUNK_SIZE) -> tuple:
+    '''
+    paths stage: one path dict per (u, v, osmid, geometry) row, in order.
+    Returns the paths, the stage hash and the number of chunks recomputed.
+    '''
+    chunks = [rows[i:i + chunk_size] for i in range(0, len(rows), chunk_size)]
+    keys = [_hash('paths', elevation_source.source.name, chunk) for chunk in chunks]
+    outputs = [_load(cache_dir, 'paths', key) for key in keys]
+    stale = [i for i, output in enumerate(outputs) if output is None]
+
+    if stale:
+        # Every point of the stale chunks in one bulk call, then a table per chunk
+        points = {
+            i: [(lat, lon) for row in chunks[i] for lon, lat in ep.pre_process_path(row[3]).values()]
+            for i in stale
+        }
+        elevation_source.elevations([point for i in stale for point in points[i]])
+        tables = {
+            i: {es.point_key(*point): value for point, value in zip(points[i], elevation_source.elevations(points[i]))}
+            for i in stale
+        }
+        if workers and workers > 1 and len(stale) > 1:
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                futures = {i: executor.submit(_path_chunk, chunks[i], tables[i]) for i in stale}
+                results = {i: future.result() for i, future in futures.items()}
+        else:
+            results = {i: _path_chunk(chunks[i], tables[i]) for i in stale}
+        for i in stale:
+            outputs[i] = results[i]
+            _store(cache_dir, 'paths', keys[i], results[i])
+
+    paths = [path for output in outputs for path in output]
+    return paths, _hash('paths', keys), len(stale)
+
+
+def add_stop_start(paths: list, edge_csv: str) -> list:
+    '''
+    stop_start stage: sets each path's 'smooth' flag, True where
+    classify_stop_start_edges finds no stop-start driving on its edge.
+    '''
+    flags = ss.classify_stop_start_edges(edge_csv)['has_stop_start'].tolist()
+    return [{**path, 'smooth': not bool(flag)} for path, flag in zip(paths, flags)]
+
+
+def fill_elevations(map_data: dict, elevation_source) -> dict:
+    '''
+    elevations stage: climb and avg_incline_angle of every section left
+    without them (climb False) by discretising, from the elevations at the
+    section's end points.
+    '''
+    pending = [
+        section for path in map_data.values() for key, section in path.items()
+        if 'section' in key and section['climb'] is False
+    ]
+    points = [point for section in pending for point in (
+        (section['coords'][1], section['coords'][0]), (section['coords'][3], section['coords'][2])
+    )]
+    elevations = elevation_source.elevations(points)
+    for i, section in enumerate(pending):
+        section['climb'] = elevations[2 * i + 1] - elevations[2 * i]
+        section['avg_incline_angle'] = ep.find_incline_angle(section['distance'], section['climb'])
+    return map_data
+
+
+def build_map_data(edge_csv: str, elevation_source, max_length: float = None, cache_dir: str = BUILD_CACHE_DIR,
+                   workers: int = None, chunk_size: int = CHUNK_SIZE) -> tuple:
+    '''
+    Runs the stages for edge_csv and returns the map data ({path_i: path},
+    in CSV order) and a report of each stage: whether it was recomputed and
+    its time. elevation_source: an elevation_source source; it is wrapped in
+    a CachedElevation if it isn't one.
+    '''
+    if not isinstance(elevation_source, es.CachedElevation):
+        elevation_source = es.CachedElevation(elevation_source)
+    report = {}
+
+    start = time.perf_counter()
+    df = pd.read_csv(edge_csv, dtype={'osmid': str})
+    rows = [[int(u), int(v), osmid, geometry] for u, v, osmid, geometry in df[list(PATH_COLUMNS)].itertuples(index=False)]
+    paths, key, recomputed = build_paths(rows, elevation_source, cache_dir, workers, chunk_size)
+    report['paths'] = {'chunks': -(-len(rows) // chunk_size), 'recomputed': recomputed, 'seconds': time.perf_counter() - start}
+
+    # The remaining stages are cached whole, each keyed on the one before
+    stages = [('stop_start', _file_hash(edge_csv), lambda data: add_stop_start(data, edge_csv))]
+    if max_length is not None:
+        stages.append(('discretise', max_length, lambda data: list(ds.discretise_all_sections(
+            {f'path{i + 1}': path for i, path in enumerate(data)}, max_length
+        ).values())))
+        stages.append(('elevations', elevation_source.source.name, lambda data: list(fill_elevations(
+            {f'path{i + 1}': path for i, path in enumerate(data)}, elevation_source
+        ).values())))
+    for stage, parameters, run in stages:
+        start = time.perf_counter()
+        key = _hash(stage, key, parameters)
+        output = _load(cache_dir, stage, key)
+        report[stage] = {'recomputed': output is None}
+        if output is None:
+            output = run(paths)
+            _store(cache_dir, stage, key, output)
+        paths = output
+        report[stage]['seconds'] = time.perf_counter() - start
+
+    return {f'path{i + 1}': path for i, path in enumerate(paths)}, report
+
+
+def elevation_source_for(name: str, dem_file: str = None, cache_file: str = es.ELEVATION_CACHE_FILE):
+    '''
+    Cached elevation source by name: 'google' (GOOGLE_API key), 'opentopodata' or 'dem' (dem_file).
+    '''
+    if name == 'google':
+        source = es.GoogleElevation(ep.API_KEY)
+    elif name == 'opentopodata':
+        source = es.OpenTopoData()
+    elif name == 'dem':
+        if dem_file is None:
+            raise ValueError("The dem source needs a DEM file")
+        source = es.DEMElevation.from_file(dem_file)
+    else:
+        raise ValueError(f"Unknown elevation source '{name}', expected google, opentopodata or dem")
+    return es.CachedElevation(source, cache_file)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Build map data from an OSM edge CSV.")
+    parser.add_argument('edge_csv')
+    parser.add_argument('output_json')
+    parser.add_argument('--max-length', type=float, default=None, help="discretise sections longer than this (m)")
+    parser.add_argument('--source', default='google', help="google, opentopodata or dem")
+    parser.add_argument('--dem', default=None, help="DEM GeoTIFF or .npz for --source dem")
+    parser.add_argument('--elevation-cache', default=es.ELEVATION_CACHE_FILE)
+    parser.add_argument('--cache-dir', default=BUILD_CACHE_DIR)
+    parser.add_argument('--workers', type=int, default=None, help="processes for the paths stage (default: all cores)")
+    parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE)
+    args = parser.parse_args(argv)
+
+    elevation_source = elevation_source_for(args.source, args.dem, args.elevation_cache)
+    map_data, report = build_map_data(
+        args.edge_csv, elevation_source, args.max_length, args.cache_dir,
+        args.workers or os.cpu_count() or 1, args.chunk_size
+    )
+    with open(args.output_json, 'w') as file:
+        json.dump(map_data, file, indent=2)
+    for stage, stats in report.items():
+        status = 'rebuilt' if stats.get('recomputed') else 'cached'
+        if stage == 'paths':
+            status = f"{stats['recomputed']}/{stats['chunks']} chunks rebuilt"
+        print(f"{stage}: {status} ({stats['seconds']:.1f}s)")
+    print(f"{len(map_data)} paths -> {args.output_json} ({elevation_source.fetched} elevations fetched)")
+
+
+if __name__ == '__main__':
+    main()
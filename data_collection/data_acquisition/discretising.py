@@ -1,10 +1,14 @@
 import math
+import numpy as np
+from models.road_network.compiled_map import CompiledMap, compile_map_data
 
 def discretise_all_sections(road_data, max_length=20.0):
     """
     Finds and replaces sections longer than max_length with multiple shorter sections.
     Works with data structure where sections are nested within paths.
-    Sets 'climb' to False for all newly created sections.
+    Sets 'climb' to False for all newly created sections, as placeholders for
+    elevations fetched at their new end points (see build_pipeline's elevations
+    stage). discretise_map splits without placeholders.
     
     Args:
         road_data: Dictionary containing paths, each containing sections
@@ -81,4 +85,78 @@ def discretise_all_sections(road_data, max_length=20.0):
         # Add the updated path to the new road data
         new_road_data[path_id] = new_path_content
     
-    return new_road_data
\ No newline at end of file
+    return new_road_data
+
+
+def discretise_map(map_data, max_length=20.0) -> CompiledMap:
+    """
+    Array version of discretise_all_sections over a CompiledMap (nested
+    map_data is compiled first). Every section longer than max_length is
+    split in one pass into ceil(distance / max_length) equal sub-sections with
+    the same coordinates and distances as discretise_all_sections, and its
+    names where they don't collide with a section already in the path (as
+    when re-discretising a discretised map).
+    Elevation is taken as linear along the section, so each sub-section gets
+    an equal share of the parent's climb and the parent's incline angle.
+    The input is left unchanged, so one loaded map can be discretised at
+    several max_lengths without reading the JSON again.
+
+    Args:
+        map_data: CompiledMap (e.g. compiled_map.load_map) or nested map_data
+        max_length: Maximum length of each section in meters
+
+    Returns:
+        CompiledMap with the split sections
+    """
+    compiled = map_data if isinstance(map_data, CompiledMap) else compile_map_data(map_data)
+    distance = compiled.distance
+    split = distance > max_length
+    counts = np.where(split, np.ceil(distance / max_length), 1).astype(np.int64)
+
+    # Parent section and position within it of every new section
+    parent = np.repeat(np.arange(len(distance)), counts)
+    starts = np.concatenate(([0], np.cumsum(counts)))
+    child = np.arange(starts[-1]) - starts[:-1][parent]
+    n = counts[parent]
+    is_split = split[parent]
+
+    coords = compiled.coords[parent]
+    start_ratio = (child / n)[:, None]
+    end_ratio = ((child + 1) / n)[:, None]
+    start_point, end_point = coords[:, :2], coords[:, 2:]
+    new_coords = np.concatenate((
+        start_point + start_ratio * (end_point - start_point),
+        start_point + end_ratio * (end_point - start_point),
+    ), axis=1)
+
+    # Sub-sections after the first are named <name>_<i> as in
+    # discretise_all_sections. An already discretised map can hold that name
+    # in the same path, so colliding names get a longer separator until every
+    # name in the path is unique
+    section_offsets = starts[compiled.section_offsets]
+    path_of = np.repeat(np.arange(len(compiled)), np.diff(section_offsets)).astype(str).astype(bytes)
+    names = base = compiled.section_names[parent]
+    suffix = child.astype(str).astype(bytes)
+    separator = b'_'
+    pending = is_split & (child > 0)
+    renamed = pending.copy()
+    while pending.any():
+        names = np.where(pending, np.char.add(np.char.add(base, separator), suffix), names)
+        keys = np.char.add(np.char.add(path_of, b':'), names)
+        _, inverse, duplicates = np.unique(keys, return_inverse=True, return_counts=True)
+        pending = renamed & (duplicates[inverse] > 1)
+        separator += b'_'
+
+    arrays = dict(compiled.arrays)
+    arrays.update({
+        'section_offsets': section_offsets,
+        'section_names': names,
+        # Unsplit sections keep their values exactly
+        'coords': np.where(is_split[:, None], new_coords, coords),
+        'distance': np.where(is_split, distance[parent] / n, distance[parent]),
+        'climb': np.where(is_split, compiled.climb[parent] / n, compiled.climb[parent]),
+        'incline': compiled.incline[parent],
+        'points': compiled.points[parent],
+        'section_extra': compiled.section_extra[parent],
+    })
+    return CompiledMap(arrays)
@@ -1,12 +1,15 @@
-import requests
 import os
 import math
 from geopy.distance import geodesic
 from dotenv import load_dotenv
+import data_collection.data_acquisition.elevation_source as es
 
 load_dotenv()
 API_KEY = os.getenv("GOOGLE_API")
 
+# Cached Google source used when no elevation source is given, see get_elevation_source
+_elevation_source = None
+
 
 def pre_process_path(path : str) -> dict:
     '''
@@ -21,18 +24,22 @@ def pre_process_path(path : str) -> dict:
         path_data[f"point{i}"] = [lon, lat]
     return path_data
 
+def get_elevation_source():
+    '''
+    Google elevations behind the persistent cache in es.ELEVATION_CACHE_FILE,
+    created on first use.
+    '''
+    global _elevation_source
+    if _elevation_source is None:
+        _elevation_source = es.CachedElevation(es.GoogleElevation(API_KEY), es.ELEVATION_CACHE_FILE)
+    return _elevation_source
+
 def find_elevation(lat: float, lon: float) -> float:
     '''
     Finds the elevation of each coordinate on the route
     '''
-    url = f"https://maps.googleapis.com/maps/api/elevation/json?locations={lon},{lat}&key={API_KEY}"
-
-    response = requests.get(url)
-    data = response.json()
-
-    if "results" in data and len(data["results"]) > 0:
-        elevation = data["results"][0]["elevation"]
-    return elevation
+    # Called with path points, which are [lon, lat], so lon holds the latitude
+    return get_elevation_source().elevation(lon, lat)
 
 def find_euc_dist(point1: list, point2 : list) -> float:
     distance = geodesic(point1, point2).meters
@@ -58,20 +65,25 @@ def find_incline_angle(distance: float, climb: float):
     return round(angle_deg,2)
 
 
-def assemble_path_data(path: str) -> dict:
+def assemble_path_data(path: str, elevation_source = None) -> dict:
     '''
     returns a dict of information from an individual path from the csv
+    elevation_source: an elevation_source source (default get_elevation_source()),
+        asked for all of the path's points in one call
     '''
+    if elevation_source is None:
+        elevation_source = get_elevation_source()
     #initialise dicts
     pathway = pre_process_path(path)
     sections = {}
 
     keys = list(pathway.keys())
+    elevations = elevation_source.elevations([(lat, lon) for lon, lat in pathway.values()])
     for i in range(len(keys) - 1):
         section_name = f"section{i+1}"
         coords1 = pathway[keys[i]]
         coords2 = pathway[keys[i+1]]
-        climb = find_climb(coords1, coords2)
+        climb = elevations[i+1] - elevations[i]
         dist = find_euc_dist(coords1, coords2)
         angle = find_incline_angle(dist, climb)
 
@@ -83,5 +95,19 @@ def assemble_path_data(path: str) -> dict:
             "avg_incline_angle" : angle
         }
 
-    return sections    
+    return sections
 
+def assemble_all_path_data(paths, elevation_source = None) -> list:
+    '''
+    assemble_path_data for many paths (e.g. the csv's geometry column), with
+    the elevations of every point fetched up front in one bulk call, so a
+    vertex shared by several paths is only looked up once.
+    '''
+    if elevation_source is None:
+        elevation_source = get_elevation_source()
+    if not isinstance(elevation_source, es.CachedElevation):
+        # In-memory cache, so the per-path lookups below are answered locally
+        elevation_source = es.CachedElevation(elevation_source)
+    paths = list(paths)
+    elevation_source.elevations([(lat, lon) for path in paths for lon, lat in pre_process_path(path).values()])
+    return [assemble_path_data(path, elevation_source) for path in paths]
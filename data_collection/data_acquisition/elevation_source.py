@@ -0,0 +1,268 @@
+'''
+Elevation sources for building map data.
+A source looks up many (lat, lon) points at once:
+    GoogleElevation: Google Maps Elevation API (the source of the map data)
+    OpenTopoData: an OpenTopoData server, public or local
+    DEMElevation: a local elevation grid (GeoTIFF or .npz), no network at all
+The HTTP sources send up to batch_size points per request, over a pooled
+session, with several requests in flight at once. Point them at a stub server
+with url to build networks offline.
+
+CachedElevation wraps any source with a persistent point -> elevation cache
+(a JSON lines file, appended as points are fetched), so every point is fetched
+once: repeated vertices within a build, and whole rebuilds, never hit the
+source again.
+'''
+import hashlib
+import json
+import math
+import os
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+ELEVATION_CACHE_FILE = './data_collection/data/elevation_cache.jsonl'
+# Decimal places of the cached coordinates (OSM stores 7)
+COORD_DECIMALS = 7
+# Retries of a failed request, with exponential backoff
+MAX_RETRIES = 5
+# Hex digits of the content digest in a DEM's name
+DIGEST_LENGTH = 16
+
+
+def _file_hash(file_path: str) -> str:
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as file:
+        for chunk in iter(lambda: file.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _session(pool_size: int) -> requests.Session:
+    retry = Retry(total=MAX_RETRIES, backoff_factor=0.5, status_forcelist=(429, 500, 502, 503, 504))
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=retry)
+    session = requests.Session()
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+
+class HTTPElevation:
+    '''
+    Elevation API answering a |-separated list of lat,lon locations with
+    {'status': 'OK', 'results': [{'elevation': ...}, ...]}, one result per
+    location, or an error message under error_key. Subclasses set kind, url
+    and error_key. name is kind:url, so each dataset or server gets its own
+    entries in a shared cache file.
+    '''
+    kind = 'http'
+    url = None
+    error_key = 'error'
+    batch_size = 100
+
+    def __init__(self, url: str = None, batch_size: int = None, workers: int = 4, timeout: float = 30):
+        self.url = url or self.url
+        self.name = f'{self.kind}:{self.url}'
+        self.batch_size = batch_size or self.batch_size
+        self.workers = workers
+        self.timeout = timeout
+        self._session = _session(workers)
+
+    def _params(self, locations: str) -> dict:
+        return {'locations': locations}
+
+    def _parse(self, data: dict, n: int) -> list:
+        if data.get('status') != 'OK' or len(data.get('results', [])) != n:
+            raise RuntimeError(f"Elevation request failed: {data.get('status')} {data.get(self.error_key, '')}")
+        return [result['elevation'] for result in data['results']]
+
+    def _fetch(self, points) -> list:
+        locations = '|'.join(f'{lat},{lon}' for lat, lon in points)
+        response = self._session.get(self.url, params=self._params(locations), timeout=self.timeout)
+        response.raise_for_status()
+        return self._parse(response.json(), len(points))
+
+    def elevations(self, points) -> list:
+        '''
+        Elevation (m) of each (lat, lon) point, in order.
+        '''
+        points = list(points)
+        batches = [points[i:i + self.batch_size] for i in range(0, len(points), self.batch_size)]
+        if self.workers > 1 and len(batches) > 1:
+            with ThreadPoolExecutor(max_workers=self.workers) as executor:
+                results = list(executor.map(self._fetch, batches))
+        else:
+            results = [self._fetch(batch) for batch in batches]
+        return [elevation for batch in results for elevation in batch]
+
+
+class GoogleElevation(HTTPElevation):
+    kind = 'google'
+    url = 'https://maps.googleapis.com/maps/api/elevation/json'
+    error_key = 'error_message'
+    # Keeps the request URL well under Google's 16384 character limit
+    batch_size = 256
+
+    def __init__(self, api_key: str, **kwargs):
+        super().__init__(**kwargs)
+        self.api_key = api_key
+
+    def _params(self, locations: str) -> dict:
+        return {'locations': locations, 'key': self.api_key}
+
+
+class OpenTopoData(HTTPElevation):
+    '''
+    OpenTopoData dataset, e.g. aster30m as in openstreetmaps.get_elevation.
+    The public server takes 100 locations and 1 request per second, so keep
+    workers at 1 there; a self-hosted server can take more.
+    '''
+    kind = 'opentopodata'
+    url = 'https://api.opentopodata.org/v1/aster30m'
+    batch_size = 100
+
+    def __init__(self, dataset: str = None, workers: int = 1, **kwargs):
+        if dataset is not None and 'url' not in kwargs:
+            kwargs['url'] = f'https://api.opentopodata.org/v1/{dataset}'
+        super().__init__(workers=workers, **kwargs)
+
+
+class DEMElevation:
+    '''
+    Bilinear interpolation in a north-up elevation grid: elevation[row, col]
+    is the value at the centre of the cell west + col * pixel_width,
+    north - row * pixel_height (degrees). nodata cells and points outside the
+    grid raise ValueError. name, a digest of the grid and its transform (of
+    the file for from_file) unless given, tells apart the DEMs sharing a cache
+    file, so an edited DEM never reads the old one's elevations.
+    '''
+
+    def __init__(self, elevation, west: float, north: float, pixel_width: float, pixel_height: float, nodata=None,
+                 name: str = None):
+        self.elevation = np.asarray(elevation, dtype=float)
+        if nodata is not None:
+            self.elevation = np.where(self.elevation == nodata, np.nan, self.elevation)
+        self.west = west
+        self.north = north
+        self.pixel_width = pixel_width
+        self.pixel_height = pixel_height
+        if name is None:
+            digest = hashlib.sha256(json.dumps([self.elevation.shape, west, north, pixel_width, pixel_height]).encode())
+            digest.update(np.ascontiguousarray(self.elevation).tobytes())
+            name = f'dem:{digest.hexdigest()[:DIGEST_LENGTH]}'
+        self.name = name
+
+    @classmethod
+    def from_file(cls, file_path: str) -> 'DEMElevation':
+        '''
+        Loads a GeoTIFF (with rasterio) or an .npz holding elevation, west,
+        north, pixel_width and pixel_height (and optionally nodata).
+        '''
+        name = f'dem:{_file_hash(file_path)[:DIGEST_LENGTH]}'
+        if file_path.endswith('.npz'):
+            with np.load(file_path) as data:
+                return cls(
+                    data['elevation'], float(data['west']), float(data['north']),
+                    float(data['pixel_width']), float(data['pixel_height']),
+                    float(data['nodata']) if 'nodata' in data else None, name,
+                )
+        import rasterio
+        with rasterio.open(file_path) as dataset:
+            transform = dataset.transform
+            return cls(
+                dataset.read(1), transform.c, transform.f, transform.a, -transform.e, dataset.nodata, name,
+            )
+
+    def elevations(self, points) -> list:
+        points = np.asarray(list(points), dtype=float).reshape(-1, 2)
+        # Fractional cell indices, relative to the cell centres
+        rows = (self.north - points[:, 0]) / self.pixel_height - 0.5
+        cols = (points[:, 1] - self.west) / self.pixel_width - 0.5
+        n_rows, n_cols = self.elevation.shape
+        outside = (rows < 0) | (rows > n_rows - 1) | (cols < 0) | (cols > n_cols - 1)
+        if outside.any():
+            raise ValueError(f"{outside.sum()} points outside the DEM, e.g. {points[outside][0].tolist()}")
+        row0 = np.minimum(np.floor(rows).astype(int), max(n_rows - 2, 0))
+        col0 = np.minimum(np.floor(cols).astype(int), max(n_cols - 2, 0))
+        row1 = np.minimum(row0 + 1, n_rows - 1)
+        col1 = np.minimum(col0 + 1, n_cols - 1)
+        dr = rows - row0
+        dc = cols - col0
+        grid = self.elevation
+        values = (
+            grid[row0, col0] * (1 - dr) * (1 - dc) + grid[row0, col1] * (1 - dr) * dc +
+            grid[row1, col0] * dr * (1 - dc) + grid[row1, col1] * dr * dc
+        )
+        if np.isnan(values).any():
+            raise ValueError(f"{np.isnan(values).sum()} points on nodata cells of the DEM")
+        return values.tolist()
+
+
+def point_key(lat: float, lon: float) -> tuple:
+    return (round(float(lat), COORD_DECIMALS), round(float(lon), COORD_DECIMALS))
+
+
+class ElevationTable:
+    '''
+    Elevations looked up in a {point_key: elevation} dict, e.g. fetched by a
+    parent process for its workers.
+    '''
+    name = 'table'
+
+    def __init__(self, table: dict):
+        self.table = table
+
+    def elevations(self, points) -> list:
+        return [self.table[point_key(lat, lon)] for lat, lon in points]
+
+
+class CachedElevation:
+    '''
+    Any source above, with each point fetched once. Points are rounded to
+    COORD_DECIMALS. With cache_file, fetched elevations are appended to it
+    (tagged with the source name, so one file can serve several sources) and
+    loaded again by later runs. fetched counts the points sent to the source.
+    '''
+
+    def __init__(self, source, cache_file: str = None):
+        self.source = source
+        self.cache_file = cache_file
+        self._cache = {}
+        self.fetched = 0
+        if cache_file is not None and os.path.exists(cache_file):
+            with open(cache_file, 'r') as file:
+                for line in file:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        # A partly written last line
+                        continue
+                    if entry['source'] == source.name:
+                        self._cache[(entry['lat'], entry['lon'])] = entry['elevation']
+
+    def __len__(self):
+        return len(self._cache)
+
+    def elevations(self, points) -> list:
+        '''
+        Elevation of each (lat, lon) point, in order, fetching the points not
+        yet cached in bulk.
+        '''
+        keys = [point_key(lat, lon) for lat, lon in points]
+        missing = list(dict.fromkeys(key for key in keys if key not in self._cache))
+        if missing:
+            values = self.source.elevations(missing)
+            self.fetched += len(missing)
+            new = {key: value for key, value in zip(missing, values) if value is not None and not math.isnan(value)}
+            self._cache.update(new)
+            if self.cache_file is not None and new:
+                os.makedirs(os.path.dirname(os.path.abspath(self.cache_file)), exist_ok=True)
+                with open(self.cache_file, 'a') as file:
+                    for (lat, lon), value in new.items():
+                        file.write(json.dumps({'source': self.source.name, 'lat': lat, 'lon': lon, 'elevation': value}) + '\n')
+        return [self._cache.get(key) for key in keys]
+
+    def elevation(self, lat: float, lon: float) -> float:
+        return self.elevations([(lat, lon)])[0]
@@ -1,7 +1,41 @@
+import ast
 import pandas as pd
 import numpy as np
 import re
 
+
+def _parse_highway(highway):
+    # Highway type of an edge; OSM sometimes stores a list of types, of which the first is used
+    if pd.isna(highway):
+        return None
+    if isinstance(highway, str) and '[' in highway:
+        try:
+            highway_types = ast.literal_eval(highway)
+        except Exception:
+            return highway
+        if isinstance(highway_types, list):
+            return highway_types[0] if highway_types else 'unknown'
+    return str(highway)
+
+
+def _extract_speed(speed_str):
+    # Numeric part of a maxspeed, from strings like "30 mph" or "50 km/h"
+    if pd.isna(speed_str):
+        return None
+    if isinstance(speed_str, (int, float)):
+        return float(speed_str)
+    match = re.search(r'(\d+)', str(speed_str))
+    if match:
+        return float(match.group(1))
+    return None
+
+
+def _map_unique(values: pd.Series, func) -> pd.Series:
+    # func applied once per distinct value instead of once per row
+    distinct = values.dropna().unique()
+    return values.map(dict(zip(distinct, map(func, distinct))))
+
+
 def classify_stop_start_edges(csv_file_path):
     """
     Analyzes OSM edge data and returns a list of OSMIDs with a flag indicating
@@ -14,48 +48,41 @@ def classify_stop_start_edges(csv_file_path):
         DataFrame: Contains OSMIDs and stop_start flag with confidence score
     """
     # Load the CSV data
-    df = pd.read_csv(csv_file_path)
+    df = pd.read_csv(csv_file_path, low_memory=False)
     print(f"Loaded {len(df)} edges from the CSV file")
     
-    # Create a copy to add our classification
-    result_df = df[['osmid']].copy()
-    result_df['has_stop_start'] = False
-    result_df['confidence'] = 0  # Add confidence score (0-10)
+    # Both endpoints of every edge, as one long table of (node, edge row)
+    edge_rows = np.arange(len(df))
+    endpoints = pd.DataFrame({
+        'node': pd.concat([df['u'], df['v']], ignore_index=True),
+        'row': np.concatenate([edge_rows, edge_rows]),
+    })
     
-    # 1. First, identify intersection nodes
-    all_nodes = pd.concat([df['u'], df['v']]).reset_index(drop=True)
-    node_counts = all_nodes.value_counts()
+    # Confidence points of each node, one column per criterion
+    node_scores = []
     
-    # Create a set to store potential stop-start nodes
-    stop_start_nodes = set()
-    node_confidence = {}  # Dictionary to store confidence scores for nodes
+    # 1. First, identify intersection nodes
+    node_counts = endpoints['node'].value_counts()
     
     # 1.1 Complex intersections (nodes with many connecting edges)
     complex_threshold = 4  # More selective: 4+ roads meeting (was 3)
-    complex_intersections = node_counts[node_counts >= complex_threshold].index.tolist()
+    complex_counts = node_counts[node_counts >= complex_threshold]
+    # Assign confidence based on number of connections (max 3 points)
+    node_scores.append((complex_counts - 2).clip(upper=3))
     
-    for node in complex_intersections:
-        stop_start_nodes.add(node)
-        # Assign confidence based on number of connections (max 3 points)
-        connections = node_counts[node]
-        node_confidence[node] = min(connections - 2, 3)
-    
-    print(f"Found {len(complex_intersections)} complex intersection nodes")
+    print(f"Found {len(complex_counts)} complex intersection nodes")
     
     # 2. Check for junction tags
-    junction_nodes = set()
+    junction_nodes = pd.Index([])
     if 'junction' in df.columns and df['junction'].notna().any():
-        junction_edges = df[df['junction'].notna()]
-        junction_nodes = set(pd.concat([junction_edges['u'], junction_edges['v']]).unique())
-        
-        for node in junction_nodes:
-            stop_start_nodes.add(node)
-            node_confidence[node] = node_confidence.get(node, 0) + 2  # +2 for junction tag
+        junction_rows = np.flatnonzero(df['junction'].notna().to_numpy())
+        junction_nodes = pd.Index(endpoints.loc[endpoints['row'].isin(junction_rows), 'node'].unique())
+        node_scores.append(pd.Series(2, index=junction_nodes))  # +2 for junction tag
     
     print(f"Found {len(junction_nodes)} nodes with junction tags")
     
     # 3. Check for highway hierarchy transitions
-    transition_nodes = set()
+    transition_scores = pd.Series(dtype=float)
     if 'highway' in df.columns:
         # Define hierarchy of roads
         highway_hierarchy = {
@@ -74,124 +101,71 @@ def classify_stop_start_edges(csv_file_path):
             'steps': 11
         }
         
-        # Create a dictionary mapping nodes to highway types
-        node_highway_types = {}
-        
-        # Populate the dictionary
-        for _, row in df.iterrows():
-            if pd.isna(row['highway']):
-                continue
-                
-            # Sometimes OSM has highway types as lists, handle both cases
-            if isinstance(row['highway'], str) and '[' in row['highway']:
-                try:
-                    highway_types = eval(row['highway'])
-                    if isinstance(highway_types, list):
-                        highway_type = highway_types[0] if highway_types else 'unknown'
-                    else:
-                        highway_type = str(row['highway'])
-                except:
-                    highway_type = str(row['highway'])
-            else:
-                highway_type = str(row['highway'])
-            
-            # Add highway type to node's list
-            if row['u'] not in node_highway_types:
-                node_highway_types[row['u']] = []
-            if row['v'] not in node_highway_types:
-                node_highway_types[row['v']] = []
-                
-            node_highway_types[row['u']].append(highway_type)
-            node_highway_types[row['v']].append(highway_type)
+        # Highway type and hierarchy level of each edge (unknown types rank 99, non-strings none)
+        highway_types = _map_unique(df['highway'], _parse_highway)
+        levels = _map_unique(
+            highway_types, lambda htype: highway_hierarchy.get(htype.lower(), 99) if isinstance(htype, str) else np.nan
+        )
+        rows = endpoints['row'].to_numpy()
+        node_highways = pd.DataFrame({
+            'node': endpoints['node'],
+            'highway': highway_types.to_numpy()[rows],
+            'level': levels.to_numpy(dtype=float)[rows],
+        }).dropna(subset=['highway'])
+        by_node = node_highways.groupby('node')
+        unique_types = by_node['highway'].nunique()
+        # Range of the highway hierarchy at each node
+        hierarchy_diff = by_node['level'].max() - by_node['level'].min()
         
         # Find nodes with significant highway transitions
-        for node, highway_types in node_highway_types.items():
-            unique_types = set(highway_types)
-            
-            if len(unique_types) > 1:
-                # Calculate the range of highway hierarchy
-                hierarchy_values = [highway_hierarchy.get(htype.lower(), 99) 
-                                    for htype in unique_types if isinstance(htype, str)]
-                
-                if hierarchy_values and max(hierarchy_values) - min(hierarchy_values) >= 3:  # More selective: bigger hierarchy gap
-                    transition_nodes.add(node)
-                    
-                    # Add to confidence based on hierarchy difference
-                    hierarchy_diff = max(hierarchy_values) - min(hierarchy_values)
-                    conf_score = min(2, hierarchy_diff - 2)  # Max +2 for hierarchy difference
-                    node_confidence[node] = node_confidence.get(node, 0) + conf_score
-    
-    print(f"Found {len(transition_nodes)} nodes with significant highway transitions")
-    stop_start_nodes.update(transition_nodes)
+        transitions = (unique_types > 1) & (hierarchy_diff >= 3)  # More selective: bigger hierarchy gap
+        # Add to confidence based on hierarchy difference
+        transition_scores = (hierarchy_diff[transitions] - 2).clip(upper=2)  # Max +2 for hierarchy difference
+        node_scores.append(transition_scores)
+    
+    print(f"Found {len(transition_scores)} nodes with significant highway transitions")
     
     # 4. Check for speed transitions
-    speed_transition_nodes = set()
+    speed_scores = pd.Series(dtype=float)
     if 'maxspeed' in df.columns:
-        # Extract numeric speed values where possible
-        def extract_speed(speed_str):
-            if pd.isna(speed_str):
-                return None
-            if isinstance(speed_str, (int, float)):
-                return float(speed_str)
-            # Extract numeric part from strings like "30 mph" or "50 km/h"
-            match = re.search(r'(\d+)', str(speed_str))
-            if match:
-                return float(match.group(1))
-            return None
-            
-        df['speed_value'] = df['maxspeed'].apply(extract_speed)
-        
-        # Create a dictionary of nodes to their connected speed values
-        node_speeds = {}
-        
-        # Populate the dictionary
-        for _, row in df.iterrows():
-            if pd.isna(row['speed_value']):
-                continue
-                
-            if row['u'] not in node_speeds:
-                node_speeds[row['u']] = []
-            if row['v'] not in node_speeds:
-                node_speeds[row['v']] = []
-                
-            node_speeds[row['u']].append(row['speed_value'])
-            node_speeds[row['v']].append(row['speed_value'])
+        speed_values = _map_unique(df['maxspeed'], _extract_speed)
+        node_speeds = pd.DataFrame({
+            'node': endpoints['node'],
+            'speed': speed_values.to_numpy(dtype=float)[endpoints['row'].to_numpy()],
+        }).dropna(subset=['speed'])
+        by_node = node_speeds.groupby('node')['speed']
+        speed_counts = by_node.count()
+        # Calculate the difference between max and min speed
+        speed_diff = by_node.max() - by_node.min()
         
         # Find nodes with significant speed differences
-        for node, speeds in node_speeds.items():
-            if len(speeds) > 1:
-                # Calculate the difference between max and min speed
-                speed_diff = max(speeds) - min(speeds)
-                if speed_diff >= 15:  # More selective: 15+ mph/km/h difference (was 10)
-                    speed_transition_nodes.add(node)
-                    
-                    # Add to confidence based on speed difference
-                    conf_score = min(2, speed_diff / 10)  # Max +2 for big speed differences
-                    node_confidence[node] = node_confidence.get(node, 0) + conf_score
-    
-    print(f"Found {len(speed_transition_nodes)} nodes with significant speed transitions")
-    stop_start_nodes.update(speed_transition_nodes)
+        speed_transitions = (speed_counts > 1) & (speed_diff >= 15)  # More selective: 15+ mph/km/h difference (was 10)
+        # Add to confidence based on speed difference
+        speed_scores = (speed_diff[speed_transitions] / 10).clip(upper=2)  # Max +2 for big speed differences
+        node_scores.append(speed_scores)
+    
+    print(f"Found {len(speed_scores)} nodes with significant speed transitions")
+    
+    # Total confidence of each potential stop-start node, summed in criterion order
+    node_confidence = pd.Series(dtype=float)
+    for scores in node_scores:
+        node_confidence = node_confidence.add(scores.astype(float), fill_value=0)
     
     # 5. Apply the node classifications to edges
-    for i, row in df.iterrows():
-        u_node, v_node = row['u'], row['v']
-        
-        # Edge has stop-start if either endpoint is a stop-start node
-        if u_node in stop_start_nodes or v_node in stop_start_nodes:
-            result_df.loc[i, 'has_stop_start'] = True
-            
-            # Set confidence to the higher of the two node confidence scores
-            u_conf = node_confidence.get(u_node, 0)
-            v_conf = node_confidence.get(v_node, 0)
-            result_df.loc[i, 'confidence'] = max(u_conf, v_conf)
+    # An edge takes the higher confidence of its endpoints; nodes not flagged by any criterion score 0
+    u_conf = node_confidence.reindex(df['u']).fillna(0).to_numpy()
+    v_conf = node_confidence.reindex(df['v']).fillna(0).to_numpy()
+    result_df = df[['osmid']].copy()
+    result_df['confidence'] = np.maximum(u_conf, v_conf)
     
     # 6. Normalize confidence to 0-10 scale and round to 1 decimal place
     max_possible = 7  # Max points possible from all criteria
     result_df['confidence'] = (result_df['confidence'] / max_possible * 10).round(1)
     
     # Only mark as stop-start if confidence exceeds a minimum threshold
+    # (every node with points is a stop-start node, so this is the whole test)
     confidence_threshold = 5.0  # More selective: Must have reasonable confidence
-    result_df.loc[result_df['confidence'] < confidence_threshold, 'has_stop_start'] = False
+    result_df.insert(1, 'has_stop_start', result_df['confidence'] >= confidence_threshold)
     
     # 7. Calculate some summary statistics
     total_edges = len(result_df)
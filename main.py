@@ -7,18 +7,21 @@ import random
 import models.road_network.create_graph as cg
 import simulation.simulate_routes as sr
 import models.vehicle_models.battery_deg as bd
+from models.road_network.compiled_map import load_map
+from models.road_network.snapshot import load_network
 
-def import_data()->tuple:
+ROAD_NETWORK_FILE = './data_collection/data/large_net/large_edge_data.csv'
+MAP_DATA_FILE = "./data_collection/data/large_net/fixed_large_dis_data.json"
+WEIGHTS_FILE = "./data_collection/weights.json"
+
+def import_parameters()->tuple:
     '''
-    Import key files, returns:
-    road_network_file: path of edge data csv
-    road_df: edge data csv
+    Import the vehicle, battery and static parameters and the optimal weights,
+    without the map data or edge CSV (import_network loads those), returns:
     static_data: dictionary of static parameters
     vehicle_data: dictionary of vehicle parameters
     battery_data: dictionary of battert parameters
-    map_data: dictionary of route data
     weights: dictionary of optimal weight parameters
-
     '''
     with open("models/vehicle_models/static_data.json", "r") as file:
         static_data = json.load(file)
@@ -26,18 +29,46 @@ def import_data()->tuple:
         vehicle_data = json.load(file)
     with open("models/vehicle_models/battery_data.json", "r") as file:
         battery_data = json.load(file)
-    with open("./data_collection/data/large_net/fixed_large_dis_data.json", "r") as file:
-        map_data = json.load(file)
-    
-    with open("./data_collection/weights.json", "r") as file:
+    with open(WEIGHTS_FILE, "r") as file:
         weights = json.load(file)
+    return static_data, vehicle_data, battery_data, weights
 
-    road_network_file = './data_collection/data/large_net/large_edge_data.csv' 
+def import_data(compiled: bool = False)->tuple:
+    '''
+    Import key files. With compiled=True map_data is loaded as a CompiledMap from
+    the .npz next to the map JSON (compiled on first use), returns:
+    road_network_file: path of edge data csv
+    road_df: edge data csv
+    static_data: dictionary of static parameters
+    vehicle_data: dictionary of vehicle parameters
+    battery_data: dictionary of battert parameters
+    map_data: dictionary of route data
+    weights: dictionary of optimal weight parameters
+
+    '''
+    static_data, vehicle_data, battery_data, weights = import_parameters()
+    if compiled:
+        map_data = load_map(MAP_DATA_FILE)
+    else:
+        with open(MAP_DATA_FILE, "r") as file:
+            map_data = json.load(file)
+
+    road_network_file = ROAD_NETWORK_FILE
     road_df = pd.read_csv(road_network_file)
 
     print("data imported")
     return road_network_file, road_df, static_data, vehicle_data, battery_data, map_data, weights
 
+def import_network()->tuple:
+    '''
+    Load the routing network from its on-disk snapshot, which is rebuilt
+    automatically whenever the edge CSV, map JSON or weights file changes. Returns:
+    graph: road graph, with distance and objective weights precomputed
+    map_data: CompiledMap of route data
+    edge_index: EdgeIndex over map_data
+    '''
+    return load_network(ROAD_NETWORK_FILE, MAP_DATA_FILE, WEIGHTS_FILE)
+
 def create_random_test_set(length:int, road_df):
     import random
     u_list = road_df['u'].to_list()
@@ -81,12 +112,22 @@ def create_new_test_set(road_df):
     with open("test_data/test_route_set.json", "w") as file:
         json.dump(test_set_dict, file, indent=4)
 
-road_network_file, road_df, static_data, vehicle_data, battery_data, map_data, weights = import_data()
+def __getattr__(name):
+    # road_df, the edge CSV, is only read when a caller asks for it
+    # (e.g. create_new_test_set(main.road_df)); routing doesn't need it
+    if name == 'road_df':
+        globals()['road_df'] = pd.read_csv(ROAD_NETWORK_FILE)
+        return globals()['road_df']
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+# The map data comes from the network snapshot alone
+static_data, vehicle_data, battery_data, weights = import_parameters()
+road_network_file = ROAD_NETWORK_FILE
 OCV = battery_data["OCV"]
 capacity = battery_data["Capacity"]
 R_int = battery_data["R_internal"]
 motor_eff = vehicle_data["motor_eff"]
-graph = cg.create_osmnx_compatible_graph(road_network_file, debug = False)
+graph, map_data, edge_index = import_network()
 
 with open("./data_collection/data/test_data/test_route_set.json", "r") as file:
         test_routes_dict = json.load(file)
@@ -95,8 +136,8 @@ def simulate_and_analyse_route(test_routes_dict):
     test_set = test_routes_dict['test_set1']
     random_route = test_set[random.randint(0, len(test_set))]
     route_output_optimised = sr.find_route(
-                    map_data, road_df, graph, random_route[0], random_route[1], 
-                    weights, plot=True, weights_type='objective'
+                    map_data, None, graph, random_route[0], random_route[1], 
+                    weights, plot=True, weights_type='objective', edge_index=edge_index
                 )            
     opt_results = sr.return_route_data_complex(
                     route_output_optimised, vehicle_data, static_data, 
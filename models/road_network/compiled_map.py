@@ -0,0 +1,275 @@
+'''
+Columnar store for map_data.
+The nested path -> section -> dict JSON is compiled into flat arrays (one entry
+per section, with per-path offsets into them) and saved as a single .npz file.
+A CompiledMap can be passed anywhere map_data is expected: it behaves as a
+read-only mapping of path key -> path dict, while the weighting and simulation
+code can read the arrays directly.
+'''
+import json
+import os
+import sys
+from collections.abc import Mapping
+import numpy as np
+
+SECTION_FIELDS = ('points', 'coords', 'climb', 'distance', 'avg_incline_angle')
+PATH_FIELDS = ('nodes', 'osmid', 'smooth')
+# Arrays with one entry per path (offsets aside)
+PATH_ARRAYS = ('path_keys', 'osmid', 'has_osmid', 'has_nodes', 'smooth', 'has_smooth', 'path_extra')
+
+
+def _text_array(values) -> np.ndarray:
+    # UTF-8 bytes take a quarter of the memory of numpy's fixed-width unicode
+    return np.char.encode(np.array(values, dtype=str), 'utf-8')
+
+
+def _point_number(point) -> int:
+    return int(str(point).removeprefix('point'))
+
+
+def _extra_json(items: dict, known) -> str:
+    extra = {key: value for key, value in items.items() if key not in known}
+    return json.dumps(extra) if extra else ''
+
+
+def _gather(offsets: np.ndarray, positions: np.ndarray) -> tuple:
+    # Indices of the entries owned by positions, in order, and their new offsets
+    counts = offsets[positions + 1] - offsets[positions]
+    new_offsets = np.concatenate([[0], np.cumsum(counts)]).astype(np.int64)
+    index = np.repeat(offsets[positions] - new_offsets[:-1], counts) + np.arange(new_offsets[-1])
+    return index, new_offsets
+
+
+class CompiledMap(Mapping):
+    '''
+    map_data held as arrays.
+
+    Path arrays (one entry per path):
+        path_keys, osmid, has_osmid, has_nodes, smooth, has_smooth,
+        section_offsets, node_offsets
+    Section arrays (one entry per section, path i owns
+    section_offsets[i]:section_offsets[i + 1]):
+        section_names, distance, climb, incline, coords (n, 4),
+        points (n, 2, the N of "pointN")
+    has_* flag which of the paths had the field at all.
+    Any other path or section keys are kept as JSON in path_extra / section_extra,
+    as is an osmid that is not a string (osmid then holds its str()).
+    Text columns are stored as UTF-8 bytes.
+    Node pairs: nodes, indexed by node_offsets the same way.
+    '''
+
+    def __init__(self, arrays: dict):
+        self.arrays = arrays
+        for name, array in arrays.items():
+            setattr(self, name, array)
+        self.path_index = {key.decode('utf-8'): i for i, key in enumerate(self.path_keys.tolist())}
+
+    def __len__(self):
+        return len(self.path_keys)
+
+    def __iter__(self):
+        return iter(self.path_index)
+
+    def __contains__(self, key):
+        return key in self.path_index
+
+    def __getitem__(self, key) -> dict:
+        return self.path_dict(self.path_index[key])
+
+    def path_dict(self, i: int) -> dict:
+        '''
+        Rebuilds the original nested dict for the path at position i.
+        '''
+        path = {}
+        start, end = self.section_offsets[i], self.section_offsets[i + 1]
+        for j in range(start, end):
+            section = {
+                'points': [f"point{n}" for n in self.points[j].tolist()],
+                'coords': self.coords[j].tolist(),
+                'climb': float(self.climb[j]),
+                'distance': float(self.distance[j]),
+                'avg_incline_angle': float(self.incline[j]),
+            }
+            if self.section_extra[j]:
+                section.update(json.loads(self.section_extra[j]))
+            path[self.section_names[j].decode('utf-8')] = section
+
+        if self.has_nodes[i]:
+            path['nodes'] = self.nodes[self.node_offsets[i]:self.node_offsets[i + 1]].tolist()
+        if self.has_osmid[i]:
+            path['osmid'] = self.osmid[i].decode('utf-8')
+        if self.has_smooth[i]:
+            path['smooth'] = bool(self.smooth[i])
+        if self.path_extra[i]:
+            path.update(json.loads(self.path_extra[i]))
+        return path
+
+    def edge_pairs(self):
+        '''
+        Yields (path_key, u, v) for every path with at least two nodes, in path order.
+        '''
+        counts = np.diff(self.node_offsets)
+        for i in np.flatnonzero(counts >= 2).tolist():
+            start = self.node_offsets[i]
+            yield self.path_keys[i].decode('utf-8'), int(self.nodes[start]), int(self.nodes[start + 1])
+
+    def section_counts(self) -> np.ndarray:
+        return np.diff(self.section_offsets)
+
+    def path_weight_inputs(self, positions=None) -> dict:
+        '''
+        Per-path inputs to the weight model (see weight_integration.process_path_weight),
+        computed for every path at once, or for the paths at positions only.
+        '''
+        offsets, incline, distances = self.section_offsets, self.incline, self.distance
+        smooth = self.has_smooth & self.smooth
+        if positions is not None:
+            positions = np.asarray(positions, dtype=np.int64)
+            sections, offsets = _gather(offsets, positions)
+            incline, distances, smooth = incline[sections], distances[sections], smooth[positions]
+        counts = np.diff(offsets)
+        has_sections = counts > 0
+        starts = offsets[:-1][has_sections]
+
+        average_incline = np.zeros(len(counts))
+        max_incline = np.zeros(len(counts))
+        distance = np.zeros(len(counts))
+        if len(incline):
+            average_incline[has_sections] = np.add.reduceat(incline, starts) / counts[has_sections]
+            max_incline[has_sections] = np.maximum.reduceat(incline, starts)
+            distance[has_sections] = np.add.reduceat(distances, starts)
+
+        return {
+            'average_incline': average_incline,
+            'max_incline': max_incline,
+            'distance': distance,
+            'zero_start': smooth,
+        }
+
+    def save(self, file_path: str):
+        np.savez(file_path, **self.arrays)
+
+
+def compile_map_data(map_data: dict) -> CompiledMap:
+    '''
+    Turns nested map_data into a CompiledMap. Sections are the path entries
+    with "section" in their key, as everywhere else in the project.
+    '''
+    path_keys, osmid, has_osmid, has_nodes, smooth, has_smooth, path_extra = [], [], [], [], [], [], []
+    section_offsets, node_offsets = [0], [0]
+    section_names, distance, climb, incline, coords, points, section_extra = [], [], [], [], [], [], []
+    nodes = []
+
+    for path_key, path_data in map_data.items():
+        path_keys.append(path_key)
+        osmid.append(str(path_data.get('osmid', '')))
+        has_osmid.append('osmid' in path_data)
+        has_nodes.append('nodes' in path_data)
+        has_smooth.append('smooth' in path_data)
+        smooth.append(bool(path_data.get('smooth', False)))
+
+        sections = {key: value for key, value in path_data.items() if 'section' in key}
+        # The osmid column is text; other osmids (ints, lists) keep their JSON form in path_extra
+        known = PATH_FIELDS if isinstance(path_data.get('osmid', ''), str) else ('nodes', 'smooth')
+        path_extra.append(_extra_json(
+            {key: value for key, value in path_data.items() if key not in sections}, known
+        ))
+        for name, section in sections.items():
+            section_names.append(name)
+            distance.append(section['distance'])
+            climb.append(section.get('climb', 0))
+            incline.append(section.get('avg_incline_angle', 0))
+            coords.append(section.get('coords', [np.nan] * 4))
+            points.append([_point_number(point) for point in section.get('points', ['point0', 'point0'])])
+            section_extra.append(_extra_json(section, SECTION_FIELDS))
+        section_offsets.append(len(section_names))
+
+        nodes.extend(int(node) for node in path_data.get('nodes', []))
+        node_offsets.append(len(nodes))
+
+    return CompiledMap({
+        'path_keys': _text_array(path_keys),
+        'osmid': _text_array(osmid),
+        'has_osmid': np.array(has_osmid, dtype=bool),
+        'has_nodes': np.array(has_nodes, dtype=bool),
+        'smooth': np.array(smooth, dtype=bool),
+        'has_smooth': np.array(has_smooth, dtype=bool),
+        'path_extra': _text_array(path_extra),
+        'section_offsets': np.array(section_offsets, dtype=np.int64),
+        'node_offsets': np.array(node_offsets, dtype=np.int64),
+        'nodes': np.array(nodes, dtype=np.int64),
+        'section_names': _text_array(section_names),
+        'distance': np.array(distance, dtype=float),
+        'climb': np.array(climb, dtype=float),
+        'incline': np.array(incline, dtype=float),
+        'coords': np.array(coords, dtype=float).reshape(-1, 4),
+        'points': np.array(points, dtype=np.int32).reshape(-1, 2),
+        'section_extra': _text_array(section_extra),
+    })
+
+
+def update_compiled_map(compiled: CompiledMap, changes: dict) -> CompiledMap:
+    '''
+    New CompiledMap with changes ({path_key: path dict, or None to remove the
+    path}) applied. Changed paths keep their position, new paths are appended
+    in the order given, as a dict update would do. Only the changed paths are
+    compiled; every other path's arrays are copied across in one pass.
+    '''
+    added = {key: path for key, path in changes.items() if path is not None}
+    new = compile_map_data(added)
+    n_old = len(compiled)
+
+    positions = []
+    for key, i in compiled.path_index.items():
+        if key not in changes:
+            positions.append(i)
+        elif changes[key] is not None:
+            positions.append(n_old + new.path_index[key])
+    positions.extend(n_old + new.path_index[key] for key in added if key not in compiled.path_index)
+    positions = np.array(positions, dtype=np.int64)
+
+    # Old and new paths side by side, with the new offsets shifted past the old entries
+    section_offsets = np.concatenate([compiled.section_offsets[:-1], new.section_offsets + compiled.section_offsets[-1]])
+    node_offsets = np.concatenate([compiled.node_offsets[:-1], new.node_offsets + compiled.node_offsets[-1]])
+    sections, new_section_offsets = _gather(section_offsets, positions)
+    nodes, new_node_offsets = _gather(node_offsets, positions)
+
+    arrays = {'section_offsets': new_section_offsets, 'node_offsets': new_node_offsets}
+    for name, array in compiled.arrays.items():
+        if name in arrays:
+            continue
+        index = positions if name in PATH_ARRAYS else nodes if name == 'nodes' else sections
+        arrays[name] = np.concatenate([array, new.arrays[name]])[index]
+    return CompiledMap(arrays)
+
+
+def load_compiled_map(file_path: str) -> CompiledMap:
+    with np.load(file_path) as data:
+        return CompiledMap({name: data[name] for name in data.files})
+
+
+def load_map(json_path: str, compiled_path: str = None) -> CompiledMap:
+    '''
+    Loads map data through its compiled .npz, compiling the JSON first if the
+    .npz is missing, older than the JSON or lacks any of the path arrays.
+    '''
+    if compiled_path is None:
+        compiled_path = os.path.splitext(json_path)[0] + '.npz'
+    if os.path.exists(compiled_path) and os.path.getmtime(compiled_path) >= os.path.getmtime(json_path):
+        compiled = load_compiled_map(compiled_path)
+        if all(name in compiled.arrays for name in PATH_ARRAYS):
+            return compiled
+
+    with open(json_path, 'r') as file:
+        compiled = compile_map_data(json.load(file))
+    compiled.save(compiled_path)
+    return compiled
+
+
+if __name__ == "__main__":
+    # python -m models.road_network.compiled_map <map_data.json> [<out.npz>]
+    source = sys.argv[1]
+    target = sys.argv[2] if len(sys.argv) > 2 else os.path.splitext(source)[0] + '.npz'
+    with open(source, 'r') as file:
+        compile_map_data(json.load(file)).save(target)
+    print(f"Compiled {source} -> {target}")
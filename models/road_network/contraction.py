@@ -0,0 +1,291 @@
+'''
+Contraction hierarchies for repeated point-to-point queries on a fixed weighting.
+Nodes are contracted one at a time in order of importance, adding shortcut
+edges wherever a shortest path ran through the contracted node. A query is
+then a bidirectional Dijkstra that only ever moves up the hierarchy, settling a
+few dozen nodes instead of most of the graph, and shortcuts are unpacked back
+into the original node sequence.
+'''
+import heapq
+import networkx as nx
+import numpy as np
+from models.road_network.csr_routing import csr_for_graph
+
+# Number of hierarchies kept per graph by ch_for_graph
+CH_CACHE_SIZE = 4
+# Nodes a witness search may settle before giving up (and adding the shortcut)
+WITNESS_SETTLE_LIMIT = 200
+
+
+class ContractionHierarchy:
+    '''
+    Contraction hierarchy over the node ids of a CSRGraph.
+    rank[i] is the contraction order of node id i. up_* arrays (CSR) hold the
+    edges i -> j with rank[j] > rank[i]; down_* arrays hold, at j, the edges
+    i -> j with rank[i] > rank[j], used by the backward search. Shortcuts map
+    (i, j) to the node they bypass.
+    '''
+
+    def __init__(self, nodes, rank, up, down, shortcuts):
+        self.nodes = np.asarray(nodes)
+        self.rank = np.asarray(rank, dtype=np.int64)
+        self.up_indptr, self.up_indices, self.up_weights = up
+        self.down_indptr, self.down_indices, self.down_weights = down
+        self.shortcuts = shortcuts
+        self.node_index = {node: i for i, node in enumerate(self.nodes.tolist())}
+        self._node_list = self.nodes.tolist()
+        self._up = _adjacency_lists(*up)
+        self._down = _adjacency_lists(*down)
+
+    def __getstate__(self):
+        # The adjacency lists are rebuilt from the arrays on load
+        state = self.__dict__.copy()
+        del state['_up'], state['_down']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._up = _adjacency_lists(self.up_indptr, self.up_indices, self.up_weights)
+        self._down = _adjacency_lists(self.down_indptr, self.down_indices, self.down_weights)
+
+    @classmethod
+    def from_csr(cls, csr):
+        '''
+        Contracts every node of a CSRGraph (parallel edges already collapsed).
+        '''
+        n = len(csr)
+        out_edges = [{} for _ in range(n)]
+        in_edges = [{} for _ in range(n)]
+        indptr, indices, weights = csr.indptr.tolist(), csr.indices.tolist(), csr.weights.tolist()
+        for v in range(n):
+            for j in range(indptr[v], indptr[v + 1]):
+                u = indices[j]
+                if u != v:
+                    out_edges[v][u] = weights[j]
+                    in_edges[u][v] = weights[j]
+
+        shortcuts = {}
+        contracted = [False] * n
+        deleted_neighbours = [0] * n
+        rank = [0] * n
+        up_edges = [None] * n
+        down_edges = [None] * n
+
+        def priority(v):
+            added = len(_needed_shortcuts(v, out_edges, in_edges))
+            return added - len(out_edges[v]) - len(in_edges[v]) + deleted_neighbours[v]
+
+        queue = [(priority(v), v) for v in range(n)]
+        heapq.heapify(queue)
+        order = 0
+        while queue:
+            _, v = heapq.heappop(queue)
+            if contracted[v]:
+                continue
+            # Lazy updates: recompute and requeue if v is no longer the least important
+            current = priority(v)
+            if queue and current > queue[0][0]:
+                heapq.heappush(queue, (current, v))
+                continue
+
+            for u, x, cost in _needed_shortcuts(v, out_edges, in_edges):
+                if cost < out_edges[u].get(x, float('inf')):
+                    out_edges[u][x] = cost
+                    in_edges[x][u] = cost
+                    shortcuts[(u, x)] = v
+
+            contracted[v] = True
+            rank[v] = order
+            order += 1
+            up_edges[v] = dict(out_edges[v])
+            down_edges[v] = dict(in_edges[v])
+            for x in out_edges[v]:
+                del in_edges[x][v]
+                deleted_neighbours[x] += 1
+            for u in in_edges[v]:
+                del out_edges[u][v]
+                deleted_neighbours[u] += 1
+            out_edges[v].clear()
+            in_edges[v].clear()
+
+        # Only the shortcuts that survived as final edges are needed for unpacking
+        kept = {
+            (u, x): middle for (u, x), middle in shortcuts.items()
+            if x in up_edges[u] or u in down_edges[x]
+        }
+        return cls(csr.nodes, rank, _to_arrays(up_edges), _to_arrays(down_edges), kept)
+
+    def query(self, source, target, return_settled=False):
+        '''
+        Shortest path from source to target as a list of nodes. Where several
+        routes tie exactly on cost it may pick a different one than Dijkstra.
+        With return_settled=True returns (path, settled nodes).
+        '''
+        for node in (source, target):
+            if node not in self.node_index:
+                raise nx.NodeNotFound(f"Node {node} not found in graph")
+        s, t = self.node_index[source], self.node_index[target]
+        if s == t:
+            return ([source], 1) if return_settled else [source]
+
+        heappush, heappop = heapq.heappush, heapq.heappop
+        adjacency = (self._up, self._down)
+        dist = ({s: 0}, {t: 0})
+        pred = ({s: -1}, {t: -1})
+        settled = (set(), set())
+        fringe = ([(0, s)], [(0, t)])
+        best, meet = float('inf'), -1
+
+        side = 0
+        while fringe[0] or fringe[1]:
+            # Alternate directions, skipping one that has run out
+            if not fringe[side]:
+                side = 1 - side
+            d, v = heappop(fringe[side])
+            if v in settled[side]:
+                side = 1 - side
+                continue
+            if d >= best:
+                # Nothing left on this side can improve the meeting point
+                fringe[side].clear()
+                side = 1 - side
+                continue
+            settled[side].add(v)
+            other = dist[1 - side].get(v)
+            if other is not None and d + other < best:
+                best, meet = d + other, v
+
+            for u, w in adjacency[side][v]:
+                vu_dist = d + w
+                if vu_dist < dist[side].get(u, float('inf')):
+                    dist[side][u] = vu_dist
+                    pred[side][u] = v
+                    heappush(fringe[side], (vu_dist, u))
+            side = 1 - side
+
+        if meet == -1:
+            raise nx.NetworkXNoPath(f"No path to {target}.")
+
+        hops = []
+        v = meet
+        while v != -1:
+            hops.append(v)
+            v = pred[0][v]
+        hops.reverse()
+        v = pred[1][meet]
+        while v != -1:
+            hops.append(v)
+            v = pred[1][v]
+
+        path = [self._node_list[i] for i in self.unpack(hops)]
+        return (path, len(settled[0]) + len(settled[1])) if return_settled else path
+
+    def unpack(self, hops) -> list:
+        '''
+        Expands a sequence of hierarchy edges (node ids) into original edges.
+        '''
+        path = [hops[0]]
+        for a, b in zip(hops, hops[1:]):
+            stack = [(a, b)]
+            while stack:
+                u, x = stack.pop()
+                middle = self.shortcuts.get((u, x))
+                if middle is None:
+                    path.append(x)
+                else:
+                    stack.append((middle, x))
+                    stack.append((u, middle))
+        return path
+
+
+def _needed_shortcuts(v, out_edges, in_edges) -> list:
+    '''
+    (u, x, cost) for every u -> v -> x that is the only shortest u -> x path
+    among the remaining nodes, found with a bounded witness search from each u.
+    '''
+    shortcuts = []
+    if not in_edges[v] or not out_edges[v]:
+        return shortcuts
+    max_out = max(out_edges[v].values())
+    for u, w_uv in in_edges[v].items():
+        targets = {x: w_uv + w_vx for x, w_vx in out_edges[v].items() if x != u}
+        if not targets:
+            continue
+        witness = _witness_search(u, v, w_uv + max_out, targets, out_edges)
+        for x, cost in targets.items():
+            if witness.get(x, float('inf')) > cost:
+                shortcuts.append((u, x, cost))
+    return shortcuts
+
+
+def _witness_search(u, v, limit, targets, out_edges) -> dict:
+    '''
+    Dijkstra from u ignoring v, up to distance limit or WITNESS_SETTLE_LIMIT
+    settled nodes. Returns the distances found.
+    '''
+    dist = {u: 0}
+    settled = set()
+    remaining = set(targets)
+    fringe = [(0, u)]
+    while fringe and len(settled) < WITNESS_SETTLE_LIMIT:
+        d, a = heapq.heappop(fringe)
+        if a in settled:
+            continue
+        if d > limit:
+            break
+        settled.add(a)
+        remaining.discard(a)
+        if not remaining:
+            break
+        for b, w in out_edges[a].items():
+            if b == v:
+                continue
+            ab_dist = d + w
+            if ab_dist < dist.get(b, float('inf')):
+                dist[b] = ab_dist
+                heapq.heappush(fringe, (ab_dist, b))
+    return dist
+
+
+def _to_arrays(edges) -> tuple:
+    indptr = [0]
+    indices = []
+    weights = []
+    for node_edges in edges:
+        for u, w in node_edges.items():
+            indices.append(u)
+            weights.append(w)
+        indptr.append(len(indices))
+    return np.array(indptr, dtype=np.int64), np.array(indices, dtype=np.int64), np.array(weights, dtype=float)
+
+
+def _adjacency_lists(indptr, indices, weights) -> list:
+    indptr, indices, weights = indptr.tolist(), indices.tolist(), weights.tolist()
+    return [
+        list(zip(indices[indptr[i]:indptr[i + 1]], weights[indptr[i]:indptr[i + 1]]))
+        for i in range(len(indptr) - 1)
+    ]
+
+
+def ch_for_graph(G, weight='weight') -> ContractionHierarchy:
+    '''
+    ContractionHierarchy for G's current weights. Graphs weighted through
+    weight_integration.get_weighted_graph keep their hierarchies in
+    G.graph['ch_cache'] under weights_key, so they are saved with the network
+    snapshot and a new hierarchy is built whenever the weights type,
+    weights_dict or map changes. Other graphs are contracted every call.
+    '''
+    weights_key = G.graph.get('weights_key')
+    if weights_key is None:
+        return ContractionHierarchy.from_csr(csr_for_graph(G, weight))
+
+    cache = G.graph.setdefault('ch_cache', {})
+    cache_key = (weights_key, weight)
+    ch = cache.pop(cache_key, None)
+    if ch is None:
+        ch = ContractionHierarchy.from_csr(csr_for_graph(G, weight))
+    # Most recently used last, drop the oldest once full
+    cache[cache_key] = ch
+    while len(cache) > CH_CACHE_SIZE:
+        cache.pop(next(iter(cache)))
+    return ch
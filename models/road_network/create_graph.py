@@ -1,14 +1,90 @@
 import networkx as nx
+import numpy as np
 import pandas as pd
 import osmnx as ox
 from shapely import wkt
+from models.road_network.csr_routing import csr_for_graph
+from models.road_network.contraction import ch_for_graph
 
-def create_bidirectional_graph(csv_path):
+def _endpoint_coords(geometry):
+    '''
+    First and last coordinates of every WKT LINESTRING in a column, without
+    parsing the full geometry. Rows without geometry come back as NaN.
+    '''
+    geometry = geometry.where(geometry.apply(lambda x: isinstance(x, str)))
+    if geometry.isna().all():
+        missing = np.full(len(geometry), np.nan)
+        return missing, missing, missing, missing
+    body = geometry.str.partition('(')[2].str.rpartition(')')[0]
+    first = body.str.partition(',')[0].str.split(expand=True)
+    last = body.str.rpartition(',')[2].str.split(expand=True)
+    first, last = first.astype(float), last.astype(float)
+    return first[0].to_numpy(), first[1].to_numpy(), last[0].to_numpy(), last[1].to_numpy()
+
+def _build_graph_bulk(edge_df, bidirectional=False):
+    '''
+    Builds the same MultiDiGraph as the row-by-row constructors using column
+    operations. Node coordinates come from the endpoints of each edge's WKT;
+    the WKT itself is kept as 'geometry_wkt' and only parsed by load_geometry.
+    '''
+    G = nx.MultiDiGraph()
+    sources = edge_df['u'].astype('int64').to_numpy()
+    targets = edge_df['v'].astype('int64').to_numpy()
+    keys = edge_df['key'].astype('int64').to_numpy() if 'key' in edge_df.columns else np.zeros(len(edge_df), dtype='int64')
+
+    # Each node takes the coordinates of the first edge it appears on, the
+    # source from the first point and the target from the last, as before
+    if 'geometry' in edge_df.columns:
+        x0, y0, x1, y1 = _endpoint_coords(edge_df['geometry'])
+        endpoints = pd.DataFrame({
+            'node': np.column_stack([sources, targets]).ravel(),
+            'x': np.column_stack([x0, x1]).ravel(),
+            'y': np.column_stack([y0, y1]).ravel(),
+        }).dropna(subset=['x'])
+        endpoints = endpoints.drop_duplicates('node', keep='first')
+        G.add_nodes_from(
+            (node, {'x': x, 'y': y})
+            for node, x, y in zip(endpoints['node'].tolist(), endpoints['x'].tolist(), endpoints['y'].tolist())
+        )
+
+    attrs = edge_df.drop(columns=[c for c in ['u', 'v', 'key'] if c in edge_df.columns])
+    if 'geometry' in attrs.columns:
+        attrs = attrs.rename(columns={'geometry': 'geometry_wkt'})
+    records = attrs.to_dict('records')
+
+    edges = []
+    for source, target, key, edge_attrs in zip(sources.tolist(), targets.tolist(), keys.tolist(), records):
+        edges.append((source, target, key, edge_attrs))
+        if bidirectional:
+            edges.append((target, source, key, edge_attrs))
+    G.add_edges_from(edges)
+
+    G.graph['crs'] = 'EPSG:4326'
+    G.graph['lazy_geometry'] = 'geometry' in edge_df.columns
+    return G
+
+def load_geometry(G):
+    '''
+    Parses the WKT kept by graphs built with lazy_geometry=True into shapely
+    'geometry' attributes, once. Plotting helpers call this before drawing.
+    '''
+    if not G.graph.get('lazy_geometry'):
+        return G
+    for _, _, data in G.edges(data=True):
+        geometry = data.pop('geometry_wkt', None)
+        data['geometry'] = wkt.loads(geometry) if isinstance(geometry, str) else None
+    G.graph['lazy_geometry'] = False
+    return G
+
+def create_bidirectional_graph(csv_path, lazy_geometry=False):
     '''
     Create a graph with bidirectional edges to ensure connectivity
+    lazy_geometry: build with column operations and leave edge geometry as WKT until plotted
     '''
     # Load the edge data from CSV
     edge_df = pd.read_csv(csv_path)
+    if lazy_geometry:
+        return _build_graph_bulk(edge_df, bidirectional=True)
     
     # Create a MultiDiGraph
     G = nx.MultiDiGraph()
@@ -59,12 +135,19 @@ def create_bidirectional_graph(csv_path):
     
     return G
 
-def create_osmnx_compatible_graph(csv_path, debug=False):
+def create_osmnx_compatible_graph(csv_path, debug=False, lazy_geometry=False):
     '''
     Initialise a graph based on route data
+    lazy_geometry: build with column operations and leave edge geometry as WKT until plotted
     '''
     # Load the edge data from CSV
     edge_df = pd.read_csv(csv_path)
+    if lazy_geometry:
+        G = _build_graph_bulk(edge_df)
+        if debug:
+            print(f"Loaded {len(edge_df)} edges from CSV")
+            print(f"Added {G.number_of_edges()} edges and {G.number_of_nodes()} nodes to the graph")
+        return G
     
     if debug:
         print(f"Loaded {len(edge_df)} edges from CSV")
@@ -148,6 +231,7 @@ def plot_graph_with_routes(G, route1=None, route2=None):
     """
     Plot the graph and optionally one or two routes on it
     """
+    load_geometry(G)
     if route1 is None and route2 is None:
         # Just plot the graph
         fig, ax = ox.plot_graph(G, node_size=10, edge_linewidth=1)
@@ -187,6 +271,8 @@ def plot_graph_with_colour_sroute(G, route, route_color='red', background='w'):
     """
     import matplotlib.pyplot as plt
     import osmnx as ox
+
+    load_geometry(G)
     
     # Create the figure and axis
     fig, ax = ox.plot_graph(G, show=False, close=False, 
@@ -232,6 +318,83 @@ def dijkstra(G, start_node:int, target_node:int) -> list:
     weighted_path = nx.dijkstra_path(G, source=start_node, target=target_node, weight='weight')
     return weighted_path
 
+ROUTING_ENGINES = ('networkx', 'csr', 'astar', 'ch')
+
+def shortest_path(G, start_node:int, target_node:int, engine='networkx') -> list:
+    '''
+    Weighted shortest path with the chosen engine:
+    'networkx': nx.dijkstra_path on the graph
+    'csr': heap-based Dijkstra on CSR arrays compiled from the graph (see csr_routing)
+    'astar': A* on the same arrays with an admissible haversine heuristic
+    'ch': contraction hierarchy query (see contraction), built once per weighting
+    'networkx' and 'csr' return the same node sequence. 'astar' and 'ch' return
+    a route of the same cost, the same route unless several tie exactly (e.g.
+    edges clipped to the same objective weight).
+    '''
+    if engine == 'networkx':
+        return dijkstra(G, start_node, target_node)
+    if engine == 'csr':
+        return csr_for_graph(G).dijkstra(start_node, target_node)
+    if engine == 'astar':
+        return csr_for_graph(G).astar(start_node, target_node)
+    if engine == 'ch':
+        return ch_for_graph(G).query(start_node, target_node)
+    raise ValueError(f"Unknown routing engine '{engine}', expected one of {ROUTING_ENGINES}")
+
+def shortest_paths(G, pairs, engine='networkx') -> list:
+    '''
+    Shortest paths for many (start_node, target_node) pairs. Pairs are grouped
+    by start node and each start node gets a single one-to-many search, so the
+    cost grows with the number of distinct start nodes, not pairs.
+    Returns one path per pair, in order, None where there is no path.
+    'astar' runs the CSR one-to-many search, as its heuristic is per target;
+    'ch' answers each pair with a hierarchy query, which is cheaper still.
+    '''
+    if engine not in ROUTING_ENGINES:
+        raise ValueError(f"Unknown routing engine '{engine}', expected one of {ROUTING_ENGINES}")
+    if engine != 'networkx':
+        return compiled_shortest_paths(ch_for_graph(G) if engine == 'ch' else csr_for_graph(G), pairs)
+    targets_by_source = {}
+    for start_node, target_node in pairs:
+        targets_by_source.setdefault(start_node, []).append(target_node)
+
+    paths = {}
+    for start_node, targets in targets_by_source.items():
+        if start_node not in G:
+            continue
+        found = nx.single_source_dijkstra_path(G, start_node, weight='weight')
+        for target_node in targets:
+            paths[(start_node, target_node)] = found.get(target_node)
+    return [paths.get((start_node, target_node)) for start_node, target_node in pairs]
+
+def compiled_shortest_paths(router, pairs) -> list:
+    '''
+    shortest_paths on an already compiled weighting: a CSRGraph (one search per
+    start node) or a ContractionHierarchy (one query per pair). Routing on a
+    router kept per weighting needs no get_weighted_graph call, which rewrites
+    every edge's weight when switching weightings.
+    '''
+    if hasattr(router, 'query'):
+        paths = []
+        for start_node, target_node in pairs:
+            try:
+                paths.append(router.query(start_node, target_node))
+            except (nx.NetworkXNoPath, nx.NodeNotFound):
+                paths.append(None)
+        return paths
+    targets_by_source = {}
+    for start_node, target_node in pairs:
+        targets_by_source.setdefault(start_node, []).append(target_node)
+
+    paths = {}
+    for start_node, targets in targets_by_source.items():
+        if start_node not in router.node_index:
+            continue
+        found = router.paths_from(start_node, targets)
+        for target_node in targets:
+            paths[(start_node, target_node)] = found[target_node]
+    return [paths.get((start_node, target_node)) for start_node, target_node in pairs]
+
 def find_ways(route:list, road_df)-> list:
     nodes = []
     for node in road_df['u'].to_list(), road_df['v'].to_list():
@@ -250,11 +413,15 @@ def find_ways(route:list, road_df)-> list:
 
     return route_osmids, route_data
 
-def find_path_with_nodes(paths_dict, node1, node2):
+def find_path_with_nodes(paths_dict, node1, node2, edge_index=None):
     """
     Search through a dictionary of paths to find keys where the 'nodes' value
     contains the two specified integers (node1 and node2) in the exact order.
+    If an EdgeIndex built over paths_dict is given, it is used instead of a scan.
     """
+    if edge_index is not None:
+        return edge_index.find_paths(node1, node2)
+
     matching_paths = {}
     checked_paths = 0
     nodes_found = 0
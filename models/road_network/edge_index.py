@@ -0,0 +1,126 @@
+'''
+Edge-keyed index over map_data, so route assembly and weighting can look up
+the path for a (u, v) edge without scanning every path.
+'''
+import uuid
+
+
+def _new_version() -> str:
+    # Every index state gets a globally unique version, so caches keyed on it
+    # (including ones saved to disk) never confuse two different maps, or the
+    # same map before and after an update.
+    return uuid.uuid4().hex
+
+
+def path_edge(path_data):
+    '''
+    The (u, v) edge a path runs on (its first two nodes), or None.
+    '''
+    nodes = path_data.get('nodes') if isinstance(path_data, dict) else None
+    if not isinstance(nodes, (list, tuple)) or len(nodes) < 2:
+        return None
+    return (int(nodes[0]), int(nodes[1]))
+
+
+class EdgeIndex:
+    '''
+    Maps (u, v) node pairs to the keys of the map_data paths whose first two
+    nodes are u and v, in map_data order.
+    '''
+
+    def __init__(self, map_data: dict):
+        self.map_data = map_data
+        self.version = _new_version()
+        self._paths = {}
+        # Compiled maps (see compiled_map.CompiledMap) expose their node pairs directly
+        edge_pairs = getattr(map_data, 'edge_pairs', None)
+        if edge_pairs is not None:
+            for path_key, u, v in edge_pairs():
+                self._paths.setdefault((u, v), []).append(path_key)
+        else:
+            for path_key, path_data in map_data.items():
+                self._add(path_key, path_data)
+
+    def _add(self, path_key, path_data):
+        edge = path_edge(path_data)
+        if edge is not None:
+            self._paths.setdefault(edge, []).append(path_key)
+
+    def update(self, map_data, old_edges: dict) -> set:
+        '''
+        Brings the index up to date with map_data after the paths in old_edges
+        were added, removed or modified, and takes a new version. old_edges
+        maps each changed path key to the (u, v) edge it ran on before the
+        change (None for new paths); only the entries of those paths are
+        touched. Returns the edges whose paths changed, before and after.
+        '''
+        position = None
+        affected = set()
+        for path_key, old_edge in old_edges.items():
+            new_edge = path_edge(map_data[path_key]) if path_key in map_data else None
+            if old_edge is not None:
+                affected.add(old_edge)
+                if old_edge != new_edge:
+                    keys = self._paths[old_edge]
+                    keys.remove(path_key)
+                    if not keys:
+                        del self._paths[old_edge]
+            if new_edge is not None:
+                affected.add(new_edge)
+                if old_edge != new_edge:
+                    keys = self._paths.setdefault(new_edge, [])
+                    keys.append(path_key)
+                    if len(keys) > 1:
+                        # Paths of an edge stay in map_data order
+                        if position is None:
+                            position = getattr(map_data, 'path_index', None) or {
+                                key: i for i, key in enumerate(map_data)
+                            }
+                        keys.sort(key=position.__getitem__)
+        self.map_data = map_data
+        self.version = _new_version()
+        return affected
+
+    def __len__(self):
+        return len(self._paths)
+
+    def __contains__(self, edge):
+        u, v = edge
+        return (int(u), int(v)) in self._paths
+
+    def path_keys(self, u, v) -> list:
+        '''
+        Keys of all paths running u -> v, empty if there are none.
+        '''
+        return self._paths.get((int(u), int(v)), [])
+
+    def first_path(self, u, v):
+        '''
+        Returns (path_key, path_data) for the first path running u -> v, or None.
+        '''
+        keys = self.path_keys(u, v)
+        if not keys:
+            return None
+        return keys[0], self.map_data[keys[0]]
+
+    def find_paths(self, u, v) -> dict:
+        '''
+        Same result as create_graph.find_path_with_nodes: {path_key: path_data}
+        for every path running u -> v.
+        '''
+        return {key: self.map_data[key] for key in self.path_keys(u, v)}
+
+
+_last_index = None
+
+
+def get_edge_index(map_data: dict) -> EdgeIndex:
+    '''
+    Returns an EdgeIndex for map_data, reusing the last one built if it was for
+    this same map_data object. Maps edited in place need a fresh EdgeIndex,
+    or an EdgeIndex.update (see map_updates.apply_map_update).
+    '''
+    global _last_index
+    if _last_index is None or _last_index.map_data is not map_data:
+        _last_index = EdgeIndex(map_data)
+    return _last_index
@@ -0,0 +1,173 @@
+'''
+Incremental updates of a loaded network.
+A change to one road (its elevation, stop-start flag or geometry) used to mean
+regenerating the map JSON, reloading the graph and reweighting every edge.
+apply_map_update applies a delta to the loaded graph, map_data and EdgeIndex
+instead, and only touches what depends on the changed paths:
+    map_data: dicts are edited in place, a CompiledMap is rebuilt around the
+        changed paths (update_compiled_map)
+    EdgeIndex: the entries of the changed paths, and a new version
+    graph: an edge is added for a path on an edge the graph did not have,
+        and removed again once no path runs on it. Edges of the road network
+        itself are kept, weighted by their length like any edge without a
+        path, as a full reload of the same sources would do
+    weights: the cached weight inputs and every cached weighting of the old
+        version are recomputed for the affected edges only, and carried over
+        to the new version (weight_integration.refresh_edge_weights)
+    CSR graphs of those weightings get their edge costs patched in place;
+        contraction hierarchies of the old version are dropped and rebuilt on
+        their next use. Both are dropped when the graph's edges changed.
+
+A delta is a JSON-compatible dict with any of:
+    'set': {path_key: path dict} adds new paths or replaces whole paths
+        (e.g. a new geometry)
+    'update': {path_key: {field: value}} changes fields of existing paths,
+        e.g. {'smooth': False} or {'section3': {'climb': 2.4}}; section values
+        are merged into the existing section, and a new climb or distance
+        without an avg_incline_angle recomputes it. None removes the field or
+        section.
+    'remove': [path_key, ...] removes paths
+Paths keep their position in map_data; new paths are appended.
+'''
+import numpy as np
+import data_collection.data_acquisition.elevation_pull as ep
+import models.weighting.weight_integration as wi
+from models.road_network.compiled_map import update_compiled_map
+from models.road_network.edge_index import path_edge
+
+
+def delta_changes(map_data: dict, delta: dict) -> dict:
+    '''
+    The paths a delta changes, as {path_key: new path dict, or None if removed}.
+    Raises KeyError for updates or removals of paths not in map_data.
+    '''
+    changes = {}
+    for path_key in delta.get('remove', []):
+        if path_key not in map_data:
+            raise KeyError(f"Cannot remove path '{path_key}': not in map_data")
+        changes[path_key] = None
+
+    for path_key, path_data in delta.get('set', {}).items():
+        changes[path_key] = dict(path_data)
+
+    for path_key, fields in delta.get('update', {}).items():
+        if changes.get(path_key) is not None:
+            path_data = changes[path_key]
+        elif path_key in map_data and path_key not in changes:
+            path_data = dict(map_data[path_key])
+        else:
+            raise KeyError(f"Cannot update path '{path_key}': not in map_data")
+        for name, value in fields.items():
+            if value is None:
+                path_data.pop(name, None)
+            elif 'section' in name and isinstance(path_data.get(name), dict):
+                section = {**path_data[name], **value}
+                if ('climb' in value or 'distance' in value) and 'avg_incline_angle' not in value:
+                    section['avg_incline_angle'] = ep.find_incline_angle(section['distance'], section['climb'])
+                path_data[name] = section
+            else:
+                path_data[name] = value
+        changes[path_key] = path_data
+    return changes
+
+
+def _new_graph_edge(G, u, v, path_data: dict):
+    # A graph edge for a path on an edge the graph did not have, with its
+    # length and end node coordinates taken from the path's sections
+    sections = [value for key, value in path_data.items() if 'section' in key]
+    coords = [section['coords'] for section in sections if 'coords' in section]
+    if coords:
+        for node, (lon, lat) in ((u, coords[0][:2]), (v, coords[-1][2:])):
+            if node not in G:
+                G.add_node(node, x=lon, y=lat)
+    G.add_edge(
+        u, v, key=0, length=sum(section['distance'] for section in sections), osmid=path_data.get('osmid'),
+        added_by_update=True,
+    )
+
+
+def _route_cache_costs(affected_rows: dict, edge_weights: list) -> dict:
+    # Cost of each affected (u, v) in a CSR graph: its cheapest parallel edge
+    return {edge: min(edge_weights[i] for i in rows) for edge, rows in affected_rows.items()}
+
+
+def apply_map_update(G, map_data: dict, edge_index, delta: dict) -> tuple:
+    '''
+    Applies delta (see the module docstring) to a loaded network: G, its
+    map_data and the map's EdgeIndex, which is updated in place and takes a
+    new version. Returns (map_data, report). map_data is the same dict,
+    edited in place, or a new CompiledMap for a compiled one, so keep the
+    returned map. report counts the changed paths, affected edges, graph
+    edges added and removed, and the weightings and routing structures kept.
+    '''
+    changes = delta_changes(map_data, delta)
+    old_edges = {
+        path_key: path_edge(map_data[path_key]) if path_key in map_data else None for path_key in changes
+    }
+    old_version = edge_index.version
+
+    if hasattr(map_data, 'path_weight_inputs'):
+        map_data = update_compiled_map(map_data, changes)
+    else:
+        for path_key, path_data in changes.items():
+            if path_data is None:
+                del map_data[path_key]
+            else:
+                map_data[path_key] = path_data
+    affected = edge_index.update(map_data, old_edges)
+
+    # An edge is added for a path on a new (u, v), and only the edges added
+    # this way are removed once no path runs on them
+    to_add = [(u, v) for u, v in affected if (u, v) in edge_index and not G.has_edge(u, v)]
+    to_remove = [
+        (u, v, k) for u, v in affected if (u, v) not in edge_index and G.has_edge(u, v)
+        for k, data in G[u][v].items() if data.get('added_by_update')
+    ]
+    edge_order = None
+    if to_add or to_remove:
+        old_positions = {edge: i for i, edge in enumerate(G.edges(keys=True))}
+        G.remove_edges_from(to_remove)
+        for u, v in to_add:
+            _new_graph_edge(G, u, v, edge_index.first_path(u, v)[1])
+        edge_order = np.array([old_positions.get(edge, -1) for edge in G.edges(keys=True)], dtype=np.int64)
+
+    changed = [
+        (i, u, v, data) for i, (u, v, k, data) in enumerate(G.edges(keys=True, data=True)) if (u, v) in affected
+    ]
+    key_map = wi.refresh_edge_weights(G, map_data, edge_index, old_version, changed, edge_order)
+
+    # CSR graphs of the refreshed weightings keep their arrays with patched
+    # costs while the graph's edges stay the same; everything else built on
+    # the old version is dropped
+    affected_rows = {}
+    for i, u, v, data in changed:
+        affected_rows.setdefault((u, v), []).append(i)
+    csr_patched = 0
+    csr_cache = {}
+    for (weights_key, weight), csr in G.graph.get('csr_cache', {}).items():
+        if weights_key[0] != old_version:
+            csr_cache[(weights_key, weight)] = csr
+        elif weights_key in key_map and edge_order is None and weight == 'weight':
+            new_key = key_map[weights_key]
+            if csr.update_costs(_route_cache_costs(affected_rows, G.graph['weight_cache'][new_key])):
+                csr_cache[(new_key, weight)] = csr
+                csr_patched += 1
+    if 'csr_cache' in G.graph:
+        G.graph['csr_cache'] = csr_cache
+
+    ch_dropped = 0
+    if 'ch_cache' in G.graph:
+        ch_cache = {key: ch for key, ch in G.graph['ch_cache'].items() if key[0][0] != old_version}
+        ch_dropped = len(G.graph['ch_cache']) - len(ch_cache)
+        G.graph['ch_cache'] = ch_cache
+
+    report = {
+        'paths': len(changes),
+        'edges': len(affected),
+        'graph_edges_added': len(to_add),
+        'graph_edges_removed': len(to_remove),
+        'weightings': len(key_map),
+        'csr_patched': csr_patched,
+        'ch_dropped': ch_dropped,
+    }
+    return map_data, report
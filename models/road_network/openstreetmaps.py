@@ -1,8 +1,8 @@
 import osmnx as ox
-import requests
 import pandas as pd
 import graph as gr
 import numpy as np
+import data_collection.data_acquisition.elevation_source as es
 
 central_point = (51.456127, -2.608071) #latitude, longitude
 
@@ -12,22 +12,17 @@ nodes = ox.graph_to_gdfs(G, edges=False)
 nodes['osmid'] = nodes.index
 edges = ox.graph_to_gdfs(G, nodes=False)
 
+_elevation_source = es.CachedElevation(es.OpenTopoData('aster30m'), es.ELEVATION_CACHE_FILE)
+
 def get_elevation(lat, lon):
     """
     Hits the open top data api to get elevation data for a specific point
-    # """
-    # url = f"https://api.open-elevation.com/api/v1/lookup?locations={lat},{lon}"
-
-    url = f"https://api.opentopodata.org/v1/aster30m?locations={lat},{lon}"
-    response = requests.get(url)
-    if response.status_code == 200:
-        data = response.json()
-        if "results" in data:
-            return data['results'][0]['elevation']
-        else:
-            return None
-    else:
-        print(f"Error fetching elevation: {response.status_code}")
+    Lookups go through a persistent cache, so each point is only requested once.
+    """
+    try:
+        return _elevation_source.elevation(lat, lon)
+    except Exception as e:
+        print(f"Error fetching elevation: {e}")
         return None
     
 def get_elevation_diff(u,v):
@@ -0,0 +1,94 @@
+'''
+On-disk snapshot of the built road network.
+The graph, the compiled map data, its EdgeIndex, precomputed edge weights and
+the contraction hierarchy of each snapshot weighting are pickled together under a content hash of the source files, so a new process
+(or every worker of a parallel run) loads them instead of rebuilding from the
+CSV/JSON. Changing any source file changes the hash and triggers a rebuild.
+'''
+import glob
+import hashlib
+import json
+import os
+import pickle
+import models.road_network.create_graph as cg
+import models.weighting.weight_integration as wi
+from models.road_network.compiled_map import compile_map_data
+from models.road_network.contraction import ch_for_graph
+from models.road_network.edge_index import EdgeIndex
+
+# Bump when the snapshot contents or the way they are built changes
+SNAPSHOT_VERSION = 5
+SNAPSHOT_DIR = os.path.join(os.path.dirname(__file__), 'cache')
+SNAPSHOT_WEIGHT_TYPES = ('distance', 'objective')
+
+
+def source_hash(*file_paths) -> str:
+    '''
+    SHA-256 over the snapshot version and the contents of every source file.
+    '''
+    digest = hashlib.sha256(f'snapshot-v{SNAPSHOT_VERSION}'.encode())
+    for file_path in file_paths:
+        with open(file_path, 'rb') as file:
+            for chunk in iter(lambda: file.read(1 << 20), b''):
+                digest.update(chunk)
+    return digest.hexdigest()
+
+
+def snapshot_name(map_data_file: str) -> str:
+    return 'snapshot_' + os.path.splitext(os.path.basename(map_data_file))[0]
+
+
+def snapshot_path(map_data_file: str, content_hash: str, snapshot_dir: str = SNAPSHOT_DIR) -> str:
+    return os.path.join(snapshot_dir, f'{snapshot_name(map_data_file)}_{content_hash[:16]}.pkl')
+
+
+def build_network(road_network_file: str, map_data_file: str, weights_file: str = None) -> dict:
+    '''
+    Builds everything a snapshot holds from the source files.
+    '''
+    graph = cg.create_osmnx_compatible_graph(road_network_file, lazy_geometry=True)
+    with open(map_data_file, 'r') as file:
+        map_data = compile_map_data(json.load(file))
+    edge_index = EdgeIndex(map_data)
+
+    if weights_file is not None:
+        with open(weights_file, 'r') as file:
+            weights = json.load(file)
+        # Leave every snapshot weighting, and its contraction hierarchy, in the graph's caches
+        for weights_type in SNAPSHOT_WEIGHT_TYPES:
+            wi.get_weighted_graph(graph, map_data, weights, weights_type, edge_index=edge_index)
+            ch_for_graph(graph)
+
+    return {'graph': graph, 'map_data': map_data, 'edge_index': edge_index}
+
+
+def load_network(road_network_file: str, map_data_file: str, weights_file: str = None,
+                 snapshot_dir: str = SNAPSHOT_DIR, rebuild: bool = False) -> tuple:
+    '''
+    Returns (graph, map_data, edge_index) from the snapshot matching the current
+    source files, building and saving a new snapshot if there is none.
+    map_data comes back as a CompiledMap.
+    '''
+    sources = [road_network_file, map_data_file] + ([weights_file] if weights_file else [])
+    target = snapshot_path(map_data_file, source_hash(*sources), snapshot_dir)
+
+    network = None
+    if not rebuild and os.path.exists(target):
+        try:
+            with open(target, 'rb') as file:
+                network = pickle.load(file)
+        except (OSError, pickle.UnpicklingError, EOFError, AttributeError, ImportError):
+            network = None
+
+    if network is None:
+        network = build_network(road_network_file, map_data_file, weights_file)
+        os.makedirs(snapshot_dir, exist_ok=True)
+        # Older snapshots of this map are for other source contents; only the current one is kept
+        for old in glob.glob(os.path.join(snapshot_dir, snapshot_name(map_data_file) + '_*.pkl')):
+            os.remove(old)
+        temp_path = target + '.tmp'
+        with open(temp_path, 'wb') as file:
+            pickle.dump(network, file, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(temp_path, target)
+
+    return network['graph'], network['map_data'], network['edge_index']
@@ -1,11 +1,69 @@
+import numpy as np
+
+
+def _ragged(values) -> bool:
+    # A list of per-route sequences, as opposed to one route's list of numbers
+    return isinstance(values, (list, tuple)) and len(values) > 0 and np.ndim(values[0]) == 1
+
+def capacity_loss(current_list, consumptions, times, OCV, Capacity, base_k = 0.200, c_rate_exp = 0.2286):
+    '''Array version of route_analysis: the capacity trajectory is a cumulative sum
+    of consumption / OCV and the loss is k * c^n * cycle_fraction over all sections at once.
+
+    Inputs
+        current_list, consumptions, times: per-section current (A), energy (Wh) and time (s), as
+            1-D arrays for one route,
+            2-D arrays (routes x sections) for a batch of equal-length routes, or
+            lists of 1-D arrays for a ragged batch
+        OCV: Nominal open circuit voltage
+        Capacity: Battery capacity at the start of the route, or one per route
+    Output:
+        capacity_loss: expected capacity loss in Ah, one per route for a batch
+    '''
+    if _ragged(current_list):
+        lengths = np.array([len(route) for route in current_list])
+        starts = np.concatenate(([0], np.cumsum(lengths)[:-1]))
+        current = np.concatenate([np.asarray(route, dtype=float) for route in current_list])
+        consumption = np.concatenate([np.asarray(route, dtype=float) for route in consumptions])
+        time = np.concatenate([np.asarray(route, dtype=float) for route in times])
+        initial_capacity = np.repeat(np.broadcast_to(np.asarray(Capacity, dtype=float), lengths.shape), lengths)
+
+        # Cumulative consumption restarted at the start of every route; the
+        # leading 0 keeps the offset of empty routes (even a last one) in range
+        used = np.cumsum(consumption / OCV)
+        used -= np.repeat(np.concatenate(([0.0], used))[starts], lengths)
+        capacity = initial_capacity - used
+        with np.errstate(divide='ignore', invalid='ignore'):
+            c_rate = np.where(capacity > 0, current / capacity, np.inf)
+            section_loss = base_k * (c_rate ** c_rate_exp) * ((time / 3600) * c_rate)
+        route_loss = np.zeros(len(lengths))
+        has_sections = lengths > 0
+        if has_sections.any():
+            route_loss[has_sections] = np.add.reduceat(section_loss, starts[has_sections])
+        return route_loss
+
+    current = np.asarray(current_list, dtype=float)
+    consumption = np.asarray(consumptions, dtype=float)
+    time = np.asarray(times, dtype=float)
+    initial_capacity = np.asarray(Capacity, dtype=float)
+    if current.ndim == 2:
+        initial_capacity = np.broadcast_to(initial_capacity, current.shape[:1])[:, None]
+
+    capacity = initial_capacity - np.cumsum(consumption / OCV, axis=-1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        c_rate = np.where(capacity > 0, current / capacity, np.inf)
+        section_loss = base_k * (c_rate ** c_rate_exp) * ((time / 3600) * c_rate)
+    loss = section_loss.sum(axis=-1)
+    return float(loss) if current.ndim == 1 else loss
+
+
 
 def route_analysis(detailed_results, current_list, consumptions, OCV, Capacity, base_k = 0.200 ,c_rate_exp = 0.2286):
     '''Take in a specific route and calculate the expected capacity loss due to degradation  through the route.
     
     Inputs
+        detailed_results: per-path section results, supplying the time spent along each section
         current_list: list of current consumption through route
         consumptions: list of energy consumptions through route
-        times: list of times spent along each section
         OCV: Nominal open circuit voltage
         Capacity: Original battery capacity
     Output:
@@ -28,57 +86,14 @@ def route_analysis(detailed_results, current_list, consumptions, OCV, Capacity,
         
         return time_list
 
-    def calc_capacity_reduction(consumption):
-        loss = consumption/OCV
-        return loss
-
-    def update_capacity_with_loss(current_list, consumptions, initial_capacity, OCV):
-        # Initialize the capacity list with the initial capacity
-        capacity_list = [initial_capacity]
-        c_rates_list = []
-        
-        # For each step, calculate the loss and update the capacity
-        for i in range(len(consumptions)):
-            # Calculate capacity loss from the consumption
-            loss = calc_capacity_reduction(consumptions[i])
-            
-            # Update the capacity by subtracting the loss
-            current_capacity = capacity_list[-1] - loss
-            capacity_list.append(current_capacity)
-            
-            # Calculate C-rate using the current capacity (not the initial one)
-            c_rate = current_list[i] / current_capacity if current_capacity > 0 else float('inf')
-            c_rates_list.append(c_rate)
-        
-        # Remove the initial capacity as it's not associated with any consumption
-        capacity_list.pop(0)
-        
-        return capacity_list, c_rates_list
-
-
-    capacity_list, c_rates_list = update_capacity_with_loss(current_list, consumptions, Capacity, OCV)
-    # ----------------------------------------
-    # Capacity Loss Calculation
-    # ----------------------------------------
-    
-    def compute_capacity_loss(c_rate_list, time_list, k=base_k, n=c_rate_exp):
-        """
-        Computes total capacity loss based on an empirical degradation model.
-        
-        cap_loss = k * (C-rate ^ n) * cycle_fraction
-        """
-        cap_losses = []
-        
-        for c_rate, time in zip(c_rate_list, time_list):
-            cycle_fraction = (time / 3600) * c_rate  # Convert time from seconds to cycles
-            cap_loss = k * (c_rate ** n) * cycle_fraction
-            cap_losses.append(cap_loss)
-
-        return sum(cap_losses)
-
-    # Calculate capacity loss
-    cap_loss = compute_capacity_loss(c_rates_list, extract_times(detailed_results))
-
-    return cap_loss
-
+    # Compact results (simulate_routes.return_route_data_complex(compact=True)) carry a times array
+    times = getattr(detailed_results, 'times', None)
+    if times is None:
+        times = extract_times(detailed_results)
 
+    # Sections without a time (or a consumption) don't contribute to the loss
+    n_sections = min(len(consumptions), len(times))
+    return capacity_loss(
+        current_list[:n_sections], consumptions[:n_sections], times[:n_sections],
+        OCV, Capacity, base_k, c_rate_exp
+    )
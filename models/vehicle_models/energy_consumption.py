@@ -385,6 +385,237 @@ def calculate_segment_energy_with_acceleration(v_initial, v_target, segment_data
             "avg_c_rate": avg_c_rate,
             "reached_target": will_reach_target
         }
+# Section modes of calculate_sections_energy, one per branch of calculate_segment_energy_with_acceleration
+MODE_STOPPED = 0     # can't accelerate from rest
+MODE_CONSTANT = 1    # no acceleration, constant velocity
+MODE_PARTIAL = 2     # still accelerating at the end of the section
+MODE_TWO_PHASE = 3   # acceleration phase then constant velocity phase
+# Sections per chunk in calculate_sections_energy, sized so the working arrays stay in cache
+SECTION_CHUNK = 16384
+
+def _discharge_currents(OCV, R_i, P_batt):
+    # discharge_current over arrays
+    P_max = OCV**2 / (4*R_i)
+    with np.errstate(invalid='ignore'):
+        I_l = (OCV - np.sqrt(OCV**2 - 4*R_i*P_batt)) / (2*R_i)
+    return np.where(P_batt > P_max, OCV / (2*R_i), I_l)
+
+def calculate_sections_energy(v_initial, v_target, distance, avg_incline_angle, vehicle_data, static_data, max_motor_power, motor_efficiency, OCV, R_i, Q):
+    """
+    calculate_segment_energy_with_acceleration for many sections at once, each
+    with its own initial velocity. Sections are sorted by which branch of the
+    scalar function applies and each branch is evaluated only over its own
+    sections.
+
+    Parameters:
+    v_initial (array): Initial velocity of each section in m/s
+    v_target (float or array): Target velocity in m/s
+    distance (array): Section distances in meters
+    avg_incline_angle (array): Section inclines in degrees
+    vehicle_data, static_data, max_motor_power, motor_efficiency, OCV, R_i, Q:
+        as for calculate_segment_energy_with_acceleration
+
+    Returns:
+    dict of arrays, one entry per section:
+        mode: which branch applied (MODE_STOPPED, MODE_CONSTANT, MODE_PARTIAL, MODE_TWO_PHASE)
+        initial_velocity, final_velocity, acceleration, time, energy (Wh), reached_target
+        current, c_rate: peak values (the single value outside MODE_TWO_PHASE)
+        avg_current, avg_c_rate: time-weighted averages
+        accel_*/const_* (distance, time, energy, current, c_rate): phases of
+            MODE_TWO_PHASE sections, NaN elsewhere
+    """
+    v_initial = np.asarray(v_initial, dtype=float)
+    distance = np.asarray(distance, dtype=float)
+    avg_incline_angle = np.asarray(avg_incline_angle, dtype=float)
+    v_target = np.broadcast_to(np.asarray(v_target, dtype=float), v_initial.shape)
+    n = len(v_initial)
+    if n <= SECTION_CHUNK:
+        return _sections_energy(v_initial, v_target, distance, avg_incline_angle, vehicle_data, static_data, max_motor_power, motor_efficiency, OCV, R_i, Q)
+
+    # Long inputs run in cache-sized chunks, which is several times faster than one pass
+    results = None
+    for start in range(0, n, SECTION_CHUNK):
+        chunk = slice(start, start + SECTION_CHUNK)
+        part = _sections_energy(
+            v_initial[chunk], v_target[chunk], distance[chunk], avg_incline_angle[chunk],
+            vehicle_data, static_data, max_motor_power, motor_efficiency, OCV, R_i, Q
+        )
+        if results is None:
+            results = {name: np.empty(n, dtype=values.dtype) for name, values in part.items()}
+        for name, values in part.items():
+            results[name][chunk] = values
+    return results
+
+def _sections_energy(v_initial, v_target, distance, avg_incline_angle, vehicle_data, static_data, max_motor_power, motor_efficiency, OCV, R_i, Q):
+    # calculate_sections_energy for one chunk of array inputs
+    mass = vehicle_data["mass"]
+    drag_factor = 0.5 * static_data["air_dens"] * vehicle_data["frontal_area"] * vehicle_data["drag_coeff"]
+
+    angle = np.radians(avg_incline_angle)
+    # Gravity plus rolling resistance, the velocity independent forces
+    incline_force = mass * static_data["grav_acc"] * np.sin(angle)
+    incline_force += mass * static_data["grav_acc"] * np.cos(angle) * vehicle_data["roll_res"]
+
+    def battery_power(velocity, acceleration, index):
+        # physical_model and battery_power_model for the sections in index
+        tract_force = drag_factor * velocity**2 + incline_force[index]
+        if acceleration is not None:
+            tract_force += mass * acceleration
+        return np.maximum(0, tract_force * velocity) / motor_efficiency
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        # calculate_actual_acceleration, using the average velocity for the power limit
+        required_accel = (v_target**2 - v_initial**2) / (2 * distance)
+        avg_velocity = (v_initial + v_target) / 2
+        maintain_power = (drag_factor * avg_velocity**2 + incline_force) * avg_velocity
+        max_accel = np.maximum(0, max_motor_power - maintain_power) / (mass * np.where(avg_velocity > 0, avg_velocity, 0.1))
+        will_reach_target = required_accel <= max_accel
+        accel = np.where(will_reach_target, required_accel, max_accel)
+        v_final = np.where(will_reach_target, v_target, np.sqrt(v_initial**2 + 2 * max_accel * distance))
+
+    n = len(v_initial)
+    mode = np.full(n, MODE_CONSTANT, dtype=np.int8)
+    mode[(accel <= 0) & (v_initial <= 0)] = MODE_STOPPED
+    moving = np.flatnonzero(accel > 0)
+    accel_time = (v_final[moving] - v_initial[moving]) / accel[moving]
+    accel_distance = v_initial[moving] * accel_time + 0.5 * accel[moving] * accel_time**2
+    partial_phase = accel_distance >= distance[moving]
+    mode[moving] = np.where(partial_phase, MODE_PARTIAL, MODE_TWO_PHASE)
+
+    results = {
+        'mode': mode,
+        'initial_velocity': v_initial.copy(),
+        'final_velocity': v_initial.copy(),
+        'acceleration': np.zeros(n),
+        'time': np.full(n, np.inf),
+        'energy': np.zeros(n),
+        'reached_target': np.zeros(n, dtype=bool),
+        'current': np.zeros(n),
+        'c_rate': np.zeros(n),
+    }
+    phase_names = ('distance', 'time', 'energy', 'current', 'c_rate')
+    for prefix in ('accel_', 'const_'):
+        for name in phase_names:
+            results[prefix + name] = np.full(n, np.nan)
+
+    # Stopped: can't accelerate from rest, nothing moves
+    stopped = mode == MODE_STOPPED
+    results['initial_velocity'][stopped] = 0
+    results['final_velocity'][stopped] = 0
+
+    # Constant velocity at the initial velocity
+    index = np.flatnonzero(mode == MODE_CONSTANT)
+    v = v_initial[index]
+    power = battery_power(v, None, index)
+    time = distance[index] / v
+    results['time'][index] = time
+    results['energy'][index] = power * time / 3600
+    results['current'][index] = _discharge_currents(OCV, R_i, power)
+
+    # Still accelerating at the end of the section
+    index = moving[partial_phase]
+    v, a = v_initial[index], accel[index]
+    final = np.sqrt(v**2 + 2 * a * distance[index])
+    time = (final - v) / a
+    power = battery_power(np.maximum(0.1, (v + final) / 2), a, index)
+    results['final_velocity'][index] = final
+    results['acceleration'][index] = a
+    results['time'][index] = time
+    results['energy'][index] = power * time / 3600
+    results['reached_target'][index] = final >= v_target[index]
+    results['current'][index] = _discharge_currents(OCV, R_i, power)
+
+    # Acceleration phase then constant velocity phase
+    index = moving[~partial_phase]
+    v, a, final = v_initial[index], accel[index], v_final[index]
+    phase_time = accel_time[~partial_phase]
+    phase_distance = accel_distance[~partial_phase]
+    accel_power = battery_power(np.maximum(0.1, (v + final) / 2), a, index)
+    const_distance = distance[index] - phase_distance
+    with np.errstate(divide='ignore', invalid='ignore'):
+        const_time = np.where(final > 0, const_distance / final, 0)
+    const_power = battery_power(final, None, index)
+    phases = {
+        'accel_': (phase_distance, phase_time, accel_power),
+        'const_': (const_distance, const_time, const_power),
+    }
+    for prefix, (phase_distance, phase_time, phase_power) in phases.items():
+        current = _discharge_currents(OCV, R_i, phase_power)
+        results[prefix + 'distance'][index] = phase_distance
+        results[prefix + 'time'][index] = phase_time
+        results[prefix + 'energy'][index] = phase_power * phase_time / 3600
+        results[prefix + 'current'][index] = current
+        results[prefix + 'c_rate'][index] = find_crate(current, Q)
+    results['final_velocity'][index] = final
+    results['acceleration'][index] = a
+    results['time'][index] = results['accel_time'][index] + results['const_time'][index]
+    results['energy'][index] = results['accel_energy'][index] + results['const_energy'][index]
+    results['reached_target'][index] = will_reach_target[index]
+    results['current'][index] = np.maximum(results['accel_current'][index], results['const_current'][index])
+
+    results['c_rate'] = find_crate(results['current'], Q)
+    results['c_rate'][index] = np.maximum(results['accel_c_rate'][index], results['const_c_rate'][index])
+    with np.errstate(invalid='ignore'):
+        results['avg_current'] = results['current'].copy()
+        results['avg_c_rate'] = results['c_rate'].copy()
+        total_time = results['time'][index]
+        results['avg_current'][index] = (
+            results['accel_current'][index] * results['accel_time'][index]
+            + results['const_current'][index] * results['const_time'][index]
+        ) / total_time
+        results['avg_c_rate'][index] = (
+            results['accel_c_rate'][index] * results['accel_time'][index]
+            + results['const_c_rate'][index] * results['const_time'][index]
+        ) / total_time
+    return results
+
+def calculate_route_energy(distance, avg_incline_angle, reset, v_target, vehicle_data, static_data, max_motor_power, motor_efficiency, OCV, R_i, Q):
+    """
+    Energy model for a whole sequence of sections, carrying the final velocity
+    of each section into the next as process_route_segments does.
+
+    Parameters:
+    distance, avg_incline_angle (array): Section distances (m) and inclines (degrees)
+    reset (array of bool): True where velocity drops to 0 before the section
+        (start of a route, or of a path that isn't smooth). Several routes can be
+        concatenated into one call with reset set at each route's first section.
+    v_target and the remaining parameters: as for calculate_sections_energy
+
+    Returns:
+    dict of arrays, as calculate_sections_energy
+    """
+    distance = np.asarray(distance, dtype=float)
+    avg_incline_angle = np.asarray(avg_incline_angle, dtype=float)
+    reset = np.asarray(reset, dtype=bool).copy()
+    if len(reset):
+        reset[0] = True
+    v_target = np.broadcast_to(np.asarray(v_target, dtype=float), distance.shape)
+
+    def sections(index, v_initial):
+        return calculate_sections_energy(
+            v_initial, v_target[index], distance[index], avg_incline_angle[index],
+            vehicle_data, static_data, max_motor_power, motor_efficiency, OCV, R_i, Q
+        )
+
+    # The carried velocity is resolved by repeated vectorised passes: start
+    # every section at the target velocity (or 0 after a reset), then recompute
+    # only the sections whose carried-in velocity changed. Each pass fixes at
+    # least one more section of every chain, and a chain ends as soon as a
+    # section finishes at exactly the target velocity, so this settles in a few
+    # passes and reproduces the sequential result exactly.
+    v_initial = np.where(reset, 0.0, v_target)
+    results = sections(slice(None), v_initial)
+    for _ in range(len(distance)):
+        carried = np.concatenate(([0.0], results['final_velocity'][:-1]))
+        carried[reset] = 0.0
+        changed = np.flatnonzero(carried != v_initial)
+        if not len(changed):
+            break
+        v_initial[changed] = carried[changed]
+        for name, values in sections(changed, v_initial[changed]).items():
+            results[name][changed] = values
+    return results
+
 # Example usage:
 def process_route_segments(segments, vehicle_data, static_data, target_velocity, max_motor_power, motor_efficiency, OCV, R_i, Q):
     """
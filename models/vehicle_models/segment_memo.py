@@ -0,0 +1,203 @@
+'''
+Memoised section energy.
+The same map sections come up again and again across routes, entered at rest
+or at the target velocity, so calculate_segment_energy_with_acceleration is
+mostly recomputing results it has seen before. SegmentEnergyMemo keeps them in
+an LRU keyed by the inputs the physics depends on: the entry and target
+velocities, the section distance and incline, and the vehicle and battery
+parameters.
+
+With tolerance=0 the key is exact and results are identical to the direct
+call. A tolerance > 0 bounds the relative error of the results (exit
+velocity, time and energy per metre, discharge current) instead, letting
+nearby sections share an entry. The inputs are snapped to a grid: the
+distance to relative steps of tolerance, an entry velocity between rest and
+v_target to steps of tolerance * v_target, and the incline to steps of
+tolerance * roll_res radians. The result for the grid point is returned with
+its distances, times and energies scaled to the actual distance, and its
+initial_velocity set to the actual entry velocity. It is only used where it
+differs from the neighbouring grid points on the input's side by at most
+tolerance (summed over the snapped inputs), so the input lies in a cell over
+which the results move by less than that. Next to the model's branch switches
+and on descents where the traction power is clipped to 0 they move further,
+and the exact result is computed instead. So are sections the vehicle
+accelerates over: it reaches its final velocity exactly at the section end,
+and whether the result takes the acceleration-only or the two-phase branch
+(with a different peak current) comes down to rounding of the actual inputs.
+stats() counts these exact calls.
+'''
+import math
+from collections import OrderedDict
+import models.vehicle_models.energy_consumption as ec
+
+# Entries kept by default
+SEGMENT_MEMO_SIZE = 65536
+# Result values proportional to the section distance, rescaled for a snapped distance
+EXTENSIVE_FIELDS = ('time', 'energy_consumption', 'total_time', 'total_energy')
+EXTENSIVE_PHASE_FIELDS = ('distance', 'time', 'energy')
+# Entry velocity, distance and incline: the inputs snapped by a tolerance
+SNAPPED_INPUTS = 3
+
+
+def parameter_key(vehicle_data: dict, static_data: dict, max_motor_power, motor_efficiency, OCV, R_i, Q) -> tuple:
+    '''
+    Hashable key of the vehicle, environment and battery parameters.
+    '''
+    return (
+        tuple(sorted(vehicle_data.items())), tuple(sorted(static_data.items())),
+        max_motor_power, motor_efficiency, OCV, R_i, Q,
+    )
+
+
+def _copy_result(result: dict, scale: float = 1.0) -> dict:
+    # Fresh dicts for the caller, with the extensive values scaled
+    copy = dict(result)
+    if scale != 1.0:
+        for field in EXTENSIVE_FIELDS:
+            if field in copy:
+                copy[field] = copy[field] * scale
+    for phase in ('acceleration_phase', 'constant_phase'):
+        if phase in copy:
+            copy[phase] = dict(copy[phase])
+            if scale != 1.0:
+                for field in EXTENSIVE_PHASE_FIELDS:
+                    copy[phase][field] = copy[phase][field] * scale
+    return copy
+
+
+def _measures(result: dict, distance: float) -> tuple:
+    # Results compared between grid points: exit velocity, time and energy per
+    # metre and the discharge current return_route_data_complex reads
+    time = result.get('total_time', result.get('time', 0))
+    energy = result.get('total_energy', result.get('energy_consumption', 0))
+    current = result.get('peak_discharge_current', result.get('avg_discharge_current', result.get('discharge_current', 0)))
+    return result['final_velocity'], time / distance, energy / distance, current
+
+
+def _relative_difference(a: float, b: float) -> float:
+    if a == b:
+        return 0.0
+    if not (math.isfinite(a) and math.isfinite(b)):
+        return math.inf
+    return abs(a - b) / max(abs(a), abs(b))
+
+
+class SegmentEnergyMemo:
+    '''
+    LRU memo of calculate_segment_energy_with_acceleration, called with the
+    same arguments (see the module docstring for tolerance). One memo can be
+    shared across vehicles and batteries, as their parameters are part of the
+    key. hits, misses and evictions count the grid lookups (including the
+    neighbours checked with a tolerance), exact_calls the results computed
+    exactly instead; see stats().
+    '''
+
+    def __init__(self, tolerance: float = 0.0, maxsize: int = SEGMENT_MEMO_SIZE):
+        if tolerance < 0:
+            raise ValueError("tolerance must be >= 0")
+        self.tolerance = tolerance
+        self.maxsize = maxsize
+        self._cache = OrderedDict()
+        self._log_step = math.log1p(tolerance) if tolerance > 0 else None
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.exact_calls = 0
+
+    def __len__(self):
+        return len(self._cache)
+
+    def _steps(self, v_initial, v_target, roll_res) -> tuple:
+        # Grid step of each snapped input, 0 where it is kept exact. Entry at
+        # rest or at the target velocity, the common cases, stays exact
+        v_step = self.tolerance * v_target if 0 < v_initial < v_target else 0
+        incline_step = math.degrees(self.tolerance * roll_res) if roll_res > 0 else 0
+        return v_step, self._log_step, incline_step
+
+    @staticmethod
+    def _point(index: tuple, steps: tuple, inputs: tuple) -> tuple:
+        # The (entry velocity, distance, incline) a grid index stands for
+        v_index, d_index, i_index = index
+        v_step, log_step, incline_step = steps
+        return (
+            v_index * v_step if v_step > 0 else inputs[0],
+            math.exp(d_index * log_step),
+            i_index * incline_step if incline_step > 0 else inputs[2],
+        )
+
+    def _lookup(self, key, v_point, v_target, d_point, i_point, args) -> dict:
+        result = self._cache.get(key)
+        if result is not None:
+            self.hits += 1
+            self._cache.move_to_end(key)
+            return result
+        self.misses += 1
+        point_data = {"distance": d_point, "avg_incline_angle": i_point}
+        result = ec.calculate_segment_energy_with_acceleration(v_point, v_target, point_data, *args)
+        self._cache[key] = result
+        if len(self._cache) > self.maxsize:
+            self._cache.popitem(last=False)
+            self.evictions += 1
+        return result
+
+    def __call__(self, v_initial, v_target, segment_data, vehicle_data, static_data, max_motor_power,
+                 motor_efficiency, OCV, R_i, Q) -> dict:
+        distance = segment_data["distance"]
+        incline = segment_data["avg_incline_angle"]
+        args = (vehicle_data, static_data, max_motor_power, motor_efficiency, OCV, R_i, Q)
+        parameters = parameter_key(*args)
+        if self._log_step is None or distance <= 0:
+            result = self._lookup(((v_initial, distance, incline), v_target, parameters),
+                                  v_initial, v_target, distance, incline, args)
+            return _copy_result(result)
+
+        inputs = (v_initial, distance, incline)
+        steps = self._steps(v_initial, v_target, vehicle_data.get("roll_res", 0))
+        index = (
+            round(v_initial / steps[0]) if steps[0] > 0 else v_initial,
+            round(math.log(distance) / steps[1]),
+            round(incline / steps[2]) if steps[2] > 0 else incline,
+        )
+        point = self._point(index, steps, inputs)
+        result = self._lookup((index, v_target, parameters), point[0], v_target, point[1], point[2], args)
+
+        # The neighbouring grid point on the input's side of each snapped input
+        measures = _measures(result, point[1])
+        error = math.inf if result["acceleration"] > 0 else 0.0
+        for axis in range(SNAPPED_INPUTS):
+            if error > self.tolerance:
+                break
+            if steps[axis] == 0 or inputs[axis] == point[axis]:
+                continue
+            neighbour = list(index)
+            neighbour[axis] += 1 if inputs[axis] > point[axis] else -1
+            neighbour = tuple(neighbour)
+            neighbour_point = self._point(neighbour, steps, inputs)
+            neighbour_result = self._lookup(
+                (neighbour, v_target, parameters), neighbour_point[0], v_target, neighbour_point[1], neighbour_point[2], args
+            )
+            error += max(
+                _relative_difference(a, b) for a, b in zip(measures, _measures(neighbour_result, neighbour_point[1]))
+            )
+        if error > self.tolerance:
+            self.exact_calls += 1
+            return ec.calculate_segment_energy_with_acceleration(v_initial, v_target, segment_data, *args)
+
+        result = _copy_result(result, distance / point[1] if point[1] != distance else 1.0)
+        result["initial_velocity"] = v_initial
+        return result
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'exact_calls': self.exact_calls,
+            'size': len(self._cache),
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+        }
+
+    def clear(self):
+        self._cache.clear()
+        self.hits = self.misses = self.evictions = self.exact_calls = 0
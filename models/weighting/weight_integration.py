@@ -1,9 +1,11 @@
 '''
 Integrating weight data with general csv data.
 '''
+import hashlib
 import random
 import numpy as np
 import models.weighting.weight_model as wm
+from models.road_network.edge_index import EdgeIndex
 
 
 def process_path_weight(path: dict) -> dict:
@@ -23,10 +25,11 @@ def process_path_weight(path: dict) -> dict:
         'distance': sum(distances),
         'zero_start': path.get('smooth', False)  # Use get with default value
     }
-def add_weights_to_graph(G, map_data:dict,weights_dict, weights_type='default', default_weight=1.0, save_weights = False):
+def add_weights_to_graph(G, map_data:dict,weights_dict, weights_type='default', default_weight=1.0, save_weights = False, edge_index=None):
     """
     Add weights to a graph based on an existing attribute or a default value.
     Optionally saves all weights to a JSON file for analysis.
+    Pass a prebuilt EdgeIndex for map_data to skip building one here.
     """
     import json
     import numpy as np
@@ -38,6 +41,9 @@ def add_weights_to_graph(G, map_data:dict,weights_dict, weights_type='default',
     attribute_weights = 0
     objective_function_calls = 0
     
+    # Weights applied here are not tracked by the cache in get_weighted_graph
+    G.graph.pop('weights_key', None)
+
     # Clear all existing weights first to ensure we're starting fresh
     for u, v, k, data in G.edges(keys=True, data=True):
         if 'weight' in data:
@@ -45,6 +51,9 @@ def add_weights_to_graph(G, map_data:dict,weights_dict, weights_type='default',
     
     # Create a list to store all edge weights
     all_weights = []
+
+    if edge_index is None:
+        edge_index = EdgeIndex(map_data)
     
     for u, v, k, data in G.edges(keys=True, data=True):
         weight_assigned = False
@@ -58,40 +67,39 @@ def add_weights_to_graph(G, map_data:dict,weights_dict, weights_type='default',
         }
         
         # First try to get weight from map_data (for specific paths)
-        for path, value in map_data.items():
-            if 'nodes' in value and len(value['nodes']) >= 2:
-                if u == value['nodes'][0] and v == value['nodes'][1]:
-                    # Custom path data found
-                    edge_record['has_custom_data'] = True
-                    edge_record['path_key'] = path
-                    
-                    # Process the path
-                    results = process_path_weight(value)
-                    edge_record['avg_incline'] = results['average_incline']
-                    edge_record['max_incline'] = results['max_incline']
-                    edge_record['distance'] = results['distance']
-                    edge_record['zero_start'] = results['zero_start']
-                    
-                    if weights_type == 'distance':
-                        weight = results['distance']
-                        edge_record['weight_source'] = 'custom_distance'
-                        
-                    elif weights_type == 'objective':
-                        weight = wm.calculate_path_weight(results, weights_dict)
-                        objective_function_calls += 1
-                        edge_record['weight_source'] = 'custom_objective'
-                        
-                    else:
-                        # Default
-                        weight = default_weight
-                        edge_record['weight_source'] = 'custom_default'
-                    
-                    G[u][v][k]['weight'] = weight
-                    edge_record['weight'] = weight
-                    weight_assigned = True
-                    custom_weights += 1
-                    break
-        
+        match = edge_index.first_path(u, v)
+        if match is not None:
+            path, value = match
+            # Custom path data found
+            edge_record['has_custom_data'] = True
+            edge_record['path_key'] = path
+
+            # Process the path
+            results = process_path_weight(value)
+            edge_record['avg_incline'] = results['average_incline']
+            edge_record['max_incline'] = results['max_incline']
+            edge_record['distance'] = results['distance']
+            edge_record['zero_start'] = results['zero_start']
+
+            if weights_type == 'distance':
+                weight = results['distance']
+                edge_record['weight_source'] = 'custom_distance'
+
+            elif weights_type == 'objective':
+                weight = wm.calculate_path_weight(results, weights_dict)
+                objective_function_calls += 1
+                edge_record['weight_source'] = 'custom_objective'
+
+            else:
+                # Default
+                weight = default_weight
+                edge_record['weight_source'] = 'custom_default'
+
+            G[u][v][k]['weight'] = weight
+            edge_record['weight'] = weight
+            weight_assigned = True
+            custom_weights += 1
+
         # If no custom weight was assigned, use length attribute or default
         if not weight_assigned:
             if weights_type == 'distance' and 'length' in data:
@@ -151,4 +159,226 @@ def add_weights_to_graph(G, map_data:dict,weights_dict, weights_type='default',
         
         print(f"Weights saved to {output_file}")
     
-    return G
\ No newline at end of file
+    return G
+
+
+# Per-edge weight model inputs kept by edge_weight_inputs
+INPUT_NAMES = ('has_custom_data', 'has_length', 'average_incline', 'max_incline', 'distance', 'zero_start')
+
+
+def _fill_edge_inputs(inputs: dict, edges, map_data:dict, edge_index):
+    # Sets the inputs of the (i, u, v, data) edges, i being the edge's position
+    # in G.edges(keys=True) order
+    edges = list(edges)
+    rows = np.array([i for i, _, _, _ in edges], dtype=np.int64)
+    inputs['has_custom_data'][rows] = False
+    inputs['has_length'][rows] = False
+    inputs['average_incline'][rows] = 0
+    inputs['max_incline'][rows] = 0
+    inputs['distance'][rows] = 0
+    inputs['zero_start'][rows] = True
+
+    matched = []
+    for i, u, v, data in edges:
+        path_keys = edge_index.path_keys(u, v)
+        if path_keys:
+            inputs['has_custom_data'][i] = True
+            matched.append((i, path_keys[0]))
+        elif 'length' in data:
+            inputs['has_length'][i] = True
+            inputs['distance'][i] = data['length']
+    if not matched:
+        return inputs
+
+    if hasattr(map_data, 'path_weight_inputs'):
+        rows = np.array([i for i, _ in matched], dtype=np.int64)
+        path_inputs = map_data.path_weight_inputs([map_data.path_index[path] for _, path in matched])
+        for name in ('average_incline', 'max_incline', 'distance', 'zero_start'):
+            inputs[name][rows] = path_inputs[name]
+        return inputs
+
+    path_results = {}
+    for i, path in matched:
+        if path not in path_results:
+            path_results[path] = process_path_weight(map_data[path])
+        results = path_results[path]
+        inputs['average_incline'][i] = results['average_incline']
+        inputs['max_incline'][i] = results['max_incline']
+        inputs['distance'][i] = results['distance']
+        inputs['zero_start'][i] = bool(results['zero_start'])
+    return inputs
+
+
+def edge_weight_inputs(G, map_data:dict, edge_index=None) -> dict:
+    '''
+    Per-edge inputs to the weight model, as arrays in G.edges(keys=True) order.
+    Edges with a map_data path use process_path_weight on its first path; other
+    edges fall back to their 'length' attribute, as in add_weights_to_graph.
+    Cached on the graph for the current EdgeIndex version. A CompiledMap's
+    per-path inputs are read straight from its arrays.
+    '''
+    if edge_index is None:
+        edge_index = EdgeIndex(map_data)
+    cached = G.graph.get('weight_inputs')
+    if cached is not None and cached['version'] == edge_index.version and len(cached['distance']) == G.number_of_edges():
+        return cached
+
+    n_edges = G.number_of_edges()
+    inputs = {
+        'version': edge_index.version,
+        'has_custom_data': np.zeros(n_edges, dtype=bool),
+        'has_length': np.zeros(n_edges, dtype=bool),
+        'average_incline': np.zeros(n_edges),
+        'max_incline': np.zeros(n_edges),
+        'distance': np.zeros(n_edges),
+        'zero_start': np.ones(n_edges, dtype=bool),
+    }
+    edges = ((i, u, v, data) for i, (u, v, k, data) in enumerate(G.edges(keys=True, data=True)))
+    _fill_edge_inputs(inputs, edges, map_data, edge_index)
+
+    G.graph['weight_inputs'] = inputs
+    return inputs
+
+
+def _weights_from_inputs(inputs: dict, weights_dict, weights_type='default', default_weight=1.0, rows=None) -> np.ndarray:
+    # Weights of every edge, or of the edges at rows, from edge_weight_inputs
+    if rows is not None:
+        inputs = {name: inputs[name][rows] for name in INPUT_NAMES}
+    weights = np.full(len(inputs['distance']), float(default_weight))
+    has_weight_data = inputs['has_custom_data'] | inputs['has_length']
+
+    if weights_type == 'distance':
+        weights[has_weight_data] = inputs['distance'][has_weight_data]
+    elif weights_type == 'objective':
+        objective = wm.calculate_path_weights(
+            inputs['average_incline'], inputs['max_incline'],
+            inputs['distance'], inputs['zero_start'], weights_dict
+        )
+        weights[has_weight_data] = objective[has_weight_data]
+    return weights
+
+
+def compute_edge_weights(G, map_data:dict, weights_dict, weights_type='default', default_weight=1.0, edge_index=None) -> list:
+    '''
+    Edge weights in G.edges(keys=True) order, matching add_weights_to_graph,
+    but with the objective weights computed in one batched call.
+    '''
+    inputs = edge_weight_inputs(G, map_data, edge_index)
+    return _weights_from_inputs(inputs, weights_dict, weights_type, default_weight).tolist()
+
+
+# Number of weightings kept per graph by get_weighted_graph
+WEIGHT_CACHE_SIZE = 16
+
+
+def weights_hash(weights_dict) -> str:
+    '''
+    Stable digest of a weights_dict (unlike hash(), the same in every process).
+    '''
+    weights_items = tuple(sorted((key, float(value)) for key, value in weights_dict.items())) if weights_dict else ()
+    return hashlib.sha1(repr(weights_items).encode()).hexdigest()
+
+
+def weights_cache_key(edge_index, weights_dict, weights_type='default', default_weight=1.0) -> tuple:
+    '''
+    Key identifying one weighting of a graph: the map_data version (from its
+    EdgeIndex), the weights type and the weights_dict contents.
+    '''
+    return (edge_index.version, weights_type, weights_hash(weights_dict), default_weight)
+
+
+def get_weighted_graph(G, map_data:dict, weights_dict, weights_type='default', default_weight=1.0, edge_index=None):
+    '''
+    Cached version of add_weights_to_graph.
+    Weight arrays are kept on the graph (G.graph['weight_cache']), keyed by
+    weights_cache_key, so repeated calls with the same map, weights type and
+    weights_dict reuse them instead of recomputing every edge weight. If the
+    graph already carries the requested weights nothing is done at all.
+    '''
+    if edge_index is None:
+        edge_index = EdgeIndex(map_data)
+    key = weights_cache_key(edge_index, weights_dict, weights_type, default_weight)
+
+    if G.graph.get('weights_key') == key:
+        return G
+
+    cache = G.graph.setdefault('weight_cache', {})
+    edge_weights = cache.pop(key, None)
+    if edge_weights is None or len(edge_weights) != G.number_of_edges():
+        edge_weights = compute_edge_weights(G, map_data, weights_dict, weights_type, default_weight, edge_index)
+    for (u, v, k, data), weight in zip(G.edges(keys=True, data=True), edge_weights):
+        data['weight'] = weight
+
+    # Most recently used last, drop the oldest once full
+    cache[key] = edge_weights
+    while len(cache) > WEIGHT_CACHE_SIZE:
+        cache.pop(next(iter(cache)))
+    # The weights_dict of each cached weighting, so refresh_edge_weights can recompute its edges
+    weights_dicts = G.graph.setdefault('weights_dicts', {})
+    weights_dicts[key[2]] = dict(weights_dict) if weights_dict else {}
+    for digest in set(weights_dicts) - {cached_key[2] for cached_key in cache}:
+        del weights_dicts[digest]
+
+    G.graph['weights_key'] = key
+    return G
+
+
+def refresh_edge_weights(G, map_data:dict, edge_index, old_version: str, edges, edge_order=None) -> dict:
+    '''
+    Brings the graph's cached weight inputs and weightings from old_version to
+    edge_index.version, after a map update changed the (i, u, v, data) edges
+    (i being the position in G.edges(keys=True) order). Only those edges are
+    recomputed. edge_order, when the update also added or removed edges of G,
+    gives the old position of every edge (-1 for new ones); new edges must be
+    in edges. Weightings that cannot be recomputed (objective weightings
+    cached without their weights_dict) are dropped, as is the graph's current
+    weighting if it was one of them.
+    Returns {old weights key: new weights key} of the weightings carried over.
+    '''
+    edges = list(edges)
+    rows = np.array([i for i, _, _, _ in edges], dtype=np.int64)
+    n_edges = G.number_of_edges()
+
+    inputs = G.graph.get('weight_inputs')
+    if inputs is not None and inputs['version'] == old_version:
+        if edge_order is not None:
+            kept = edge_order >= 0
+            for name in INPUT_NAMES:
+                reordered = np.zeros(n_edges, dtype=inputs[name].dtype)
+                reordered[kept] = inputs[name][edge_order[kept]]
+                inputs[name] = reordered
+        inputs['version'] = edge_index.version
+        _fill_edge_inputs(inputs, edges, map_data, edge_index)
+    else:
+        inputs = edge_weight_inputs(G, map_data, edge_index)
+
+    cache = G.graph.get('weight_cache', {})
+    weights_dicts = G.graph.get('weights_dicts', {})
+    key_map = {}
+    refreshed = {}
+    for key, edge_weights in cache.items():
+        version, weights_type, digest, default_weight = key
+        if version != old_version:
+            refreshed[key] = edge_weights
+            continue
+        if weights_type == 'objective' and digest not in weights_dicts:
+            continue
+        if edge_order is not None:
+            edge_weights = [edge_weights[j] if j >= 0 else default_weight for j in edge_order.tolist()]
+        new_weights = _weights_from_inputs(inputs, weights_dicts.get(digest), weights_type, default_weight, rows)
+        for i, weight in zip(rows.tolist(), new_weights.tolist()):
+            edge_weights[i] = weight
+        new_key = (edge_index.version, weights_type, digest, default_weight)
+        refreshed[new_key] = edge_weights
+        key_map[key] = new_key
+    G.graph['weight_cache'] = refreshed
+
+    weights_key = G.graph.get('weights_key')
+    if weights_key in key_map:
+        edge_weights = refreshed[key_map[weights_key]]
+        for i, u, v, data in edges:
+            data['weight'] = edge_weights[i]
+        G.graph['weights_key'] = key_map[weights_key]
+    elif weights_key is not None and weights_key[0] == old_version:
+        G.graph.pop('weights_key')
+    return key_map
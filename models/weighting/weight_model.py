@@ -1,3 +1,6 @@
+import numpy as np
+
+
 def calculate_path_weight(path_data, weights_dict):
     """
     Calculates a weight for a path segment based on EV-relevant factors.
@@ -70,4 +73,44 @@ def calculate_path_weight(path_data, weights_dict):
     # Also raise the maximum to allow more extreme values for truly bad paths
     final_weight = max(1.5, min(200.0, final_weight))
     
-    return final_weight
\ No newline at end of file
+    return final_weight
+
+
+def calculate_path_weights(avg_incline, max_incline, distance, zero_start, weights_dict):
+    """
+    Batched version of calculate_path_weight, for reweighting a whole graph in one call.
+    Applies the same scaling, compression and [1.5, 200] clipping to every element.
+
+    Parameters:
+    avg_incline (array): Average incline of each path in degrees
+    max_incline (array): Maximum incline of each path in degrees
+    distance (array): Distance of each path in meters
+    zero_start (array): Whether each path starts from zero velocity
+    weights_dict (dict): Same weights as calculate_path_weight
+
+    Returns:
+    np.ndarray: Calculated weight for each path
+    """
+    avg_incline = np.asarray(avg_incline, dtype=float)
+    max_incline = np.asarray(max_incline, dtype=float)
+    distance = np.asarray(distance, dtype=float)
+    zero_start = np.asarray(zero_start, dtype=bool)
+
+    base_distance_effect = distance / 10
+    avg_incline_effect = 1.0 + (np.abs(avg_incline) / 3) ** 2.5
+    max_incline_effect = 1.0 + (np.abs(max_incline) / 2) ** 3.0
+    direction_factor = np.where(avg_incline > 0, 1.5, 0.8)
+    zero_start_factor = np.where(zero_start, 1.0, 3.5)
+
+    final_weight = (
+        weights_dict["incline_weight"] * avg_incline_effect * direction_factor +
+        weights_dict["max_incline_weight"] * max_incline_effect +
+        weights_dict["distance_weight"] * base_distance_effect +
+        weights_dict["zero_start_weight"] * zero_start_factor
+    )
+
+    # Same logarithmic-style compression above 50 as the scalar version
+    compressed = 50 + 20 * np.sqrt(np.maximum(final_weight - 50, 0))
+    final_weight = np.where(final_weight > 50, compressed, final_weight)
+
+    return np.clip(final_weight, 1.5, 200.0)
@@ -0,0 +1,256 @@
+'''
+Parallel batch simulation of test route sets.
+Every (start_node, end_node) pair is routed with the distance and objective
+weightings, run through return_route_data_complex and battery_deg.route_analysis,
+and appended to a results_store directory as it completes, one record per
+pair in the layout of the single route simulation results:
+{"sim": "sim1", "index": 0, "start_point": ..., "end_point": ...,
+ "distance": {...}, "optimised": {...}}
+A pair that fails in either weighting gets {} for it and an "error" entry
+instead of aborting the run.
+
+The network, map data and compiled weightings are loaded once in the parent,
+which keeps a router per weighting: its CSR graph, or contraction hierarchy
+for engine='ch'. Workers are forked from it and route on those routers
+without weighting the graph, so nothing is pickled or rebuilt per worker and
+the graph's edge data is only read. The networkx engine has no compiled form
+and weights the graph in every task. Where fork is unavailable each worker
+loads the network snapshot instead.
+
+python -m simulation.batch_runner [test_set ...] [--workers N] [--n-pairs N] [--output-dir DIR]
+'''
+import argparse
+import hashlib
+import json
+import multiprocessing
+import os
+import time
+import models.vehicle_models.battery_deg as bd
+import models.weighting.weight_integration as wi
+import simulation.results_store as rs
+import simulation.simulate_routes as sr
+from models.road_network.contraction import ch_for_graph
+from models.road_network.csr_routing import csr_for_graph
+from models.road_network.snapshot import load_network
+
+ROAD_NETWORK_FILE = './data_collection/data/large_net/large_edge_data.csv'
+MAP_DATA_FILE = "./data_collection/data/large_net/fixed_large_dis_data.json"
+WEIGHTS_FILE = "./data_collection/weights.json"
+TEST_ROUTES_FILE = "./data_collection/data/test_data/test_route_set.json"
+OUTPUT_DIR = "./results/singular_routes_sim"
+# Weights type of each result entry, in the order they are simulated
+RESULT_WEIGHTINGS = {'optimised': 'objective', 'distance': 'distance'}
+# Pairs per task. A task's pairs share one search per start node in each
+# weighting, and one round trip to the pool for the task and its records
+CHUNK_SIZE = 16
+
+# Network and parameters used by the workers, set by load_context
+_context = None
+
+
+def map_hash(road_network_file: str = ROAD_NETWORK_FILE, map_data_file: str = MAP_DATA_FILE) -> str:
+    '''
+    Digest of the contents of the edge CSV and map JSON: what a route's
+    results depend on, unlike the snapshot (also keyed on the weights file).
+    '''
+    digest = hashlib.sha1()
+    for file_path in (road_network_file, map_data_file):
+        with open(file_path, 'rb') as file:
+            for chunk in iter(lambda: file.read(1 << 20), b''):
+                digest.update(chunk)
+        digest.update(b'\0')
+    return digest.hexdigest()
+
+
+def load_context(weights_file: str = WEIGHTS_FILE, engine: str = 'csr') -> dict:
+    '''
+    Loads the network snapshot and the model parameters, and compiles the
+    router of every weighting up front so forked workers share them instead
+    of each building their own.
+    '''
+    global _context
+    graph, map_data, edge_index = load_network(ROAD_NETWORK_FILE, MAP_DATA_FILE, weights_file)
+    with open(weights_file, 'r') as file:
+        weights = json.load(file)
+    with open("models/vehicle_models/static_data.json", "r") as file:
+        static_data = json.load(file)
+    with open("models/vehicle_models/vehicle_data.json", "r") as file:
+        vehicle_data = json.load(file)
+    with open("models/vehicle_models/battery_data.json", "r") as file:
+        battery_data = json.load(file)
+
+    routers = {}
+    if engine != 'networkx':
+        for weights_type in RESULT_WEIGHTINGS.values():
+            G = wi.get_weighted_graph(graph, map_data, weights, weights_type, edge_index=edge_index)
+            routers[weights_type] = ch_for_graph(G) if engine == 'ch' else csr_for_graph(G)
+
+    _context = {
+        'graph': graph, 'map_data': map_data, 'edge_index': edge_index, 'weights': weights,
+        'static_data': static_data, 'vehicle_data': vehicle_data, 'battery_data': battery_data,
+        'engine': engine, 'routers': routers,
+        # The map's content hash, valid while edge_index keeps this version
+        'map_hash': map_hash(), 'map_version': edge_index.version,
+    }
+    return _context
+
+
+def route_record(route_dict: dict, context: dict, detailed: bool = False) -> dict:
+    '''
+    Result entry of one routed pair: the return_route_data_complex values
+    (without detailed_results unless detailed), the section times and the
+    route_analysis capacity loss at the battery's nominal capacity.
+    '''
+    battery_data = context['battery_data']
+    vehicle_data = context['vehicle_data']
+    result = sr.return_route_data_complex(
+        route_dict, vehicle_data, context['static_data'], vehicle_data["motor_eff"], battery_data, compact=True
+    )
+    record = {
+        'total_distance': result.total_distance,
+        'total_consumption': result.total_consumption,
+        'total_climb': result.total_climb,
+        'capacity_loss': bd.route_analysis(
+            result.detailed_results, result.currents, result.consumptions,
+            battery_data["OCV"], battery_data["Capacity"]
+        ),
+        'current_list': result.currents.tolist(),
+        'climbs': result.climbs.tolist(),
+        'distances': result.distances.tolist(),
+        'consumptions': result.consumptions.tolist(),
+        'times': result.times.tolist(),
+    }
+    if detailed:
+        record['detailed_results'] = result.to_dict()
+    return record
+
+
+def _route_weighting(pairs, weights_type: str, context: dict) -> list:
+    # One route_dict or exception per pair; a failing batch is retried pair by pair
+    args = (context['map_data'], None, context['graph'])
+    options = dict(
+        edge_index=context['edge_index'], engine=context['engine'], router=context['routers'].get(weights_type)
+    )
+    try:
+        return sr.find_routes(*args, pairs, context['weights'], weights_type, **options)
+    except Exception:
+        routes = []
+        for pair in pairs:
+            try:
+                routes.append(sr.find_routes(*args, [pair], context['weights'], weights_type, **options)[0])
+            except Exception as e:
+                routes.append(e)
+        return routes
+
+
+def simulate_chunk(chunk, detailed: bool = False, context: dict = None) -> list:
+    '''
+    Simulates a list of (index, (start_node, end_node)) items, returning one
+    record per item. Failures are recorded, never raised.
+    '''
+    context = _context if context is None else context
+    pairs = [tuple(pair) for _, pair in chunk]
+    records = [
+        {'sim': f'sim{index + 1}', 'index': index, 'start_point': pair[0], 'end_point': pair[1]}
+        for index, pair in chunk
+    ]
+    for test, weights_type in RESULT_WEIGHTINGS.items():
+        routes = _route_weighting(pairs, weights_type, context)
+        for record, pair, route_dict in zip(records, pairs, routes):
+            try:
+                if isinstance(route_dict, Exception):
+                    raise route_dict
+                if route_dict is None:
+                    raise ValueError(f"No path from {pair[0]} to {pair[1]}")
+                record[test] = route_record(route_dict, context, detailed)
+            except Exception as e:
+                record[test] = {}
+                record.setdefault('error', {})[test] = f"{type(e).__name__}: {e}"
+    return records
+
+
+def _init_worker(weights_file: str, engine: str):
+    # Workers that weren't forked from a loaded parent load the snapshot themselves
+    if _context is None:
+        load_context(weights_file, engine)
+
+
+def _simulate_task(task):
+    chunk, detailed = task
+    return simulate_chunk(chunk, detailed)
+
+
+def run_batch(pairs, output_path: str, workers: int = None, chunk_size: int = CHUNK_SIZE,
+              detailed: bool = False, resume: bool = True, weights_file: str = WEIGHTS_FILE,
+              engine: str = 'csr', store_chunk_size: int = rs.CHUNK_SIZE) -> dict:
+    '''
+    Simulates every pair across worker processes (all cores by default),
+    appending the records to the results_store directory output_path as they
+    complete, so they are stored in completion order. With resume=True pairs
+    already in the store are skipped. Returns counts of the pairs simulated and
+    failed and the elapsed time.
+    '''
+    workers = workers or os.cpu_count() or 1
+    start = time.perf_counter()
+    simulated = 0
+    failed = 0
+    with rs.ResultsWriter(output_path, store_chunk_size, resume) as writer:
+        items = [(index, pair) for index, pair in enumerate(pairs) if index not in writer.completed]
+        chunks = [items[i:i + chunk_size] for i in range(0, len(items), chunk_size)]
+
+        def write(records):
+            nonlocal simulated, failed
+            for record in records:
+                writer.append(record)
+                simulated += 1
+                failed += 'error' in record
+
+        if workers == 1 or len(chunks) <= 1:
+            if _context is None:
+                load_context(weights_file, engine)
+            for chunk in chunks:
+                write(simulate_chunk(chunk, detailed))
+        else:
+            if 'fork' in multiprocessing.get_all_start_methods():
+                # Load before forking so every worker shares the parent's copy
+                if _context is None:
+                    load_context(weights_file, engine)
+                mp_context = multiprocessing.get_context('fork')
+            else:
+                mp_context = multiprocessing.get_context()
+            with mp_context.Pool(workers, initializer=_init_worker, initargs=(weights_file, engine)) as pool:
+                for records in pool.imap_unordered(_simulate_task, [(chunk, detailed) for chunk in chunks]):
+                    write(records)
+
+    return {
+        'pairs': len(pairs), 'skipped': len(pairs) - len(items), 'simulated': simulated,
+        'failed': failed, 'seconds': time.perf_counter() - start,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Simulate test route sets across all cores.")
+    parser.add_argument('test_sets', nargs='*', default=['test_set1'], help="test sets of the test route file")
+    parser.add_argument('--workers', type=int, default=None, help="worker processes (default: all cores)")
+    parser.add_argument('--n-pairs', type=int, default=None, help="only the first N pairs of each set")
+    parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE)
+    parser.add_argument('--output-dir', default=OUTPUT_DIR)
+    parser.add_argument('--test-routes', default=TEST_ROUTES_FILE)
+    parser.add_argument('--detailed', action='store_true', help="also store detailed_results")
+    parser.add_argument('--restart', action='store_true', help="overwrite existing results instead of resuming")
+    args = parser.parse_args(argv)
+
+    with open(args.test_routes, 'r') as file:
+        test_routes = json.load(file)
+    for test_set in args.test_sets:
+        output_path = os.path.join(args.output_dir, f'simulation_{test_set}')
+        stats = run_batch(
+            test_routes[test_set][:args.n_pairs], output_path, args.workers, args.chunk_size,
+            args.detailed, resume=not args.restart
+        )
+        print(f"{test_set}: {stats['simulated']} pairs simulated ({stats['failed']} failed, "
+              f"{stats['skipped']} already done) in {stats['seconds']:.1f}s -> {output_path}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,109 @@
+'''
+Benchmark of the shortest-path engines on the large network.
+Routes every test pair with both weightings through networkx, the CSR
+Dijkstra and A* engines and the contraction hierarchy, checks they return
+identical node sequences (A* and the hierarchy may pick another route of equal
+cost where routes tie exactly) and prints the timings and the mean number of
+nodes settled per query.
+
+python -m simulation.benchmark_routing [n_pairs] [test_set]
+'''
+import json
+import sys
+import time
+import networkx as nx
+import models.road_network.create_graph as cg
+import models.weighting.weight_integration as wi
+from models.road_network.csr_routing import CSRGraph, csr_for_graph
+from models.road_network.contraction import ContractionHierarchy, ch_for_graph
+from models.road_network.snapshot import load_network
+
+ROAD_NETWORK_FILE = './data_collection/data/large_net/large_edge_data.csv'
+MAP_DATA_FILE = "./data_collection/data/large_net/fixed_large_dis_data.json"
+WEIGHTS_FILE = "./data_collection/weights.json"
+TEST_ROUTES_FILE = "./data_collection/data/test_data/test_route_set.json"
+
+
+def time_engine(G, pairs, engine) -> tuple:
+    '''
+    Routes every pair, returns (paths, seconds). Unreachable pairs give None.
+    '''
+    paths = []
+    start = time.perf_counter()
+    for source, target in pairs:
+        try:
+            paths.append(cg.shortest_path(G, source, target, engine))
+        except (nx.NetworkXNoPath, nx.NodeNotFound):
+            paths.append(None)
+    return paths, time.perf_counter() - start
+
+
+def settled_counts(G, pairs) -> tuple:
+    '''
+    Mean number of nodes settled per query by CSR Dijkstra, A* and the
+    contraction hierarchy, over the reachable pairs.
+    '''
+    csr = csr_for_graph(G)
+    ch = ch_for_graph(G)
+    settled = {'dijkstra': [], 'astar': [], 'ch': []}
+    for source, target in pairs:
+        try:
+            settled['dijkstra'].append(csr.dijkstra(source, target, return_settled=True)[1])
+            settled['astar'].append(csr.astar(source, target, return_settled=True)[1])
+            settled['ch'].append(ch.query(source, target, return_settled=True)[1])
+        except (nx.NetworkXNoPath, nx.NodeNotFound):
+            continue
+    return {name: sum(counts) / len(counts) for name, counts in settled.items()}
+
+
+def benchmark(n_pairs: int = None, test_set: str = 'test_set1'):
+    graph, map_data, edge_index = load_network(ROAD_NETWORK_FILE, MAP_DATA_FILE, WEIGHTS_FILE)
+    with open(WEIGHTS_FILE, 'r') as file:
+        weights = json.load(file)
+    with open(TEST_ROUTES_FILE, 'r') as file:
+        pairs = json.load(file)[test_set][:n_pairs]
+
+    print(f"{len(pairs)} pairs from {test_set}, "
+          f"{graph.number_of_nodes()} nodes, {graph.number_of_edges()} edges")
+    for weights_type in ('distance', 'objective'):
+        G = wi.get_weighted_graph(graph, map_data, weights, weights_type, edge_index=edge_index)
+
+        # The compiled graph may be cached already, time a fresh compile
+        start = time.perf_counter()
+        CSRGraph.from_networkx(G)
+        compile_time = time.perf_counter() - start
+
+        nx_paths, nx_time = time_engine(G, pairs, 'networkx')
+        csr_paths, csr_time = time_engine(G, pairs, 'csr')
+        astar_paths, astar_time = time_engine(G, pairs, 'astar')
+        ch_paths, ch_time = time_engine(G, pairs, 'ch')
+        # The snapshot already holds the hierarchy, time a fresh build
+        start = time.perf_counter()
+        ContractionHierarchy.from_csr(csr_for_graph(G))
+        ch_build_time = time.perf_counter() - start
+        mismatches = sum(a != b for a, b in zip(nx_paths, csr_paths))
+        astar_mismatches = sum(a != b for a, b in zip(nx_paths, astar_paths))
+        ch_mismatches = sum(a != b for a, b in zip(nx_paths, ch_paths))
+        settled = settled_counts(G, pairs)
+
+        print(f"[{weights_type}] networkx: {nx_time:.3f}s "
+              f"({1000 * nx_time / len(pairs):.2f}ms/route)")
+        print(f"[{weights_type}] csr:      {csr_time:.3f}s "
+              f"({1000 * csr_time / len(pairs):.2f}ms/route, compile {1000 * compile_time:.1f}ms), "
+              f"speedup {nx_time / csr_time:.1f}x")
+        print(f"[{weights_type}] astar:    {astar_time:.3f}s "
+              f"({1000 * astar_time / len(pairs):.2f}ms/route, heuristic scale "
+              f"{csr_for_graph(G).heuristic_scale():.4f}/m), speedup {nx_time / astar_time:.1f}x")
+        print(f"[{weights_type}] ch:       {ch_time:.3f}s "
+              f"({1000 * ch_time / len(pairs):.2f}ms/route, build {ch_build_time:.2f}s), "
+              f"speedup {nx_time / ch_time:.1f}x")
+        print(f"[{weights_type}] identical paths: csr {len(pairs) - mismatches}/{len(pairs)}, "
+              f"astar {len(pairs) - astar_mismatches}/{len(pairs)}, ch {len(pairs) - ch_mismatches}/{len(pairs)}")
+        print(f"[{weights_type}] mean settled nodes: "
+              + ", ".join(f"{name} {count:.0f}" for name, count in settled.items()))
+
+
+if __name__ == '__main__':
+    n_pairs = int(sys.argv[1]) if len(sys.argv) > 1 else None
+    test_set = sys.argv[2] if len(sys.argv) > 2 else 'test_set1'
+    benchmark(n_pairs, test_set)
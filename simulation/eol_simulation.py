@@ -0,0 +1,408 @@
+'''
+End-of-life (EOL) fleet simulation.
+A battery repeatedly drives randomly ordered routes from a route set until its
+charge falls below a threshold, is recharged, and loses the degradation of that
+discharge from its capacity, until it reaches end of life. Every route's
+per-section currents, times and consumptions are packed into flat arrays once,
+so a discharge is a few array operations instead of a route_analysis call per
+route, and many independent trajectories are simulated together. The distance
+and objective weightings of the same routes drive the same route order, so
+their capacity curves can be compared side by side.
+
+python -m simulation.eol_simulation [n_pairs] [num_trajectories] [num_cycles] [test_set]
+'''
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import simulation.results_store as rs
+import simulation.simulate_routes as sr
+from models.road_network.snapshot import load_network
+
+ROAD_NETWORK_FILE = './data_collection/data/large_net/large_edge_data.csv'
+MAP_DATA_FILE = "./data_collection/data/large_net/fixed_large_dis_data.json"
+WEIGHTS_FILE = "./data_collection/weights.json"
+TEST_ROUTES_FILE = "./data_collection/data/test_data/test_route_set.json"
+
+WEIGHTINGS = ('distance', 'objective')
+# Test names used for each weighting in the simulation_test_set*.json files
+RESULT_TESTS = {'distance': 'distance', 'objective': 'optimised'}
+# A discharge stops before a route would start below this fraction of the capacity at full charge
+DISCHARGE_THRESHOLD = 0.2
+# End of life once the capacity falls below this fraction of the initial capacity
+EOL_FRACTION = 0.2
+
+
+def route_arrays(results, pairs=None) -> dict:
+    '''
+    Packs a list of route results into flat per-section arrays. Each result is
+    a route_result.RouteResult or a dict with the current_list, consumptions,
+    total_consumption and total_distance of return_route_data_complex and
+    either the section times (as written by batch_runner) or the
+    detailed_results it came with. Returns:
+    current, consumption, time: section values of every route, concatenated
+    starts, lengths: first section and number of sections of each route
+    total_consumption, total_distance: one per route
+    pairs: the (start_node, end_node) of each route, if given
+    '''
+    current = []
+    consumption = []
+    times = []
+    total_consumption = []
+    total_distance = []
+    for result in results:
+        if hasattr(result, 'sections'):
+            route_current, route_consumption, route_times = result.currents, result.consumptions, result.times
+            total_consumption.append(result.total_consumption)
+            total_distance.append(result.total_distance)
+        else:
+            route_times = result.get('times')
+            if route_times is None:
+                route_times = getattr(result['detailed_results'], 'times', None)
+            if route_times is None:
+                detailed_results = result['detailed_results']
+                route_times = [
+                    data["time"]
+                    for key, value in detailed_results.items() if 'path' in key
+                    for _, data in value.items()
+                ]
+            route_current, route_consumption = result['current_list'], result['consumptions']
+            total_consumption.append(result['total_consumption'])
+            total_distance.append(result['total_distance'])
+        # As in battery_deg.route_analysis, sections without a time or a consumption are left out
+        n_sections = min(len(route_consumption), len(route_times), len(route_current))
+        current.append(np.asarray(route_current[:n_sections], dtype=float))
+        consumption.append(np.asarray(route_consumption[:n_sections], dtype=float))
+        times.append(np.asarray(route_times[:n_sections], dtype=float))
+
+    lengths = np.array([len(route) for route in current], dtype=np.int64)
+    starts = np.concatenate(([0], np.cumsum(lengths)[:-1])).astype(np.int64)
+    return {
+        'current': np.concatenate(current) if current else np.zeros(0),
+        'consumption': np.concatenate(consumption) if consumption else np.zeros(0),
+        'time': np.concatenate(times) if times else np.zeros(0),
+        'starts': starts,
+        'lengths': lengths,
+        'total_consumption': np.array(total_consumption, dtype=float),
+        'total_distance': np.array(total_distance, dtype=float),
+        'pairs': None if pairs is None else [tuple(pair) for pair in pairs],
+    }
+
+
+def load_route_sets(simulation_file: str) -> dict:
+    '''
+    Route sets from a simulation_test_set*.json file of the single route
+    simulation, or a results_store directory written by batch_runner,
+    {'distance': route_arrays, 'objective': route_arrays}.
+    Routes that failed with either weighting are left out of both, so the same
+    index is the same start and end point in each.
+    '''
+    if os.path.isdir(simulation_file):
+        sim_results = rs.to_sim_results(simulation_file)
+    else:
+        with open(simulation_file, 'r') as file:
+            sim_results = json.load(file)
+
+    results = {weighting: [] for weighting in WEIGHTINGS}
+    pairs = []
+    for values in sim_results.values():
+        tests = {weighting: values.get(test) for weighting, test in RESULT_TESTS.items()}
+        if 'error' in values or not all(tests.values()):
+            continue
+        for weighting in WEIGHTINGS:
+            results[weighting].append(tests[weighting])
+        pairs.append((values.get('start_point'), values.get('end_point')))
+    return {weighting: route_arrays(results[weighting], pairs) for weighting in WEIGHTINGS}
+
+
+def build_route_sets(map_data, road_df, graph, pairs, weights, vehicle_data: dict, static_data: dict,
+                     battery_data: dict, edge_index=None, engine='csr') -> dict:
+    '''
+    Routes every (start_node, end_node) pair with the distance and objective
+    weightings (simulate_routes.find_routes) and runs the energy model over
+    each route, {'distance': route_arrays, 'objective': route_arrays}.
+    Pairs without a route in either weighting are left out of both.
+    '''
+    routes = {
+        weighting: sr.find_routes(map_data, road_df, graph, pairs, weights, weighting, edge_index, engine)
+        for weighting in WEIGHTINGS
+    }
+    kept = [i for i in range(len(pairs)) if all(routes[weighting][i] is not None for weighting in WEIGHTINGS)]
+    return {
+        weighting: route_arrays(
+            [
+                sr.return_route_data_complex(
+                    routes[weighting][i], vehicle_data, static_data, vehicle_data["motor_eff"], battery_data, compact=True
+                )
+                for i in kept
+            ],
+            [pairs[i] for i in kept],
+        )
+        for weighting in WEIGHTINGS
+    }
+
+
+def _with_used(route_set: dict, OCV) -> dict:
+    # Adds the consumed charge (Ah) from the start of each route to every section
+    route_set = dict(route_set)
+    used = np.cumsum(route_set['consumption'] / OCV)
+    if len(used):
+        has_sections = route_set['lengths'] > 0
+        route_start = np.zeros(len(route_set['lengths']))
+        route_start[has_sections] = (used - route_set['consumption'] / OCV)[route_set['starts'][has_sections]]
+        used -= np.repeat(route_start, route_set['lengths'])
+    route_set['used'] = used
+    return route_set
+
+
+def discharge(route_set: dict, order, capacity, OCV, base_k=0.200, c_rate_exp=0.2286,
+              discharge_threshold=DISCHARGE_THRESHOLD) -> dict:
+    '''
+    One full discharge for each of a batch of batteries, as battery_deg.route_analysis
+    over the routes driven.
+
+    route_set: route_arrays with the used column (see simulate_cycles)
+    order: batteries x routes array, the route order of each battery
+    capacity: capacity of each battery at the start of the discharge (Ah)
+
+    Routes are driven in order while the charge left before the route is at
+    least discharge_threshold * capacity. Returns, one per battery:
+    capacity_loss: degradation over the routes driven (Ah)
+    routes, distance, consumption: routes driven, their distance (m) and energy (Wh)
+    final_charge: charge left at the end of the discharge (Ah)
+    '''
+    order = np.asarray(order, dtype=np.int64)
+    capacity = np.asarray(capacity, dtype=float)
+    n_batteries = len(capacity)
+
+    # Charge left before each route, and whether the battery gets that far
+    route_used = route_set['total_consumption'][order] / OCV
+    used_before = np.cumsum(route_used, axis=1) - route_used
+    charge_before = capacity[:, None] - used_before
+    driven = np.logical_and.accumulate(charge_before >= discharge_threshold * capacity[:, None], axis=1)
+
+    battery, position = np.nonzero(driven)
+    routes = order[battery, position]
+    lengths = route_set['lengths'][routes]
+    total = int(lengths.sum())
+    # Section indices of every route driven, in driving order
+    offsets = np.concatenate(([0], np.cumsum(lengths)[:-1]))
+    sections = np.repeat(route_set['starts'][routes] - offsets, lengths) + np.arange(total)
+    section_battery = np.repeat(battery, lengths)
+
+    charge = np.repeat(charge_before[battery, position], lengths) - route_set['used'][sections]
+    current = route_set['current'][sections]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        c_rate = np.where(charge > 0, current / charge, np.inf)
+        section_loss = base_k * (c_rate ** c_rate_exp) * ((route_set['time'][sections] / 3600) * c_rate)
+
+    n_routes = driven.sum(axis=1)
+    consumption = np.bincount(battery, weights=route_set['total_consumption'][routes], minlength=n_batteries)
+    return {
+        'capacity_loss': np.bincount(section_battery, weights=section_loss, minlength=n_batteries),
+        'routes': n_routes,
+        'distance': np.bincount(battery, weights=route_set['total_distance'][routes], minlength=n_batteries),
+        'consumption': consumption,
+        'final_charge': capacity - consumption / OCV,
+    }
+
+
+def simulate_cycles(route_sets: dict, initial_capacity, OCV, num_cycles=600, seeds=None,
+                    base_k=0.200, c_rate_exp=0.2286, loss_factor=1, discharge_threshold=DISCHARGE_THRESHOLD,
+                    eol_fraction=EOL_FRACTION) -> dict:
+    '''
+    Charge/discharge cycles of one battery per seed and per weighting, all
+    simulated together. Each battery shuffles the routes with its own
+    np.random.default_rng(seed) every cycle, and the batteries of every
+    weighting with the same seed drive the same route order (route_sets must
+    hold the same routes in the same order, as built by build_route_sets).
+
+    Each cycle is a discharge (see discharge) whose capacity_loss, times
+    loss_factor, comes off the capacity. A battery reaches end of life when its
+    capacity falls below eol_fraction * initial_capacity, is held there, and
+    the run stops once every battery has. The notebook's ageing models were
+    (base_k, c_rate_exp, loss_factor) = (0.2, 0.2286, 1), (0.012, 0.8, 2) and
+    (0.047, 1.2, 2), the last with discharge_threshold=0.6.
+
+    Returns, for weighting in route_sets:
+    cycles: 0..cycles run
+    capacity[weighting]: (cycles + 1) x batteries capacity after each cycle (Ah)
+    capacity_percentage[weighting]: the same as a percentage of initial_capacity
+    losses[weighting]: cycles x batteries capacity lost in each cycle
+    distance[weighting]: cycles x batteries distance driven in each cycle (m)
+    eol_cycle[weighting]: cycle each battery reached end of life, -1 if it didn't
+    seeds: the seed of each battery
+    '''
+    seeds = [None] if seeds is None else list(seeds)
+    n_routes = {len(route_set['lengths']) for route_set in route_sets.values()}
+    if len(n_routes) != 1:
+        raise ValueError("Every weighting needs the same routes")
+    n_routes = n_routes.pop()
+    route_sets = {weighting: _with_used(route_set, OCV) for weighting, route_set in route_sets.items()}
+    generators = [np.random.default_rng(seed) for seed in seeds]
+    eol_capacity = eol_fraction * initial_capacity
+
+    capacity = {weighting: np.full(len(seeds), float(initial_capacity)) for weighting in route_sets}
+    eol_cycle = {weighting: np.full(len(seeds), -1, dtype=np.int64) for weighting in route_sets}
+    capacity_curve = {weighting: [capacity[weighting].copy()] for weighting in route_sets}
+    losses = {weighting: [] for weighting in route_sets}
+    distance = {weighting: [] for weighting in route_sets}
+
+    cycle = 0
+    for cycle in range(1, num_cycles + 1):
+        order = np.array([rng.permutation(n_routes) for rng in generators], dtype=np.int64).reshape(len(seeds), n_routes)
+        for weighting, route_set in route_sets.items():
+            active = eol_cycle[weighting] < 0
+            cycle_loss = np.zeros(len(seeds))
+            cycle_distance = np.zeros(len(seeds))
+            if active.any():
+                result = discharge(
+                    route_set, order[active], capacity[weighting][active], OCV,
+                    base_k, c_rate_exp, discharge_threshold
+                )
+                cycle_loss[active] = loss_factor * result['capacity_loss']
+                cycle_distance[active] = result['distance']
+                capacity[weighting] -= cycle_loss
+                reached = active & (capacity[weighting] < eol_capacity)
+                capacity[weighting][reached] = eol_capacity
+                eol_cycle[weighting][reached] = cycle
+            capacity_curve[weighting].append(capacity[weighting].copy())
+            losses[weighting].append(cycle_loss)
+            distance[weighting].append(cycle_distance)
+        if all((cycles >= 0).all() for cycles in eol_cycle.values()):
+            break
+
+    capacity_curve = {weighting: np.array(curve) for weighting, curve in capacity_curve.items()}
+    return {
+        'cycles': np.arange(cycle + 1),
+        'capacity': capacity_curve,
+        'capacity_percentage': {weighting: curve / initial_capacity * 100 for weighting, curve in capacity_curve.items()},
+        'losses': {weighting: np.array(values).reshape(cycle, len(seeds)) for weighting, values in losses.items()},
+        'distance': {weighting: np.array(values).reshape(cycle, len(seeds)) for weighting, values in distance.items()},
+        'eol_cycle': eol_cycle,
+        'seeds': seeds,
+    }
+
+
+def _pad_cycles(values: np.ndarray, n_rows: int, fill) -> np.ndarray:
+    # Extends a cycles x batteries array to n_rows, repeating fill for the cycles not run
+    if len(values) == n_rows:
+        return values
+    padding = np.broadcast_to(fill, (n_rows - len(values),) + values.shape[1:])
+    return np.concatenate((values, padding))
+
+
+def simulate_fleet(route_sets: dict, initial_capacity, OCV, num_cycles=600, num_trajectories=100, seed=None,
+                   workers=None, **kwargs) -> dict:
+    '''
+    Monte Carlo EOL simulation: num_trajectories independent batteries per
+    weighting, each with its own route order seed drawn from seed, so the
+    result is reproducible for a given seed whatever the number of workers.
+    With workers > 1 the trajectories are split across that many processes.
+    Other keyword arguments are passed to simulate_cycles.
+
+    Returns simulate_cycles' result over all trajectories, with the curves of
+    batteries that finished early held at their end of life capacity, plus
+    mean_capacity_percentage[weighting]: the mean curve over trajectories.
+    '''
+    seeds = np.random.SeedSequence(seed).generate_state(num_trajectories).tolist()
+    if not workers or workers <= 1 or num_trajectories < 2:
+        result = simulate_cycles(route_sets, initial_capacity, OCV, num_cycles, seeds, **kwargs)
+    else:
+        chunks = [chunk.tolist() for chunk in np.array_split(seeds, min(workers, num_trajectories))]
+        with ProcessPoolExecutor(max_workers=len(chunks)) as executor:
+            futures = [
+                executor.submit(simulate_cycles, route_sets, initial_capacity, OCV, num_cycles, chunk, **kwargs)
+                for chunk in chunks
+            ]
+            parts = [future.result() for future in futures]
+        n_cycles = max(len(part['cycles']) for part in parts)
+        result = {
+            'cycles': np.arange(n_cycles),
+            'eol_cycle': {weighting: np.concatenate([part['eol_cycle'][weighting] for part in parts]) for weighting in route_sets},
+            'seeds': seeds,
+        }
+        for key in ('capacity', 'capacity_percentage'):
+            result[key] = {
+                weighting: np.concatenate([
+                    _pad_cycles(part[key][weighting], n_cycles, part[key][weighting][-1]) for part in parts
+                ], axis=1)
+                for weighting in route_sets
+            }
+        for key in ('losses', 'distance'):
+            result[key] = {
+                weighting: np.concatenate([
+                    _pad_cycles(part[key][weighting], n_cycles - 1, 0.0) for part in parts
+                ], axis=1)
+                for weighting in route_sets
+            }
+
+    result['mean_capacity_percentage'] = {
+        weighting: curve.mean(axis=1) for weighting, curve in result['capacity_percentage'].items()
+    }
+    return result
+
+
+def eol_summary(result: dict) -> dict:
+    '''
+    Per weighting: batteries that reached end of life, and the mean, median
+    and min/max cycles they took.
+    '''
+    summary = {}
+    for weighting, cycles in result['eol_cycle'].items():
+        reached = cycles[cycles >= 0]
+        summary[weighting] = {
+            'reached_eol': int(len(reached)),
+            'trajectories': int(len(cycles)),
+            'mean_cycles': float(reached.mean()) if len(reached) else None,
+            'median_cycles': float(np.median(reached)) if len(reached) else None,
+            'min_cycles': int(reached.min()) if len(reached) else None,
+            'max_cycles': int(reached.max()) if len(reached) else None,
+        }
+    return summary
+
+
+def run(n_pairs: int = None, num_trajectories: int = 100, num_cycles: int = 600, test_set: str = 'test_set1',
+        seed=None, workers=None, **kwargs) -> dict:
+    '''
+    Builds the route sets for a test set of the large network and runs
+    simulate_fleet over them, printing the timings and the EOL summary.
+    '''
+    graph, map_data, edge_index = load_network(ROAD_NETWORK_FILE, MAP_DATA_FILE, WEIGHTS_FILE)
+    with open(WEIGHTS_FILE, 'r') as file:
+        weights = json.load(file)
+    with open(TEST_ROUTES_FILE, 'r') as file:
+        pairs = json.load(file)[test_set][:n_pairs]
+    with open("models/vehicle_models/vehicle_data.json", "r") as file:
+        vehicle_data = json.load(file)
+    with open("models/vehicle_models/static_data.json", "r") as file:
+        static_data = json.load(file)
+    with open("models/vehicle_models/battery_data.json", "r") as file:
+        battery_data = json.load(file)
+
+    start = time.perf_counter()
+    route_sets = build_route_sets(
+        map_data, None, graph, pairs, weights, vehicle_data, static_data, battery_data, edge_index=edge_index
+    )
+    build_time = time.perf_counter() - start
+    start = time.perf_counter()
+    result = simulate_fleet(
+        route_sets, battery_data["Capacity"], battery_data["OCV"], num_cycles, num_trajectories, seed, workers, **kwargs
+    )
+    simulate_time = time.perf_counter() - start
+
+    print(f"{len(route_sets['distance']['lengths'])}/{len(pairs)} routes from {test_set} in {build_time:.1f}s, "
+          f"{num_trajectories} trajectories x {len(result['cycles']) - 1} cycles in {simulate_time:.1f}s")
+    for weighting, summary in eol_summary(result).items():
+        print(f"[{weighting}] {summary}")
+    return result
+
+
+if __name__ == '__main__':
+    n_pairs = int(sys.argv[1]) if len(sys.argv) > 1 else None
+    num_trajectories = int(sys.argv[2]) if len(sys.argv) > 2 else 100
+    num_cycles = int(sys.argv[3]) if len(sys.argv) > 3 else 600
+    test_set = sys.argv[4] if len(sys.argv) > 4 else 'test_set1'
+    run(n_pairs, num_trajectories, num_cycles, test_set)
@@ -0,0 +1,337 @@
+'''
+Optimisation of the objective weighting's weights_dict.
+A candidate weights_dict is scored, as in notebooks/optimise_weights.ipynb, by
+routing every test pair with the objective weighting (weight_model.calculate_path_weight)
+and simulating the routes:
+    objective = 0.5 * total consumption (Wh) + 0.5 * sum of the section currents (A)
+Most candidates change only a few of the routes, so route results are kept
+in a route_memo.RouteEnergyMemo keyed by node sequence: each distinct route is
+simulated once, and with a memo file not even again in later runs. Candidates
+are evaluated in batches across forked worker processes: first every
+candidate of a batch is routed, then the routes missing from the memo are
+simulated, then each candidate is scored from the memo.
+
+Search strategies, all reproducible from their seed:
+    'gp': Bayesian optimisation with skopt (as in the notebook), asking for
+        a batch of points at a time
+    'differential_evolution': scipy.optimize.differential_evolution, its
+        population evaluated as one batch per generation
+    'random': Latin hypercube sample of the search space
+
+python -m simulation.optimise_weights [test_set] [--strategy S] [--n-calls N] [--n-pairs N] [--workers N] [--seed N] [--no-write]
+'''
+import argparse
+import json
+import math
+import multiprocessing
+import os
+import time
+import numpy as np
+import models.road_network.create_graph as cg
+import models.weighting.weight_integration as wi
+import simulation.batch_runner as br
+import simulation.route_memo as rm
+
+WEIGHTS_FILE = "./data_collection/weights.json"
+TEST_ROUTES_FILE = "./data_collection/data/test_data/test_route_set.json"
+
+WEIGHT_NAMES = ('incline_weight', 'max_incline_weight', 'distance_weight', 'zero_start_weight')
+# Bounds of each weight, the notebook's refined search space
+SEARCH_SPACE = {
+    'incline_weight': (0.1, 5.0),
+    'max_incline_weight': (0.1, 8.0),
+    'distance_weight': (3.0, 8.0),
+    'zero_start_weight': (10.0, 25.0),
+}
+# Original weights the notebook compared against
+BASELINE_WEIGHTS = {'incline_weight': 4.0, 'max_incline_weight': 4.0, 'distance_weight': 10.0, 'zero_start_weight': 10.0}
+# Share of consumption and summed current in the objective
+CONSUMPTION_SHARE = 0.5
+CURRENT_SHARE = 0.5
+STRATEGIES = ('gp', 'differential_evolution', 'random')
+N_CALLS = 20
+SEED = 42
+
+# Network, parameters and test pairs used by the workers, set by load_context
+_context = None
+
+
+def load_context(pairs, weights_file: str = WEIGHTS_FILE, engine: str = 'csr') -> dict:
+    '''
+    batch_runner.load_context plus the test pairs, shared with forked workers.
+    '''
+    global _context
+    _context = {**br.load_context(weights_file, engine), 'pairs': [tuple(pair) for pair in pairs]}
+    return _context
+
+
+def weights_from_vector(x) -> dict:
+    return {name: float(value) for name, value in zip(WEIGHT_NAMES, x)}
+
+
+def route_paths(weights_dict: dict, context: dict = None) -> list:
+    '''
+    Node sequence (tuple) of each test pair's route under the objective
+    weighting of weights_dict, None where there is no path.
+    '''
+    context = _context if context is None else context
+    G = wi.get_weighted_graph(
+        context['graph'], context['map_data'], weights_dict, 'objective', edge_index=context['edge_index']
+    )
+    return [
+        None if path is None else tuple(path)
+        for path in cg.shortest_paths(G, context['pairs'], context['engine'])
+    ]
+
+
+def route_energy(record: dict) -> tuple:
+    '''
+    (total consumption, summed section current) of a route_memo result.
+    '''
+    return record['total_consumption'], float(np.sum(record['current_list']))
+
+
+def _route_task(weights_dict):
+    return route_paths(weights_dict)
+
+
+def _simulate_task(paths):
+    return [rm.simulate_path(path, _context) for path in paths]
+
+
+def _init_worker(pairs, weights_file: str, engine: str):
+    if _context is None:
+        load_context(pairs, weights_file, engine)
+
+
+class CandidateEvaluator:
+    '''
+    Scores batches of weights_dicts, in a pool of `workers` processes when
+    workers > 1. Route results are looked up in memo (a fresh in-memory
+    route_memo.RouteEnergyMemo by default) and only the missing ones are
+    simulated; history keeps every evaluation in order. Use as a context
+    manager, or call close().
+    '''
+
+    def __init__(self, context: dict, workers: int = 1, weights_file: str = WEIGHTS_FILE, memo=None):
+        self.context = context
+        self.workers = workers
+        self.memo = rm.RouteEnergyMemo() if memo is None else memo
+        self.parameters = rm.context_hash(context)
+        self.history = []
+        self.route_lookups = 0
+        self.routes_simulated = 0
+        self._pool = None
+        if workers > 1:
+            if 'fork' in multiprocessing.get_all_start_methods():
+                mp_context = multiprocessing.get_context('fork')
+            else:
+                mp_context = multiprocessing.get_context()
+            self._pool = mp_context.Pool(
+                workers, initializer=_init_worker, initargs=(context['pairs'], weights_file, context['engine'])
+            )
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.close()
+            self._pool.join()
+            self._pool = None
+
+    def evaluate(self, candidates) -> list:
+        '''
+        One result per weights_dict: the weights, objective, consumption,
+        current and the number of unrouted pairs.
+        '''
+        candidates = [dict(weights) for weights in candidates]
+        if self._pool is not None:
+            paths = self._pool.map(_route_task, candidates)
+        else:
+            paths = [route_paths(weights, self.context) for weights in candidates]
+
+        energies = {}
+        new_paths = []
+        for path in dict.fromkeys(path for candidate_paths in paths for path in candidate_paths if path is not None):
+            record = self.memo.get(path, self.parameters)
+            if record is None:
+                new_paths.append(path)
+            else:
+                energies[path] = route_energy(record)
+        if self._pool is not None and len(new_paths) > 1:
+            n_chunks = min(len(new_paths), self.workers * 4)
+            chunks = [new_paths[i::n_chunks] for i in range(n_chunks)]
+            records = [record for chunk_records in self._pool.map(_simulate_task, chunks) for record in chunk_records]
+            new_paths = [path for chunk in chunks for path in chunk]
+        else:
+            records = [rm.simulate_path(path, self.context) for path in new_paths]
+        for path, record in zip(new_paths, records):
+            self.memo.put(path, self.parameters, record)
+            energies[path] = route_energy(record)
+        self.routes_simulated += len(new_paths)
+        self.memo.flush()
+
+        results = []
+        for weights, candidate_paths in zip(candidates, paths):
+            route_energies = [energies[path] for path in candidate_paths if path is not None]
+            self.route_lookups += len(route_energies)
+            consumption = sum(energy[0] for energy in route_energies)
+            current = sum(energy[1] for energy in route_energies)
+            results.append({
+                'weights': weights,
+                'objective': CONSUMPTION_SHARE * consumption + CURRENT_SHARE * current,
+                'consumption': consumption,
+                'current': current,
+                'unrouted': len(candidate_paths) - len(route_energies),
+            })
+        self.history.extend(results)
+        return results
+
+    def stats(self) -> dict:
+        return {
+            'candidates': len(self.history),
+            'route_lookups': self.route_lookups,
+            'routes_simulated': self.routes_simulated,
+            'memo': self.memo.stats(),
+        }
+
+
+def _search_gp(evaluate, bounds, n_calls: int, seed: int, batch_size: int):
+    from skopt import Optimizer
+    optimizer = Optimizer(bounds, base_estimator='GP', random_state=seed, n_initial_points=min(10, n_calls))
+    done = 0
+    while done < n_calls:
+        points = optimizer.ask(n_points=min(batch_size, n_calls - done))
+        optimizer.tell(points, [result['objective'] for result in evaluate(points)])
+        done += len(points)
+
+
+def _search_differential_evolution(evaluate, bounds, n_calls: int, seed: int, batch_size: int):
+    from scipy.optimize import differential_evolution
+    # One generation per batch; stops after the generation reaching n_calls
+    popsize = max(1, math.ceil(batch_size / len(bounds)))
+    population = popsize * len(bounds)
+    evaluated = 0
+
+    def evaluate_population(_, points):
+        nonlocal evaluated
+        evaluated += len(points)
+        return [result['objective'] for result in evaluate(points)]
+
+    differential_evolution(
+        lambda x: None, bounds, popsize=popsize, maxiter=max(0, math.ceil((n_calls - population) / population)),
+        seed=seed, polish=False, init='latinhypercube', updating='deferred', workers=evaluate_population,
+        callback=lambda *args, **kwargs: evaluated >= n_calls, tol=0,
+    )
+
+
+def _search_random(evaluate, bounds, n_calls: int, seed: int, batch_size: int):
+    from scipy.stats import qmc
+    lower, upper = np.array(bounds).T
+    points = qmc.scale(qmc.LatinHypercube(d=len(bounds), seed=seed).random(n_calls), lower, upper)
+    for i in range(0, n_calls, batch_size):
+        evaluate(points[i:i + batch_size])
+
+
+SEARCHES = {'gp': _search_gp, 'differential_evolution': _search_differential_evolution, 'random': _search_random}
+
+
+def optimise(pairs, strategy: str = 'gp', n_calls: int = N_CALLS, seed: int = SEED, workers: int = None,
+             batch_size: int = None, search_space: dict = None, start_weights: dict = None,
+             weights_file: str = WEIGHTS_FILE, engine: str = 'csr', context: dict = None,
+             memo_file: str = None) -> dict:
+    '''
+    Searches search_space (default SEARCH_SPACE) for the weights_dict with the
+    lowest objective over pairs, using n_calls evaluations of the strategy
+    (see STRATEGIES). batch_size candidates are proposed and evaluated at a
+    time, by default one per worker (all cores by default); a strategy's
+    proposals depend on batch_size, so keep it fixed to reproduce a run.
+    start_weights (default: the weights in weights_file) are evaluated first
+    and compete for best, so the result is never worse than them.
+    memo_file: route_memo backing file, to reuse route results across runs
+
+    Returns:
+    weights: best weights_dict, objective/consumption/current: its scores
+    start: result of start_weights
+    history: every evaluation, in order
+    cache: candidates evaluated, route lookups, routes simulated and memo stats
+    seconds: elapsed time
+    '''
+    if strategy not in SEARCHES:
+        raise ValueError(f"Unknown strategy '{strategy}', expected one of {STRATEGIES}")
+    start = time.perf_counter()
+    workers = workers or os.cpu_count() or 1
+    batch_size = batch_size or workers
+    search_space = SEARCH_SPACE if search_space is None else search_space
+    bounds = [tuple(map(float, search_space[name])) for name in WEIGHT_NAMES]
+    if start_weights is None:
+        with open(weights_file, 'r') as file:
+            start_weights = json.load(file)
+    if context is None:
+        context = _context if _context is not None and _context['pairs'] == [tuple(pair) for pair in pairs] \
+            else load_context(pairs, weights_file, engine)
+
+    with rm.RouteEnergyMemo(memo_file) as memo, CandidateEvaluator(context, workers, weights_file, memo) as evaluator:
+        start_result = evaluator.evaluate([start_weights])[0]
+        SEARCHES[strategy](
+            lambda points: evaluator.evaluate([weights_from_vector(x) for x in points]),
+            bounds, n_calls, seed, batch_size
+        )
+    best = min(evaluator.history, key=lambda result: result['objective'])
+    return {
+        **best,
+        'start': start_result,
+        'history': evaluator.history,
+        'cache': evaluator.stats(),
+        'seconds': time.perf_counter() - start,
+    }
+
+
+def write_weights(weights_dict: dict, weights_file: str = WEIGHTS_FILE):
+    '''
+    Writes weights_dict in the layout of data_collection/weights.json.
+    '''
+    with open(weights_file, 'w') as file:
+        json.dump({name: float(weights_dict[name]) for name in WEIGHT_NAMES}, file, indent=2)
+        file.write('\n')
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Optimise the objective weighting's weights.")
+    parser.add_argument('test_set', nargs='?', default='test_set1', help="test set of the test route file")
+    parser.add_argument('--strategy', choices=STRATEGIES, default='gp')
+    parser.add_argument('--n-calls', type=int, default=N_CALLS, help="candidate weights to evaluate")
+    parser.add_argument('--n-pairs', type=int, default=None, help="only the first N pairs of the set")
+    parser.add_argument('--workers', type=int, default=None, help="worker processes (default: all cores)")
+    parser.add_argument('--batch-size', type=int, default=None, help="candidates per batch (default: workers)")
+    parser.add_argument('--seed', type=int, default=SEED)
+    parser.add_argument('--test-routes', default=TEST_ROUTES_FILE)
+    parser.add_argument('--weights-file', default=WEIGHTS_FILE)
+    parser.add_argument('--memo-file', default=rm.ROUTE_MEMO_FILE, help="route result memo, reused across runs")
+    parser.add_argument('--no-write', action='store_true', help="don't write the best weights to the weights file")
+    args = parser.parse_args(argv)
+
+    with open(args.test_routes, 'r') as file:
+        pairs = json.load(file)[args.test_set][:args.n_pairs]
+    result = optimise(
+        pairs, args.strategy, args.n_calls, args.seed, args.workers, args.batch_size,
+        weights_file=args.weights_file, memo_file=args.memo_file
+    )
+    start_objective = result['start']['objective']
+    print(f"Start objective: {start_objective}")
+    print(f"Best objective: {result['objective']} "
+          f"({(start_objective - result['objective']) / start_objective * 100:.2f}% better)")
+    print(f"Best weights: {result['weights']}")
+    print(f"{result['cache']['candidates']} candidates, {result['cache']['routes_simulated']} routes "
+          f"simulated for {result['cache']['route_lookups']} route evaluations, {result['seconds']:.1f}s")
+    if not args.no_write and result['weights'] != result['start']['weights']:
+        write_weights(result['weights'], args.weights_file)
+        print(f"Best weights written to {args.weights_file}")
+
+
+if __name__ == '__main__':
+    main()
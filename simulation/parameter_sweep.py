@@ -0,0 +1,160 @@
+'''
+Parameter sweeps over a fixed set of routes.
+The routes' sections are packed into arrays once; every combination of the
+swept parameters then runs the vectorised energy model over all routes in one
+call (energy_consumption.calculate_route_energy) and the degradation model over
+all routes in another (battery_deg.capacity_loss). Incline multipliers scale
+the packed inclines directly, so no modified map files are written or read.
+Parameters that only affect ageing (Capacity, base_k, c_rate_exp) reuse the
+energy results of their combination instead of recomputing them.
+
+Results are tensors with one axis per swept parameter, in the order given,
+and a last axis over the routes.
+'''
+import itertools
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import models.vehicle_models.battery_deg as bd
+import models.vehicle_models.energy_consumption as ec
+import simulation.simulate_routes as sr
+
+VEHICLE_PARAMETERS = ('mass', 'drag_coeff', 'frontal_area', 'roll_res', 'motor_eff', 'max_speed')
+STATIC_PARAMETERS = ('air_dens', 'grav_acc')
+BATTERY_PARAMETERS = ('OCV', 'R_internal', 'Capacity')
+# Parameters of battery_deg.capacity_loss, with its defaults
+AGEING_PARAMETERS = {'base_k': 0.200, 'c_rate_exp': 0.2286}
+# Parameters that don't change the energy results
+AGEING_ONLY = ('Capacity',) + tuple(AGEING_PARAMETERS)
+SWEEP_PARAMETERS = ('incline_multiplier',) + VEHICLE_PARAMETERS + STATIC_PARAMETERS + BATTERY_PARAMETERS + tuple(AGEING_PARAMETERS)
+
+
+def pack_routes(route_dicts) -> dict:
+    '''
+    Concatenates the sections of every route (simulate_routes.route_section_arrays),
+    with reset set at the start of each route and starts/lengths locating
+    each route's sections. Routes without sections (a start == end pair, or
+    None where find_routes found no path) are kept as empty routes.
+    '''
+    sections = [sr.route_section_arrays(route_dict or {}) for route_dict in route_dicts]
+    lengths = np.array([len(route['distance']) for route in sections], dtype=np.int64)
+    packed = {
+        name: np.concatenate([route[name] for route in sections]) if sections else np.zeros(0)
+        for name in ('distance', 'avg_incline_angle', 'climb', 'reset')
+    }
+    packed['reset'] = packed['reset'].astype(bool)
+    packed['starts'] = np.concatenate(([0], np.cumsum(lengths)[:-1])).astype(np.int64)
+    packed['lengths'] = lengths
+    return packed
+
+
+def _route_sums(values: np.ndarray, packed: dict) -> np.ndarray:
+    sums = np.zeros(len(packed['lengths']))
+    has_sections = packed['lengths'] > 0
+    if has_sections.any():
+        sums[has_sections] = np.add.reduceat(values, packed['starts'][has_sections])
+    return sums
+
+
+def _energy_combination(packed: dict, parameters: dict, vehicle_data: dict, static_data: dict, battery_data: dict) -> dict:
+    # Section energy results for one combination of the energy parameters
+    vehicle_data = {**vehicle_data, **{name: parameters[name] for name in VEHICLE_PARAMETERS if name in parameters}}
+    static_data = {**static_data, **{name: parameters[name] for name in STATIC_PARAMETERS if name in parameters}}
+    battery_data = {**battery_data, **{name: parameters[name] for name in BATTERY_PARAMETERS if name in parameters}}
+    OCV = battery_data["OCV"]
+    R_i = battery_data["R_internal"]
+    max_motor_power = OCV**2 / (4*R_i)
+    return ec.calculate_route_energy(
+        packed['distance'], packed['avg_incline_angle'] * parameters.get('incline_multiplier', 1.0), packed['reset'],
+        vehicle_data["max_speed"], vehicle_data, static_data, max_motor_power, vehicle_data["motor_eff"],
+        OCV, R_i, battery_data["Capacity"]
+    )
+
+
+def _sweep_block(packed: dict, energy_combinations: list, ageing_combinations: list,
+                 vehicle_data: dict, static_data: dict, battery_data: dict) -> tuple:
+    # consumption and capacity_loss, energy combinations x ageing combinations x routes
+    n_routes = len(packed['lengths'])
+    consumption = np.empty((len(energy_combinations), n_routes))
+    capacity_loss = np.empty((len(energy_combinations), len(ageing_combinations), n_routes))
+    split = packed['starts'][1:]
+    for i, parameters in enumerate(energy_combinations):
+        results = _energy_combination(packed, parameters, vehicle_data, static_data, battery_data)
+        consumption[i] = _route_sums(results['energy'], packed)
+        current = np.split(results['current'], split)
+        energy = np.split(results['energy'], split)
+        time = np.split(results['time'], split)
+        OCV = parameters.get('OCV', battery_data["OCV"])
+        for j, ageing in enumerate(ageing_combinations):
+            capacity_loss[i, j] = bd.capacity_loss(
+                current, energy, time, OCV, ageing.get('Capacity', battery_data["Capacity"]),
+                ageing.get('base_k', AGEING_PARAMETERS['base_k']),
+                ageing.get('c_rate_exp', AGEING_PARAMETERS['c_rate_exp']),
+            )
+    return consumption, capacity_loss
+
+
+def sweep(routes, vehicle_data: dict, static_data: dict, battery_data: dict, grid: dict, workers: int = None) -> dict:
+    '''
+    Consumption and capacity loss of every route for every combination of the
+    parameter values in grid, {parameter: values}. Parameters are those of
+    SWEEP_PARAMETERS: incline_multiplier scales every section's incline,
+    vehicle/static/battery parameters override the given data, and base_k /
+    c_rate_exp are passed to battery_deg.capacity_loss. Parameters not in grid
+    keep their values from the data (or the capacity_loss defaults).
+
+    routes: route_dicts (e.g. from simulate_routes.find_routes) or pack_routes output.
+        Empty routes get 0 consumption and capacity loss.
+    workers: split the energy combinations across that many processes
+
+    Returns:
+    axes: {parameter: values}, in grid order
+    consumption: energy (Wh), shape (*len(values) for each axis, routes)
+    capacity_loss: battery_deg.capacity_loss at the start of each route (Ah), same shape
+    distance: (routes,) route distances (m)
+    '''
+    unknown = [name for name in grid if name not in SWEEP_PARAMETERS]
+    if unknown:
+        raise ValueError(f"Unknown sweep parameters {unknown}, expected some of {SWEEP_PARAMETERS}")
+    packed = routes if isinstance(routes, dict) else pack_routes(routes)
+    axes = {name: np.asarray(values) for name, values in grid.items()}
+    energy_names = [name for name in axes if name not in AGEING_ONLY]
+    ageing_names = [name for name in axes if name in AGEING_ONLY]
+    energy_combinations = [
+        dict(zip(energy_names, (value.item() for value in values)))
+        for values in itertools.product(*(axes[name] for name in energy_names))
+    ]
+    ageing_combinations = [
+        dict(zip(ageing_names, (value.item() for value in values)))
+        for values in itertools.product(*(axes[name] for name in ageing_names))
+    ]
+
+    data = (vehicle_data, static_data, battery_data)
+    if not workers or workers <= 1 or len(energy_combinations) < 2:
+        consumption, capacity_loss = _sweep_block(packed, energy_combinations, ageing_combinations, *data)
+    else:
+        blocks = [list(block) for block in np.array_split(np.arange(len(energy_combinations)), min(workers, len(energy_combinations)))]
+        with ProcessPoolExecutor(max_workers=len(blocks)) as executor:
+            futures = [
+                executor.submit(_sweep_block, packed, [energy_combinations[i] for i in block], ageing_combinations, *data)
+                for block in blocks
+            ]
+            parts = [future.result() for future in futures]
+        consumption = np.concatenate([part[0] for part in parts])
+        capacity_loss = np.concatenate([part[1] for part in parts])
+
+    # Back to one axis per parameter, in grid order
+    n_routes = len(packed['lengths'])
+    energy_shape = [len(axes[name]) for name in energy_names]
+    ageing_shape = [len(axes[name]) for name in ageing_names]
+    order = [(energy_names + ageing_names).index(name) for name in axes]
+    consumption = np.broadcast_to(
+        consumption.reshape(energy_shape + [1] * len(ageing_shape) + [n_routes]),
+        energy_shape + ageing_shape + [n_routes],
+    )
+    capacity_loss = capacity_loss.reshape(energy_shape + ageing_shape + [n_routes])
+    return {
+        'axes': axes,
+        'consumption': np.ascontiguousarray(consumption.transpose(order + [len(order)])),
+        'capacity_loss': np.ascontiguousarray(capacity_loss.transpose(order + [len(order)])),
+        'distance': _route_sums(packed['distance'], packed),
+    }
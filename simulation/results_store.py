@@ -0,0 +1,236 @@
+'''
+Append-only store for simulation results.
+A store is a directory holding
+    summaries.jsonl: one line per route with everything but the per-section
+        lists (totals, capacity loss, errors) and where its arrays are
+    arrays_NNNNN.npz: the per-section lists of a chunk of routes, one
+        concatenated array per test and field plus per-route offsets
+    detailed.jsonl: detailed_results, only for records that carry them
+Routes are buffered into chunks of chunk_size; each chunk's arrays are written
+before its summary lines, so every summary on disk points at arrays that
+exist. Readers can load the summaries alone, or only the fields they need from
+the array files. An interrupted run keeps every completed chunk and resumes
+after it.
+'''
+import glob
+import json
+import os
+import numpy as np
+
+SUMMARIES_FILE = 'summaries.jsonl'
+DETAILED_FILE = 'detailed.jsonl'
+# Per-section lists of a record's test entries, stored in the array files
+ARRAY_FIELDS = ('current_list', 'consumptions', 'times', 'distances', 'climbs')
+# Routes per array file
+CHUNK_SIZE = 64
+
+
+def _array_file(path: str, chunk: int) -> str:
+    return os.path.join(path, f'arrays_{chunk:05d}.npz')
+
+
+def _drop_partial_line(file_path: str):
+    # Cuts a partly written last line, left by an interrupted run, so appends start on a new line
+    if not os.path.exists(file_path):
+        return
+    with open(file_path, 'rb+') as file:
+        file.seek(0, os.SEEK_END)
+        size = file.tell()
+        position = size
+        while position > 0:
+            step = min(position, 1 << 16)
+            file.seek(position - step)
+            newline = file.read(step).rfind(b'\n')
+            if newline >= 0:
+                position = position - step + newline + 1
+                break
+            position -= step
+        if position != size:
+            file.truncate(position)
+
+
+def _read_lines(file_path: str):
+    if not os.path.exists(file_path):
+        return
+    with open(file_path, 'r') as file:
+        for line in file:
+            try:
+                yield json.loads(line)
+            except ValueError:
+                # A partly written last line
+                continue
+
+
+class ResultsWriter:
+    '''
+    Appends records to a store, e.g. the per-pair records of
+    batch_runner.simulate_chunk: {'index': i, ..., test: {field: value}}.
+    Test entries are the dict values of a record; their ARRAY_FIELDS go to the
+    array files, their detailed_results to detailed.jsonl and everything else
+    to the summary. Every record needs a unique 'index'.
+
+    With resume=True (default) an existing store is continued: completed
+    holds the indices already written. Use as a context manager, or call
+    close() to write the last partial chunk.
+    '''
+
+    def __init__(self, path: str, chunk_size: int = CHUNK_SIZE, resume: bool = True):
+        self.path = path
+        self.chunk_size = chunk_size
+        self.buffer = []
+        os.makedirs(path, exist_ok=True)
+        summaries_file = os.path.join(path, SUMMARIES_FILE)
+        detailed_file = os.path.join(path, DETAILED_FILE)
+        if not resume:
+            for old in [summaries_file, detailed_file] + glob.glob(os.path.join(path, 'arrays_*.npz')):
+                if os.path.exists(old):
+                    os.remove(old)
+
+        _drop_partial_line(summaries_file)
+        _drop_partial_line(detailed_file)
+        summaries = list(_read_lines(summaries_file))
+        self.completed = {summary['index'] for summary in summaries}
+        # Array files past the last summarised chunk were never summarised and are overwritten
+        self.next_chunk = max((summary['chunk'] for summary in summaries), default=-1) + 1
+        self._summaries = open(summaries_file, 'a')
+        self._detailed = open(detailed_file, 'a')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def append(self, record: dict):
+        self.buffer.append(record)
+        if len(self.buffer) >= self.chunk_size:
+            self.flush()
+
+    def flush(self):
+        '''
+        Writes the buffered records: their arrays, then their detailed results
+        and summaries.
+        '''
+        if not self.buffer:
+            return
+        chunk = self.next_chunk
+        tests = sorted({
+            key for record in self.buffer for key, value in record.items()
+            if isinstance(value, dict) and key != 'error'
+        })
+
+        arrays = {}
+        for test in tests:
+            for field in ARRAY_FIELDS:
+                values = [np.asarray(record.get(test, {}).get(field, ()), dtype=float) for record in self.buffer]
+                arrays[f'{test}/{field}'] = np.concatenate(values) if values else np.zeros(0)
+                arrays[f'{test}/{field}_offsets'] = np.concatenate(([0], np.cumsum([len(value) for value in values])))
+        # Written under a temporary name so a half-written chunk is never picked up
+        temp_path = _array_file(self.path, chunk) + '.tmp.npz'
+        np.savez(temp_path, **arrays)
+        os.replace(temp_path, _array_file(self.path, chunk))
+
+        for row, record in enumerate(self.buffer):
+            summary = {'chunk': chunk, 'row': row}
+            detailed = {}
+            for key, value in record.items():
+                if key in tests:
+                    summary[key] = {
+                        name: item for name, item in value.items()
+                        if name not in ARRAY_FIELDS and name != 'detailed_results'
+                    }
+                    if 'detailed_results' in value:
+                        detailed[key] = value['detailed_results']
+                else:
+                    summary[key] = value
+            if detailed:
+                self._detailed.write(json.dumps({'index': record['index'], **detailed}) + '\n')
+            self._summaries.write(json.dumps(summary) + '\n')
+            self.completed.add(record['index'])
+        self._detailed.flush()
+        self._summaries.flush()
+        self.buffer = []
+        self.next_chunk += 1
+
+    def close(self):
+        self.flush()
+        self._summaries.close()
+        self._detailed.close()
+
+
+def read_summaries(path: str) -> list:
+    '''
+    Summary of every completed route, in index order.
+    '''
+    return sorted(_read_lines(os.path.join(path, SUMMARIES_FILE)), key=lambda summary: summary['index'])
+
+
+def read_arrays(path: str, fields=ARRAY_FIELDS, tests=None, indices=None) -> dict:
+    '''
+    Per-section arrays, {index: {test: {field: array}}}, loading only the
+    requested fields (and tests), and only the array files holding the
+    requested indices.
+    '''
+    wanted = None if indices is None else set(indices)
+    by_chunk = {}
+    for summary in read_summaries(path):
+        if wanted is None or summary['index'] in wanted:
+            by_chunk.setdefault(summary['chunk'], []).append(summary)
+
+    arrays = {}
+    for chunk, summaries in by_chunk.items():
+        with np.load(_array_file(path, chunk)) as data:
+            chunk_tests = sorted({name.split('/')[0] for name in data.files})
+            columns = {}
+            for test in chunk_tests if tests is None else [test for test in tests if test in chunk_tests]:
+                for field in fields:
+                    columns[(test, field)] = (data[f'{test}/{field}'], data[f'{test}/{field}_offsets'])
+        for summary in summaries:
+            row = summary['row']
+            route = arrays.setdefault(summary['index'], {})
+            for (test, field), (values, offsets) in columns.items():
+                route.setdefault(test, {})[field] = values[offsets[row]:offsets[row + 1]]
+    return arrays
+
+
+def read_detailed(path: str, indices=None) -> dict:
+    '''
+    detailed_results of the records that stored them, {index: {test: detailed_results}}.
+    '''
+    wanted = None if indices is None else set(indices)
+    return {
+        line.pop('index'): line
+        for line in _read_lines(os.path.join(path, DETAILED_FILE))
+        if wanted is None or line['index'] in wanted
+    }
+
+
+def read_records(path: str, fields=ARRAY_FIELDS, detailed: bool = False) -> list:
+    '''
+    Full records in index order: each summary with its arrays (as lists) put
+    back into its test entries, plus detailed_results if detailed.
+    '''
+    summaries = read_summaries(path)
+    arrays = read_arrays(path, fields)
+    details = read_detailed(path) if detailed else {}
+    records = []
+    for summary in summaries:
+        record = {key: value for key, value in summary.items() if key not in ('chunk', 'row')}
+        for test, columns in arrays.get(summary['index'], {}).items():
+            if record.get(test):
+                record[test] = {**record[test], **{field: values.tolist() for field, values in columns.items()}}
+        for test, detailed_results in details.get(summary['index'], {}).items():
+            record[test]['detailed_results'] = detailed_results
+        records.append(record)
+    return records
+
+
+def to_sim_results(path: str, detailed: bool = False) -> dict:
+    '''
+    The store as the single route simulation's JSON dict, {sim: record}, for
+    the notebook analysis code.
+    '''
+    return {
+        record.pop('sim', f"sim{record['index'] + 1}"): record
+        for record in read_records(path, detailed=detailed)
+    }
@@ -0,0 +1,190 @@
+'''
+Persistent memo of route simulation results.
+Different weightings, and most optimiser candidates, keep returning the same
+node sequences, and each one would otherwise be reassembled with
+find_spec_route and simulated again. RouteEnergyMemo keeps the result of a
+route (batch_runner.route_record: totals, capacity loss and per-section
+currents, consumptions and times) in an LRU keyed by
+    (node tuple, parameter_hash of the vehicle, static and battery data)
+The hash also covers the map: batch_runner.map_hash, the content hash of
+the edge CSV and map JSON. It is not the snapshot, which is rebuilt (with
+a new EdgeIndex version) whenever weights.json changes, and routes don't
+depend on that file. Once the loaded map is changed in memory
+(map_updates.apply_map_update) the new EdgeIndex version is used instead,
+so results of a changed map are never reused.
+
+With a file the memo is backed by a JSON lines log: every new result is
+appended as it is stored, and the log is loaded again (most recent last) by
+the next session. The log is rewritten with only the live entries, in LRU
+order, once it holds more than twice maxsize lines, or on compact().
+'''
+import hashlib
+import json
+import os
+from collections import OrderedDict
+import simulation.batch_runner as br
+import simulation.results_store as rs
+import simulation.simulate_routes as sr
+
+# Entries kept by default
+ROUTE_MEMO_SIZE = 20000
+ROUTE_MEMO_FILE = os.path.join(os.path.dirname(__file__), 'cache', 'route_memo.jsonl')
+# Bump when the energy or degradation models change, so stored results are not reused
+MEMO_VERSION = 1
+
+
+def parameter_hash(vehicle_data: dict, static_data: dict, battery_data: dict, map_version: str = None) -> str:
+    '''
+    Stable digest of the parameters a route's results depend on (the same in
+    every process and session, unlike hash()).
+    '''
+    parameters = (
+        MEMO_VERSION, tuple(sorted(vehicle_data.items())), tuple(sorted(static_data.items())),
+        tuple(sorted(battery_data.items())), map_version,
+    )
+    return hashlib.sha1(repr(parameters).encode()).hexdigest()
+
+
+def context_hash(context: dict) -> str:
+    '''
+    parameter_hash of a batch_runner.load_context context.
+    '''
+    map_version = context['edge_index'].version
+    if context.get('map_version') == map_version:
+        map_version = context['map_hash']
+    return parameter_hash(context['vehicle_data'], context['static_data'], context['battery_data'], map_version)
+
+
+def simulate_path(nodes, context: dict) -> dict:
+    '''
+    batch_runner.route_record of the route through nodes.
+    '''
+    route_dict = sr.find_spec_route(list(nodes), context['map_data'], context['graph'], edge_index=context['edge_index'])
+    return br.route_record(route_dict, context)
+
+
+class RouteEnergyMemo:
+    '''
+    LRU memo of route results keyed by node sequence and parameter hash (see
+    the module docstring), optionally backed by file. hits, misses and
+    evictions count this session's lookups; see stats(). Use as a context
+    manager, or call close() when backed by a file.
+    '''
+
+    def __init__(self, file_path: str = None, maxsize: int = ROUTE_MEMO_SIZE):
+        self.file_path = file_path
+        self.maxsize = maxsize
+        self._cache = OrderedDict()
+        self._file = None
+        self._file_lines = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        if file_path is not None:
+            os.makedirs(os.path.dirname(os.path.abspath(file_path)), exist_ok=True)
+            rs._drop_partial_line(file_path)
+            for line in rs._read_lines(file_path):
+                key = (tuple(line['nodes']), line['parameters'])
+                self._cache.pop(key, None)
+                self._cache[key] = line['result']
+                self._file_lines += 1
+            while len(self._cache) > maxsize:
+                self._cache.popitem(last=False)
+            self._file = open(file_path, 'a')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __len__(self):
+        return len(self._cache)
+
+    def __contains__(self, key):
+        nodes, parameters = key
+        return (tuple(nodes), parameters) in self._cache
+
+    def get(self, nodes, parameters: str):
+        '''
+        Stored result of the route through nodes, or None.
+        '''
+        key = (tuple(nodes), parameters)
+        result = self._cache.get(key)
+        if result is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._cache.move_to_end(key)
+        return result
+
+    def put(self, nodes, parameters: str, result: dict):
+        key = (tuple(nodes), parameters)
+        self._cache.pop(key, None)
+        self._cache[key] = result
+        if len(self._cache) > self.maxsize:
+            self._cache.popitem(last=False)
+            self.evictions += 1
+        if self._file is not None:
+            self._file.write(json.dumps({'nodes': list(key[0]), 'parameters': parameters, 'result': result}) + '\n')
+            self._file_lines += 1
+            if self._file_lines > 2 * self.maxsize:
+                self.compact()
+
+    def lookup(self, nodes, context: dict, parameters: str = None) -> dict:
+        '''
+        Result of the route through nodes for a batch_runner context,
+        simulated and stored on a miss. Pass parameters (context_hash(context))
+        to skip hashing the context on every call.
+        '''
+        parameters = context_hash(context) if parameters is None else parameters
+        result = self.get(nodes, parameters)
+        if result is None:
+            result = simulate_path(nodes, context)
+            self.put(nodes, parameters, result)
+        return result
+
+    def flush(self):
+        if self._file is not None:
+            self._file.flush()
+
+    def compact(self):
+        '''
+        Rewrites the backing file with only the live entries, least recently
+        used first.
+        '''
+        if self.file_path is None:
+            return
+        was_open = self._file is not None
+        self.close()
+        temp_path = self.file_path + '.tmp'
+        with open(temp_path, 'w') as file:
+            for (nodes, parameters), result in self._cache.items():
+                file.write(json.dumps({'nodes': list(nodes), 'parameters': parameters, 'result': result}) + '\n')
+        os.replace(temp_path, self.file_path)
+        self._file_lines = len(self._cache)
+        if was_open:
+            self._file = open(self.file_path, 'a')
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'size': len(self._cache),
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+        }
+
+    def clear(self):
+        '''
+        Empties the memo and its backing file.
+        '''
+        self._cache.clear()
+        self.hits = self.misses = self.evictions = 0
+        self.compact()
@@ -0,0 +1,214 @@
+'''
+Compact route results.
+RouteResult holds the per-section output of the vectorised energy model as
+columns instead of the nested detailed_results dicts, and builds those dicts
+only on access, so batch runs keep and serialise a handful of arrays per route.
+'''
+import sys
+from collections.abc import Mapping
+import numpy as np
+import models.vehicle_models.energy_consumption as ec
+
+# One record per section: route data plus the calculate_sections_energy columns
+SECTION_DTYPE = np.dtype([
+    ('path', np.int32), ('distance', float), ('climb', float), ('mode', np.int8),
+    ('initial_velocity', float), ('final_velocity', float), ('acceleration', float),
+    ('time', float), ('energy', float), ('reached_target', bool),
+    ('current', float), ('c_rate', float), ('avg_current', float), ('avg_c_rate', float),
+])
+PHASE_COLUMNS = ('distance', 'time', 'energy', 'current', 'c_rate')
+PHASE_PREFIXES = {'acceleration_phase': 'accel_', 'constant_phase': 'const_'}
+# One record per two-phase section: its position and both phases
+PHASE_DTYPE = np.dtype([('section', np.int64)] + [
+    (prefix + name, float) for prefix in PHASE_PREFIXES.values() for name in PHASE_COLUMNS
+])
+
+
+class RouteResult:
+    '''
+    Result of return_route_data_complex(..., compact=True).
+
+    sections: structured array (SECTION_DTYPE), one record per section in route
+        order, with its path (index into path_keys), distance, climb and the
+        energy_consumption.calculate_sections_energy results
+    phases: structured array (PHASE_DTYPE) of the acceleration/constant phases,
+        only for the two-phase sections
+    section_names: section keys, in route order
+
+    Unpacks and indexes like the tuple from return_route_data_complex:
+    (total_distance, total_consumption, total_climb, detailed_results,
+    current_list, climbs, distances, consumptions), where detailed_results is
+    a read-only lazy view (see detailed_results).
+    '''
+    __slots__ = ('path_keys', 'section_names', 'sections', 'phases')
+
+    def __init__(self, sections: dict, results: dict):
+        self.path_keys = list(sections['path_keys'])
+        # Interned so the repeated "sectionN" names are stored and pickled once
+        self.section_names = [sys.intern(name) for name in sections['section_names']]
+
+        self.sections = np.empty(len(self.section_names), dtype=SECTION_DTYPE)
+        self.sections['path'] = sections['section_path']
+        self.sections['distance'] = sections['distance']
+        self.sections['climb'] = sections['climb']
+        for name in SECTION_DTYPE.names[3:]:
+            self.sections[name] = results[name]
+
+        phase_index = np.flatnonzero(results['mode'] == ec.MODE_TWO_PHASE)
+        self.phases = np.empty(len(phase_index), dtype=PHASE_DTYPE)
+        self.phases['section'] = phase_index
+        for name in PHASE_DTYPE.names[1:]:
+            self.phases[name] = results[name][phase_index]
+
+    def __getstate__(self):
+        return {name: getattr(self, name) for name in self.__slots__}
+
+    def __setstate__(self, state):
+        for name, value in state.items():
+            setattr(self, name, value)
+
+    def __len__(self):
+        return 8
+
+    def __iter__(self):
+        return iter(self.to_tuple())
+
+    def __getitem__(self, item):
+        return self.to_tuple()[item]
+
+    @property
+    def total_distance(self) -> float:
+        return float(self.sections['distance'].sum())
+
+    @property
+    def total_consumption(self) -> float:
+        return float(self.sections['energy'].sum())
+
+    @property
+    def total_climb(self) -> float:
+        return float(self.sections['climb'].sum())
+
+    @property
+    def distances(self) -> np.ndarray:
+        return self.sections['distance']
+
+    @property
+    def climbs(self) -> np.ndarray:
+        return self.sections['climb']
+
+    @property
+    def consumptions(self) -> np.ndarray:
+        return self.sections['energy']
+
+    @property
+    def currents(self) -> np.ndarray:
+        return self.sections['current']
+
+    @property
+    def times(self) -> np.ndarray:
+        return self.sections['time']
+
+    @property
+    def detailed_results(self) -> 'DetailedResultsView':
+        '''
+        Lazy read-only view with the layout of return_route_data_complex's
+        detailed_results: {path_key: {section_name: {...}}, 'summary': {...}}.
+        Use to_dict() for a plain dict, e.g. to save it as JSON.
+        '''
+        return DetailedResultsView(self)
+
+    def summary(self) -> dict:
+        total_distance = self.total_distance
+        total_consumption = self.total_consumption
+        total_climb = self.total_climb
+        return {
+            "total_distance": total_distance,
+            "total_consumption": total_consumption,
+            "total_climb": total_climb,
+            "wh_per_km": (total_consumption / total_distance * 1000) if total_distance > 0 else 0,
+            "wh_per_climb_m": (total_consumption / total_climb) if total_climb > 0 else 0,
+            "current_list": self.currents.tolist(),
+            "climb_list": self.climbs.tolist(),
+            "distance_list": self.distances.tolist(),
+        }
+
+    def section(self, i: int) -> dict:
+        '''
+        detailed_results entry of section i, as built by return_route_data_complex.
+        '''
+        record = self.sections[i].item()
+        values = dict(zip(SECTION_DTYPE.names, record))
+        result = {
+            name: values[name]
+            for name in ('energy', 'distance', 'climb', 'initial_velocity', 'final_velocity', 'acceleration', 'time')
+        }
+        if values['mode'] == ec.MODE_TWO_PHASE:
+            j = int(np.searchsorted(self.phases['section'], i))
+            phase_values = dict(zip(PHASE_DTYPE.names, self.phases[j].item()))
+            result["peak_current"] = values['current']
+            result["peak_c_rate"] = values['c_rate']
+            result["avg_current"] = values['avg_current']
+            result["avg_c_rate"] = values['avg_c_rate']
+            for phase, prefix in PHASE_PREFIXES.items():
+                result[phase] = {
+                    "distance": phase_values[prefix + 'distance'],
+                    "time": phase_values[prefix + 'time'],
+                    "energy": phase_values[prefix + 'energy'],
+                    "discharge_current": phase_values[prefix + 'current'],
+                    "c_rate": phase_values[prefix + 'c_rate'],
+                }
+        else:
+            result["current"] = values['current']
+            result["c_rate"] = values['c_rate']
+        result["reached_target"] = values['reached_target']
+        return result
+
+    def to_dict(self) -> dict:
+        '''
+        detailed_results as plain nested dicts.
+        '''
+        detailed_results = {path: {} for path in self.path_keys}
+        for i, (path_index, section_name) in enumerate(zip(self.sections['path'].tolist(), self.section_names)):
+            detailed_results[self.path_keys[path_index]][section_name] = self.section(i)
+        detailed_results["summary"] = self.summary()
+        return detailed_results
+
+    def to_tuple(self, lazy: bool = True) -> tuple:
+        '''
+        The return_route_data_complex tuple. detailed_results is the lazy view,
+        or plain dicts with lazy=False.
+        '''
+        detailed_results = self.detailed_results if lazy else self.to_dict()
+        return (
+            self.total_distance, self.total_consumption, self.total_climb, detailed_results,
+            self.currents.tolist(), self.climbs.tolist(), self.distances.tolist(), self.consumptions.tolist(),
+        )
+
+
+class DetailedResultsView(Mapping):
+    '''
+    detailed_results of a RouteResult, building each path's section dicts on access.
+    '''
+
+    def __init__(self, result: RouteResult):
+        self.result = result
+        self._paths = {path: i for i, path in enumerate(result.path_keys)}
+
+    def __len__(self):
+        return len(self._paths) + 1
+
+    def __iter__(self):
+        yield from self._paths
+        yield "summary"
+
+    @property
+    def times(self) -> np.ndarray:
+        # Section times in route order, read by battery_deg.route_analysis
+        return self.result.times
+
+    def __getitem__(self, key):
+        if key == "summary":
+            return self.result.summary()
+        path_index = self._paths[key]
+        start, end = np.searchsorted(self.result.sections['path'], [path_index, path_index + 1])
+        return {self.result.section_names[i]: self.result.section(i) for i in range(start, end)}
@@ -1,8 +1,11 @@
 import models.road_network.create_graph as cg
 import models.vehicle_models.energy_consumption as ec
 import models.weighting.weight_integration as wi
+from models.road_network.edge_index import get_edge_index
+from simulation.route_result import RouteResult
 import json
 import math
+import numpy as np
 import pandas as pd
 import random
 from pprint import pprint
@@ -29,13 +32,17 @@ def find_random_route(map_data:dict, road_df:dict, graph, plot = False, weights_
 
     return route_dict
 
-def find_route(map_data:dict, road_df:dict, graph, start_node: int, end_node: int, weights_dict, plot = False, weights_type= 'default', debug = False):
+def find_route(map_data:dict, road_df:dict, graph, start_node: int, end_node: int, weights_dict, plot = False, weights_type= 'default', debug = False, edge_index = None, engine = 'networkx'):
     '''
     Takes in a overall map, road and graph, simulates a specific route and returns data for that route.
+    edge_index: EdgeIndex over map_data, built once when the map loads. Built here if not given.
+    engine: shortest-path engine, see create_graph.shortest_path
     '''
-    G = wi.add_weights_to_graph(graph, map_data, weights_dict, weights_type)
+    if edge_index is None:
+        edge_index = get_edge_index(map_data)
+    G = wi.get_weighted_graph(graph, map_data, weights_dict, weights_type, edge_index=edge_index)
     
-    route = cg.dijkstra(G, start_node, end_node)
+    route = cg.shortest_path(G, start_node, end_node, engine)
     route_dict = {}
     missing_segments = []
     
@@ -43,7 +50,7 @@ def find_route(map_data:dict, road_df:dict, graph, start_node: int, end_node: in
         current_node = route[i]
         next_node = route[i + 1]
         
-        path = cg.find_path_with_nodes(map_data, current_node, next_node)
+        path = cg.find_path_with_nodes(map_data, current_node, next_node, edge_index)
         
         if not path:  # If no path found between these nodes
             missing_segments.append((current_node, next_node))
@@ -70,7 +77,9 @@ def find_route(map_data:dict, road_df:dict, graph, start_node: int, end_node: in
     
     return route_dict
 
-def find_spec_route(route, map_data, graph, plot = False, debug = False ):
+def find_spec_route(route, map_data, graph, plot = False, debug = False, edge_index = None):
+    if edge_index is None:
+        edge_index = get_edge_index(map_data)
     route_dict = {}
     missing_segments = []
     
@@ -78,7 +87,7 @@ def find_spec_route(route, map_data, graph, plot = False, debug = False ):
         current_node = route[i]
         next_node = route[i + 1]
         
-        path = cg.find_path_with_nodes(map_data, current_node, next_node)
+        path = cg.find_path_with_nodes(map_data, current_node, next_node, edge_index)
         
         if not path:  # If no path found between these nodes
             missing_segments.append((current_node, next_node))
@@ -105,8 +114,134 @@ def find_spec_route(route, map_data, graph, plot = False, debug = False ):
     
     return route_dict
 
+def find_routes(map_data:dict, road_df:dict, graph, pairs, weights_dict, weights_type= 'default', edge_index = None, engine = 'csr',
+                router = None):
+    '''
+    Batch version of find_route for a list of (start_node, end_node) pairs.
+    Pairs sharing a start node are routed from one single-source search
+    (see create_graph.shortest_paths). Returns one route_dict per pair, in
+    order, None where there is no path.
+    router: a CSRGraph or ContractionHierarchy already compiled for this
+    weighting, routed on instead of weighting graph (engine and weights_dict
+    are then unused)
+    '''
+    if edge_index is None:
+        edge_index = get_edge_index(map_data)
+    if router is not None:
+        routes = cg.compiled_shortest_paths(router, pairs)
+    else:
+        G = wi.get_weighted_graph(graph, map_data, weights_dict, weights_type, edge_index=edge_index)
+        routes = cg.shortest_paths(G, pairs, engine)
+    return [
+        None if route is None else find_spec_route(route, map_data, graph, edge_index=edge_index)
+        for route in routes
+    ]
+
+def route_distance(route_dict: dict) -> float:
+    '''
+    Total section distance of a route_dict.
+    '''
+    return sum(
+        data['distance']
+        for pathdata in route_dict.values()
+        for section, data in pathdata.items() if "section" in section
+    )
+
+def route_matrix(map_data:dict, road_df:dict, graph, origins, destinations, weights_dict, weights_type= 'default',
+                 vehicle_data = None, static_data = None, battery_data = None, edge_index = None, engine = 'csr') -> dict:
+    '''
+    Routes every origin to every destination, one search per origin. Returns:
+    routes: {(origin, destination): route_dict or None}
+    distance: len(origins) x len(destinations) array of route distances (m)
+    energy: same shape, route consumption (Wh) from return_route_data_complex,
+            only when vehicle_data, static_data and battery_data are given
+    Unreachable pairs are NaN in the matrices.
+    '''
+    pairs = [(origin, destination) for origin in origins for destination in destinations]
+    route_dicts = find_routes(map_data, road_df, graph, pairs, weights_dict, weights_type, edge_index, engine)
+    with_energy = vehicle_data is not None and static_data is not None and battery_data is not None
+
+    distance = np.full((len(origins), len(destinations)), np.nan)
+    energy = np.full((len(origins), len(destinations)), np.nan) if with_energy else None
+    routes = {}
+    for n, (pair, route_dict) in enumerate(zip(pairs, route_dicts)):
+        routes[pair] = route_dict
+        if route_dict is None:
+            continue
+        i, j = divmod(n, len(destinations))
+        distance[i, j] = route_distance(route_dict)
+        if with_energy:
+            energy[i, j] = return_route_data_complex(
+                route_dict, vehicle_data, static_data, vehicle_data["motor_eff"], battery_data
+            )[1]
+
+    result = {'routes': routes, 'distance': distance}
+    if with_energy:
+        result['energy'] = energy
+    return result
+
+def route_section_arrays(route_dict: dict) -> dict:
+    '''
+    Flattens a route_dict into per-section arrays for the vectorised energy model:
+    path_keys: route_dict path keys, in order
+    section_path: index into path_keys of each section
+    section_names: section keys
+    distance, avg_incline_angle, climb: section values
+    reset: True where the velocity drops to 0 before the section, i.e. the
+           first section of the route and of every path that isn't smooth
+    '''
+    path_keys = []
+    section_path = []
+    section_names = []
+    distance = []
+    incline = []
+    climb = []
+    reset = []
+    pending_reset = True  # Always start the first path from zero
+    for path_index, (path, pathdata) in enumerate(route_dict.items()):
+        path_keys.append(path)
+        if path_index > 0 and not pathdata.get("smooth", False):
+            pending_reset = True
+        for section, data in pathdata.items():
+            if "section" in section:
+                section_path.append(path_index)
+                section_names.append(section)
+                distance.append(data['distance'])
+                incline.append(data['avg_incline_angle'])
+                climb.append(data.get('climb', 0))
+                reset.append(pending_reset)
+                pending_reset = False
+
+    return {
+        'path_keys': path_keys,
+        'section_path': np.array(section_path, dtype=np.int64),
+        'section_names': section_names,
+        'distance': np.array(distance, dtype=float),
+        'avg_incline_angle': np.array(incline, dtype=float),
+        'climb': np.array(climb, dtype=float),
+        'reset': np.array(reset, dtype=bool),
+    }
+
+def route_energy_arrays(route_dict: dict, vehicle_data: dict, static_data: dict, motor_eff: float, battery_data: dict) -> tuple:
+    '''
+    Runs the vectorised energy model (energy_consumption.calculate_route_energy)
+    over a route, returns (sections, results) as per-section arrays.
+    '''
+    OCV = battery_data["OCV"]
+    R_i = battery_data["R_internal"]
+    Q = battery_data["Capacity"]
+    max_motor_power = OCV**2 / (4*R_i)
+
+    sections = route_section_arrays(route_dict)
+    results = ec.calculate_route_energy(
+        sections['distance'], sections['avg_incline_angle'], sections['reset'], vehicle_data["max_speed"],
+        vehicle_data, static_data, max_motor_power, motor_eff, OCV, R_i, Q
+    )
+    return sections, results
+
 def return_route_data_complex(route_dict: dict, vehicle_data: dict, static_data: dict, 
-                             motor_eff: float, battery_data: dict) -> tuple:
+                             motor_eff: float, battery_data: dict, vectorised: bool = False, compact: bool = False,
+                             memo = None) -> tuple:
     '''
     Analyses a route and returns consumption, distance, and climb data,
     incorporating acceleration models for more accurate energy estimation.
@@ -117,6 +252,13 @@ def return_route_data_complex(route_dict: dict, vehicle_data: dict, static_data:
     static_data (dict): Static environmental values
     motor_eff (float): Motor efficiency
     battery_data (dict): Battery parameters including OCV, internal resistance, and capacity
+    vectorised (bool): Compute all sections at once with the array energy model
+        (see route_energy_arrays); same results to floating point precision
+    compact (bool): Return a route_result.RouteResult (vectorised), which holds
+        the sections as columns and unpacks like the tuple below, with
+        detailed_results as a lazy read-only view
+    memo (segment_memo.SegmentEnergyMemo): look sections up in this memo
+        instead of recomputing them; share one across routes
     
     Returns:
     tuple: (total_distance, total_consumption, total_climb, detailed_results, current_list, climbs, distances, consumptions)
@@ -124,6 +266,10 @@ def return_route_data_complex(route_dict: dict, vehicle_data: dict, static_data:
     current_list, climb_list, and distance_list are lists of all discharge currents,
     climbs, and distances respectively
     '''
+    if vectorised or compact:
+        result = RouteResult(*route_energy_arrays(route_dict, vehicle_data, static_data, motor_eff, battery_data))
+        return result if compact else result.to_tuple(lazy=False)
+
     OCV = battery_data["OCV"]
     R_i = battery_data["R_internal"]
     Q = battery_data["Capacity"]
@@ -171,7 +317,8 @@ def return_route_data_complex(route_dict: dict, vehicle_data: dict, static_data:
             detailed_results[path][section_name] = {}
             
             # Process section with acceleration model
-            segment_result = ec.calculate_segment_energy_with_acceleration(
+            segment_energy = ec.calculate_segment_energy_with_acceleration if memo is None else memo
+            segment_result = segment_energy(
                 current_velocity, target_velocity, section_data,
                 vehicle_data, static_data, max_motor_power, motor_eff, OCV, R_i, Q
             )